@@ -0,0 +1,258 @@
+"""
+Async front tier for the Flask apps.
+
+The Flask apps are plain WSGI: a worker thread is held for the whole request,
+including the time spent receiving a multi-megabyte JSON/base64 upload from a
+slow client. `WSGIToASGI` wraps a WSGI app so that:
+
+1. request bodies are received asynchronously on the event loop (spooled to a
+   temporary file once they get large), without holding a compute thread;
+2. only fully received requests are dispatched to a bounded thread pool that
+   runs the (CPU-bound) Flask view;
+3. the response is sent back asynchronously, so slow downloads do not hold a
+   compute thread either. Responses without a Content-Length (server-sent
+   event streams) are forwarded chunk by chunk as the app yields them, and
+   closed as soon as the client disconnects. Their chunks are produced on a
+   separate stream pool: a stream mostly waits for its next event, and open
+   tabs must not take the compute threads.
+
+Run it with uvicorn through serve.py:
+
+    python serve.py cartilage --server uvicorn --workers 2 --threads 8
+"""
+import os
+import sys
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Bodies above this size are spooled to disk while they are being received
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+# Uploads above this size are rejected with 413
+DEFAULT_MAX_BODY_SIZE = 512 * 1024 * 1024
+# Threads for open streamed responses (the app caps open event streams itself)
+DEFAULT_STREAM_THREADS = 32
+# Marks the end of a streamed WSGI response
+_END = object()
+
+
+class WSGIToASGI:
+    """
+    Minimal ASGI adapter that runs a WSGI app on a dedicated executor.
+
+    Args:
+        wsgi_app: the Flask (or any WSGI) application
+        threads: number of compute threads running WSGI calls
+        max_body_size: largest accepted request body in bytes
+        on_startup: optional callable run once in the executor on ASGI lifespan startup
+        stream_threads: threads producing the chunks of streamed responses
+    """
+
+    def __init__(self, wsgi_app, threads=4, max_body_size=DEFAULT_MAX_BODY_SIZE, on_startup=None,
+                 stream_threads=DEFAULT_STREAM_THREADS):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.max_body_size = max_body_size
+        self.on_startup = on_startup
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self.stream_executor = ThreadPoolExecutor(max_workers=stream_threads, thread_name_prefix='wsgi-stream')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        # Websocket scopes are not handled by the WSGI apps
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.on_startup:
+                        await loop.run_in_executor(self.executor, self.on_startup)
+                    await send({'type': 'lifespan.startup.complete'})
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.stream_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        # 1. Receive the whole body without touching the compute pool
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body_size:
+                body.close()
+                await self._send_simple(send, 413, b'Request body too large')
+                return
+            if chunk:
+                body.write(chunk)
+            more_body = message.get('more_body', False)
+        body.seek(0)
+
+        # 2. Run the WSGI app on the executor
+        environ = self._build_environ(scope, body, size)
+        loop = asyncio.get_running_loop()
+        try:
+            status, headers, chunks, stream = await loop.run_in_executor(
+                self.executor, self._run_wsgi, environ
+            )
+        except Exception as e:
+            print(f"ASGI bridge error: {e}")
+            await self._send_simple(send, 500, b'Internal Server Error')
+            return
+        finally:
+            body.close()
+
+        # 3. Send the response back asynchronously
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers
+        })
+        for chunk in chunks:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if stream is not None:
+            await self._send_stream(stream, receive, send)
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _send_stream(self, result, receive, send):
+        """
+        Forward a streamed response chunk by chunk: each chunk is produced on the
+        stream pool (never a compute thread) and sent as soon as it is ready. Stops at the end of the stream
+        or when the client disconnects, and closes the WSGI iterable.
+        """
+        loop = asyncio.get_running_loop()
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        iterator = iter(result)
+        try:
+            while not disconnected.is_set():
+                chunk = await loop.run_in_executor(self.stream_executor, next, iterator, _END)
+                if chunk is _END or disconnected.is_set():
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': bytes(chunk), 'more_body': True})
+        finally:
+            watcher.cancel()
+            if hasattr(result, 'close'):
+                try:
+                    await loop.run_in_executor(self.stream_executor, result.close)
+                except RuntimeError:
+                    result.close()  # stream pool already shut down: the server is stopping
+
+    def _run_wsgi(self, environ):
+        """
+        Call the WSGI app (runs on the executor). Returns (status, headers, chunks,
+        stream): responses with a Content-Length are fully materialised in `chunks`
+        and `stream` is None; otherwise `stream` is the WSGI iterable to forward.
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+            return lambda data: response.setdefault('written', []).append(data)
+
+        result = self.wsgi_app(environ, start_response)
+        # An app that defers start_response to its first chunk is materialised too
+        if 'status' in response and not any(name == b'content-length' for name, _ in response['headers']):
+            return response['status'], response['headers'], response.pop('written', []), result
+        try:
+            chunks = response.pop('written', []) + [bytes(c) for c in result]
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks, None
+
+    def _build_environ(self, scope, body, size):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for raw_name, raw_value in scope.get('headers', []):
+            name = raw_name.decode('latin-1').upper().replace('-', '_')
+            value = raw_value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'CONTENT_LENGTH':
+                continue
+            else:
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    @staticmethod
+    async def _send_simple(send, status, text):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(text)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': text})
+
+
+def create_app():
+    """
+    ASGI factory used by `serve.py --server uvicorn`.
+
+    Configuration comes from the environment because uvicorn re-imports the
+    factory in every worker process.
+    """
+    import serve
+
+    module = serve.load_app(os.environ.get('SERVE_APP', 'cartilage'))
+    load_detector = os.environ.get('LAZY_AI', '') != '1'
+    return WSGIToASGI(
+        module.app,
+        threads=int(os.environ.get('WEB_THREADS', 4)),
+        max_body_size=int(os.environ.get('MAX_BODY_SIZE', DEFAULT_MAX_BODY_SIZE)),
+        on_startup=lambda: serve.warm_up(module, load_detector=load_detector),
+        stream_threads=int(os.environ.get('STREAM_THREADS', DEFAULT_STREAM_THREADS))
+    )
@@ -0,0 +1,250 @@
+"""
+Admission control for the image analysis endpoints.
+
+Every /analyze call decodes a full-resolution image and allocates several
+HSV/float copies of it. Running an unbounded number of them at once makes the
+machine swap, so requests are admitted against a shared *pixel budget*: a
+request costs the pixel count of its image, waits in a FIFO queue while the
+budget is used up, and is rejected (HTTP 429 + Retry-After) when the queue is
+full or it has waited too long.
+"""
+import os
+import time
+import struct
+import threading
+from collections import deque
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Memory-aware semaphore with a bounded FIFO wait queue.
+
+    Args:
+        max_pixels: total pixels that may be processed concurrently
+        max_queue: maximum number of requests waiting for admission
+        max_wait: seconds a request may wait before it is rejected
+    """
+
+    def __init__(self, max_pixels, max_queue=16, max_wait=30.0):
+        self.max_pixels = int(max_pixels)
+        self.max_queue = int(max_queue)
+        self.max_wait = float(max_wait)
+
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._in_use = 0
+        self._in_flight = 0
+
+        # Metrics
+        self._admitted = 0
+        self._rejected = 0
+        self._peak_queue = 0
+        self._total_wait = 0.0
+        self._service_avg = 1.0  # exponential moving average of run time (s)
+
+    def _cost(self, pixels):
+        # An image larger than the whole budget may still run, but only on its own
+        return max(1, min(int(pixels), self.max_pixels))
+
+    def _retry_after(self):
+        queued = len(self._waiting)
+        slots = max(1, self._in_flight)
+        return max(1, int(round(self._service_avg * (queued + 1) / slots)))
+
+    def acquire(self, pixels):
+        """Block until `pixels` fit in the budget. Returns the reserved cost."""
+        cost = self._cost(pixels)
+        with self._cond:
+            can_run_now = not self._waiting and self._in_use + cost <= self.max_pixels
+            if len(self._waiting) >= self.max_queue and not can_run_now:
+                self._rejected += 1
+                raise AdmissionRejected("Server is busy: analysis queue is full", self._retry_after())
+
+            ticket = object()
+            self._waiting.append(ticket)
+            self._peak_queue = max(self._peak_queue, len(self._waiting))
+            start = time.monotonic()
+            deadline = start + self.max_wait
+            try:
+                # FIFO: only the head of the queue may take budget
+                while self._waiting[0] is not ticket or self._in_use + cost > self.max_pixels:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected += 1
+                        raise AdmissionRejected("Server is busy: timed out waiting for capacity",
+                                                self._retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                # The new head (if any) may now fit
+                self._cond.notify_all()
+
+            self._in_use += cost
+            self._in_flight += 1
+            self._admitted += 1
+            self._total_wait += time.monotonic() - start
+        return cost
+
+    def release(self, cost, service_time=None):
+        with self._cond:
+            self._in_use -= cost
+            self._in_flight -= 1
+            if service_time is not None:
+                self._service_avg = 0.8 * self._service_avg + 0.2 * service_time
+            self._cond.notify_all()
+
+    def admit(self, pixels):
+        """Context manager: `with controller.admit(h * w): ...`"""
+        return _Admission(self, pixels)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                'max_pixels': self.max_pixels,
+                'pixels_in_use': self._in_use,
+                'in_flight': self._in_flight,
+                'queue_depth': len(self._waiting),
+                'max_queue': self.max_queue,
+                'peak_queue_depth': self._peak_queue,
+                'admitted_total': self._admitted,
+                'rejected_total': self._rejected,
+                'avg_wait_s': round(self._total_wait / self._admitted, 4) if self._admitted else 0.0,
+                'avg_service_s': round(self._service_avg, 4)
+            }
+
+
+class _Admission:
+    def __init__(self, controller, pixels):
+        self.controller = controller
+        self.pixels = pixels
+        self.cost = None
+        self.start = None
+
+    def __enter__(self):
+        self.cost = self.controller.acquire(self.pixels)
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.controller.release(self.cost, time.monotonic() - self.start)
+        return False
+
+
+class StreamSlots:
+    """
+    Cap on concurrently open server-sent event streams.
+
+    An open stream holds a server thread for its whole life (a waitress or gunicorn
+    gthread thread, or a stream thread of asgi_bridge) while it mostly waits, so
+    a few dozen open tabs could take every thread and starve the analyses. Streams
+    beyond the cap are refused and their clients long-poll instead.
+
+    Args:
+        limit: maximum number of open streams
+    """
+
+    def __init__(self, limit):
+        self.limit = int(limit)
+        self._lock = threading.Lock()
+        self._open = 0
+        self._opened = 0
+        self._refused = 0
+
+    def acquire(self):
+        """Take a slot; returns its release function (safe to call twice), or None if all are taken."""
+        with self._lock:
+            if self._open >= self.limit:
+                self._refused += 1
+                return None
+            self._open += 1
+            self._opened += 1
+        released = []
+
+        def release():
+            with self._lock:
+                if not released:
+                    released.append(True)
+                    self._open -= 1
+        return release
+
+    def metrics(self):
+        with self._lock:
+            return {'limit': self.limit, 'open': self._open,
+                    'opened_total': self._opened, 'refused_total': self._refused}
+
+
+def image_dimensions(image_bytes):
+    """
+    Read (width, height) from a PNG, JPEG, BMP or TIFF header without decoding.
+    Returns None for formats/headers that cannot be parsed.
+    """
+    data = bytes(image_bytes[:64 * 1024])
+    try:
+        # PNG: IHDR is always the first chunk
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            w, h = struct.unpack('>II', data[16:24])
+            return w, h
+
+        # BMP: BITMAPINFOHEADER, height may be negative (top-down)
+        if data[:2] == b'BM':
+            w, h = struct.unpack('<ii', data[18:26])
+            return abs(w), abs(h)
+
+        # JPEG: walk the markers up to the first SOFn
+        if data[:2] == b'\xff\xd8':
+            i = 2
+            while i + 9 < len(data):
+                if data[i] != 0xFF:
+                    i += 1
+                    continue
+                marker = data[i + 1]
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    i += 2
+                    continue
+                length = struct.unpack('>H', data[i + 2:i + 4])[0]
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    h, w = struct.unpack('>HH', data[i + 5:i + 9])
+                    return w, h
+                i += 2 + length
+            return None
+
+        # TIFF: first IFD, ImageWidth (256) / ImageLength (257)
+        if data[:4] in (b'II*\x00', b'MM\x00*'):
+            endian = '<' if data[:2] == b'II' else '>'
+            ifd = struct.unpack(endian + 'I', data[4:8])[0]
+            count = struct.unpack(endian + 'H', data[ifd:ifd + 2])[0]
+            dims = {}
+            for n in range(count):
+                entry = data[ifd + 2 + n * 12: ifd + 14 + n * 12]
+                tag, typ = struct.unpack(endian + 'HH', entry[:4])
+                if tag in (256, 257):
+                    fmt = 'H' if typ == 3 else 'I'
+                    dims[tag] = struct.unpack(endian + fmt, entry[8:8 + struct.calcsize(fmt)])[0]
+            if 256 in dims and 257 in dims:
+                return dims[256], dims[257]
+    except (struct.error, IndexError):
+        return None
+    return None
+
+
+def streams_from_env():
+    """Event stream cap from MAX_EVENT_STREAMS (default 8; serve.py sets it from its thread counts)."""
+    return StreamSlots(int(os.environ.get('MAX_EVENT_STREAMS', 8)))
+
+
+def controller_from_env():
+    """Build the process-wide controller from ANALYZE_* environment variables."""
+    return AdmissionController(
+        max_pixels=float(os.environ.get('ANALYZE_PIXEL_BUDGET', 48e6)),
+        max_queue=int(os.environ.get('ANALYZE_MAX_QUEUE', 16)),
+        max_wait=float(os.environ.get('ANALYZE_MAX_WAIT', 30))
+    )
@@ -1,22 +1,172 @@
 
-import torch
 import numpy as np
 import cv2
 
+from circular_stats import circular_median, row_histograms, hue_histogram
+
+# K-Means settings shared by per-image and pooled fits
+KMEANS_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+KMEANS_ATTEMPTS = 10
+
+
+def zone_samples(image_bgr, mask=None):
+    """Normalised (hue, value) K-Means samples of an image's pixels with V > 10 (or `mask`)."""
+    hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+    if mask is None:
+        mask = hsv[:, :, 2] > 10
+    return np.column_stack((hsv[:, :, 0][mask] / 180.0, hsv[:, :, 2][mask] / 255.0)).astype(np.float32)
+
+
+def order_centers(centers):
+    """
+    Sort 3 K-Means centres into [SZ, MZ, DZ]: the darkest is MZ (extinction),
+    of the other two the lower hue (red/orange) is SZ and the higher (green) DZ.
+    """
+    centers = np.asarray(centers, dtype=np.float32).reshape(3, 2)
+    by_v = np.argsort(centers[:, 1], kind='stable')
+    mz, rest = by_v[0], by_v[1:]
+    sz, dz = (rest[0], rest[1]) if centers[rest[0], 0] < centers[rest[1], 0] else (rest[1], rest[0])
+    return centers[[sz, mz, dz]]
+
+
+def stratified_sample(image_bgr, count, strata=10, rng=None):
+    """
+    Up to `count` valid-pixel samples of an image, drawn evenly from `strata`
+    horizontal bands so every depth (and so every zone) is represented.
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    height = image_bgr.shape[0]
+    edges = np.linspace(0, height, strata + 1).astype(int)
+    per_band = max(1, count // strata)
+    parts = []
+    for y0, y1 in zip(edges[:-1], edges[1:]):
+        if y1 <= y0:
+            continue
+        band = zone_samples(image_bgr[y0:y1])
+        if len(band) > per_band:
+            band = band[rng.choice(len(band), per_band, replace=False)]
+        parts.append(band)
+    return np.concatenate(parts) if parts else np.zeros((0, 2), np.float32)
+
+
+def segment_zones(row_labels, min_width=0.05, window=None):
+    """
+    Optimal two-change-point segmentation of per-row zone labels.
+
+    Rows are split into SZ [0, a), MZ [a, b) and DZ [b, H) so that the number of
+    rows whose label matches their segment is maximal. With cumulative label
+    counts C_k the score is (C_SZ(a) - C_MZ(a)) + (C_MZ(b) - C_DZ(b)) + C_DZ(H), so
+    the best a for every b is a running maximum and the whole search is O(rows).
+    A few noisy rows cannot move a boundary unless they outweigh the rows around it.
+
+    Args:
+        row_labels: (H,) labels 0=SZ, 1=MZ, 2=DZ, -1 = background (ignored)
+        min_width: minimum zone height as a fraction of H, so no zone collapses to nothing
+        window: rows on each side of a boundary used for its confidence
+            (default 5% of H, at least 3)
+
+    Returns:
+        (a, b, confidence) with confidence {'overall', 'sz_boundary', 'mz_boundary'} in 0-1:
+        overall = share of labelled rows that agree with the segmentation; a boundary's
+        confidence = how cleanly the rows within `window` above/below it are separated
+    """
+    labels = np.asarray(row_labels)
+    height = len(labels)
+    counts = np.zeros((height + 1, 3), dtype=np.int64)
+    counts[1:] = np.cumsum(labels[:, None] == np.arange(3), axis=0)
+
+    # Valid boundaries: m <= a, a + m <= b, b <= H - m
+    m = min(int(height * min_width), height // 3)
+    gain_a = (counts[:, 0] - counts[:, 1]).astype(float)
+    gain_a[:m] = -np.inf
+    gain_b = counts[:, 1] - counts[:, 2]
+    best_gain_a = np.maximum.accumulate(gain_a)
+    rows = np.arange(height + 1)
+    new_max = np.concatenate([[True], gain_a[1:] > best_gain_a[:-1]])
+    best_a = np.maximum.accumulate(np.where(new_max, rows, 0))
+
+    candidates = np.arange(2 * m, height - m + 1)
+    total = best_gain_a[candidates - m] + gain_b[candidates]
+    best = int(np.argmax(total))
+    b = int(candidates[best])
+    a = int(best_a[b - m])
+    labelled = int(counts[height].sum())
+    agreement = (total[best] + counts[height, 2]) / labelled if labelled else 0.0
+
+    window = window or max(3, int(height * 0.05))
+
+    def purity(y0, y1, wrong):
+        """Share of labelled rows in [y0, y1) that are not labelled `wrong` (None if none)."""
+        y0, y1 = max(0, y0), min(height, y1)
+        n = counts[y1].sum() - counts[y0].sum()
+        return 1.0 - (counts[y1, wrong] - counts[y0, wrong]) / n if n else None
+
+    def separation(above, below):
+        sides = [p for p in (above, below) if p is not None]
+        return round(float(np.mean(sides)), 3) if sides else 0.0
+
+    # Above the SZ boundary nothing should be MZ/DZ-like, below it nothing SZ-like; same for DZ
+    sz_conf = separation(purity(a - window, a, 1), purity(a, a + window, 0))
+    dz_conf = separation(purity(b - window, b, 2), purity(b, b + window, 1))
+    confidence = {'overall': round(float(agreement), 3), 'sz_boundary': sz_conf, 'mz_boundary': dz_conf}
+    return a, b, confidence
+
+
 class ZoneDetector:
     def __init__(self):
         # We upgrade to a robust K-Means + Spatial Voting approach
         # This handles complex cases like "Black/Dark MZ" and "Greenish DZ" effectively.
+        # Everything runs on OpenCV/NumPy on the CPU, so no deep-learning runtime is needed.
         print("Initializing Advanced K-Means Zone Detector...")
-        self.device = torch.device("cpu") # CPU is sufficient for this logic
         
-    def detect_zones_and_colors(self, image_bgr):
+    def fit_zone_model(self, images, samples_per_image=20000, strata=10, seed=0):
+        """
+        Fit the 3-cluster (hue, value) model once for a whole batch.
+
+        Slides from one staining session share their SZ/MZ/DZ colours, so instead
+        of clustering every image on its own, a stratified sample of each image
+        is pooled and clustered once. Per image only the row voting remains.
+
+        Args:
+            images: iterable of BGR images (a single reference image also works)
+            samples_per_image: pixels sampled from each image
+            strata: depth bands the samples of an image are spread over
+            seed: random seed, so the same batch gives the same model
+
+        Returns:
+            (3, 2) float32 array of normalised (hue, value) centres in SZ, MZ, DZ order,
+            to pass to detect_zones_and_colors(..., zone_model=...)
+        """
+        rng = np.random.default_rng(seed)
+        pooled = [stratified_sample(img, samples_per_image, strata, rng) for img in images]
+        samples = np.concatenate(pooled) if pooled else np.zeros((0, 2), np.float32)
+        if len(samples) < 3:
+            raise ValueError("Not enough valid pixels to fit a zone model.")
+        _, _, centers = cv2.kmeans(samples, 3, None, KMEANS_CRITERIA, KMEANS_ATTEMPTS, cv2.KMEANS_PP_CENTERS)
+        model = order_centers(centers)
+        print(f"Shared Zone Model from {len(pooled)} image(s), {len(samples)} samples -- SZ: {model[0]}, MZ: {model[1]}, DZ: {model[2]}")
+        return model
+
+    def detect_batch(self, images, zone_model=None, **fit_options):
+        """
+        Detect zones of several images with one shared model (fitted on all of
+        them unless `zone_model` is given). Returns (zone_model, [result per image]).
+        """
+        images = list(images)
+        if zone_model is None:
+            zone_model = self.fit_zone_model(images, **fit_options)
+        return zone_model, [self.detect_zones_and_colors(img, zone_model) for img in images]
+
+    def detect_zones_and_colors(self, image_bgr, zone_model=None):
         """
         Detects SZ, MZ, DZ using robust K-Means Clustering on HSV space combined with Spatial Row Voting.
         This handles:
         1. Dark MZ (Extinction) vs Bright SZ/DZ
         2. Hue transitions (Orange -> Green)
         3. Mixed "Black-Green" regions
+
+        With `zone_model` (centres from fit_zone_model) the clustering step is
+        skipped and only the row voting runs.
         """
         try:
             h_img, w_img = image_bgr.shape[:2]
@@ -39,137 +189,61 @@ class ZoneDetector:
             if not np.any(mask):
                  raise ValueError("Image appears empty or too dark.")
                  
-            samples = np.column_stack((h_norm[mask], v_norm[mask])).astype(np.float32)
-            
-            # 3. K-Means Clustering (k=3 for SZ, MZ, DZ)
-            # Use plenty of attempts to find stable clusters
-            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
-            k = 3
-            ret, labels, centers = cv2.kmeans(samples, k, None, criteria, 10, cv2.KMEANS_PP_CENTERS)
-            
-            # 4. Identify Clusters (Who is SZ, MZ, DZ?)
-            # Centers: [ [h, v], [h, v], [h, v] ]
-            
-            # A. Sort by Intensity (V). The darkest center is predominantly MZ (Extinction)
-            # However, if MZ is just transitional color, V might not be lowest.
-            # But user specifically mentioned "Black Greenish region is MZ". So V is key.
-            
-            cluster_indices = [0, 1, 2]
-            sorted_by_v = sorted(cluster_indices, key=lambda i: centers[i][1]) # Ascending V
-            
-            mz_cluster_idx = sorted_by_v[0] # Lowest Intensity (Darkest)
-            
-            # The other two are SZ and DZ. Sort them by Hue.
-            remaining = sorted_by_v[1:]
-            # SZ is Lower Hue (Red/Orange), DZ is Higher Hue (Green)
-            if centers[remaining[0]][0] < centers[remaining[1]][0]:
-                sz_cluster_idx = remaining[0]
-                dz_cluster_idx = remaining[1]
+            if zone_model is not None:
+                # Shared batch model: no clustering for this image
+                centers = np.asarray(zone_model, dtype=np.float32).reshape(3, 2)
             else:
-                sz_cluster_idx = remaining[1]
-                dz_cluster_idx = remaining[0]
-                
+                # 3. K-Means Clustering (k=3 for SZ, MZ, DZ)
+                # Use plenty of attempts to find stable clusters
+                samples = np.column_stack((h_norm[mask], v_norm[mask])).astype(np.float32)
+                ret, labels, centers = cv2.kmeans(samples, 3, None, KMEANS_CRITERIA, KMEANS_ATTEMPTS, cv2.KMEANS_PP_CENTERS)
+
+                # 4. Identify Clusters (Who is SZ, MZ, DZ?)
+                # The darkest center is predominantly MZ (Extinction): "Black Greenish region is MZ".
+                # Of the other two, SZ is Lower Hue (Red/Orange), DZ is Higher Hue (Green)
+                centers = order_centers(centers)
+            sz_cluster_idx, mz_cluster_idx, dz_cluster_idx = 0, 1, 2
+
             print(f"Cluster Config -- SZ_Center: {centers[sz_cluster_idx]}, MZ_Center: {centers[mz_cluster_idx]}, DZ_Center: {centers[dz_cluster_idx]}")
             
             # 5. Spatial Row Voting
             # Assign each ROW to a zone based on its median pixel characteristics
             # We don't just use the cluster labels because we need spatial continuity
-            
-            row_labels = []
-            
-            for y in range(h_img):
-                # Get median normalized H and V for this row
-                # Mask out background
-                row_mask = (v_chan[y, :] > 10)
-                if not np.any(row_mask):
-                    row_labels.append(-1) # Background row
-                    continue
-                    
-                row_h = np.median(h_norm[y, :][row_mask])
-                row_v = np.median(v_norm[y, :][row_mask])
-                
-                # Find distance to each cluster center
-                pixel_pt = np.array([row_h, row_v], dtype=np.float32)
-                
-                d_sz = np.linalg.norm(pixel_pt - centers[sz_cluster_idx])
-                d_mz = np.linalg.norm(pixel_pt - centers[mz_cluster_idx]) 
-                d_dz = np.linalg.norm(pixel_pt - centers[dz_cluster_idx])
-                
-                # Assign label (0=SZ, 1=MZ, 2=DZ) based on closest center
-                dists = [d_sz, d_mz, d_dz]
-                min_idx = np.argmin(dists)
-                row_labels.append(min_idx)
-                
-            # 6. Find Boundaries from Smoothed Row Labels
-            # Smooth the labels to remove noise (e.g. median filter)
-            row_labels = np.array(row_labels)
-            
-            # Simple window vote
-            smooth_labels = row_labels.copy()
-            window = int(h_img * 0.05)
-            if window < 3: window = 3
-            
-            for i in range(len(row_labels)):
-                start = max(0, i - window)
-                end = min(len(row_labels), i + window)
-                chunk = row_labels[start:end]
-                valid_chunk = chunk[chunk != -1]
-                if len(valid_chunk) > 0:
-                    counts = np.bincount(valid_chunk, minlength=3)
-                    smooth_labels[i] = np.argmax(counts)
-            
-            # Find transitions
-            # SZ -> MZ (Transition from 0 to 1)
-            # Scan from top
-            sz_boundary = 0
-            found_sz_trans = False
-            for y in range(int(h_img * 0.05), int(h_img * 0.6)):
-                # If we see consistent MZ (1) or DZ (2) after SZ (0)
-                if smooth_labels[y] != 0:
-                    # check stability
-                    if np.all(smooth_labels[y:y+5] != 0):
-                        sz_boundary = y
-                        found_sz_trans = True
-                        break
-            if not found_sz_trans: sz_boundary = int(h_img * 0.33)
-            
-            # MZ -> DZ (Transition from 1 to 2)
-            # Scan from bottom up? or from SZ down
-            dz_boundary = h_img
-            found_dz_trans = False
-            for y in range(h_img - int(h_img * 0.05), sz_boundary, -1):
-                # If we see consistent MZ (1) or SZ (0) ABOVE DZ (2)
-                if smooth_labels[y] != 2:
-                     # This means we hit the top of the DZ block
-                     dz_boundary = y
-                     found_dz_trans = True
-                     break
-            if not found_dz_trans: dz_boundary = int(h_img * 0.66)
-            
+            valid_rows = mask.any(axis=1)
+            # Circular median hue of every row at once (linear medians break on the red 0/180 wrap)
+            row_hues = circular_median(row_histograms(hsv[:, :, 0], mask)) / 180.0
+            row_v = np.zeros(h_img)
+            row_v[valid_rows] = np.nanmedian(np.where(mask[valid_rows], v_norm[valid_rows], np.nan), axis=1)
+
+            # Closest cluster center per row (0=SZ, 1=MZ, 2=DZ), -1 = background row
+            features = np.column_stack((row_hues, row_v)).astype(np.float32)
+            dists = np.linalg.norm(features[:, None, :] - centers[None, :, :], axis=2)
+            row_labels = np.where(valid_rows, np.argmin(dists, axis=1), -1)
+
+            # 6. Boundaries: best SZ | MZ | DZ segmentation of the row labels
+            sz_boundary, dz_boundary, confidence = segment_zones(row_labels)
+
             # 7. Extract Representative Colors from Centers + Real Data
             # Map normalized centroids back to real units
-            sz_hue = centers[sz_cluster_idx][0] * 180.0
-            mz_hue_cen = centers[mz_cluster_idx][0] * 180.0
-            dz_hue = centers[dz_cluster_idx][0] * 180.0
+            sz_hue = float(centers[sz_cluster_idx][0]) * 180.0
+            mz_hue_cen = float(centers[mz_cluster_idx][0]) * 180.0
+            dz_hue = float(centers[dz_cluster_idx][0]) * 180.0
             
             # Refine hues by sampling the identified regions directly (ground truth)
             # SZ Region
             if sz_boundary > 0:
-                roi = h_chan[0:sz_boundary, :][mask[0:sz_boundary, :]]
-                if len(roi) > 0: sz_hue = np.median(roi)
+                roi = hsv[0:sz_boundary, :, 0][mask[0:sz_boundary, :]]
+                if len(roi) > 0: sz_hue = circular_median(hue_histogram(roi))
                 
             # MZ Region
             if dz_boundary > sz_boundary:
-                roi = h_chan[sz_boundary:dz_boundary, :][mask[sz_boundary:dz_boundary, :]]
-                if len(roi) > 0: mz_hue_cen = np.median(roi)
+                roi = hsv[sz_boundary:dz_boundary, :, 0][mask[sz_boundary:dz_boundary, :]]
+                if len(roi) > 0: mz_hue_cen = circular_median(hue_histogram(roi))
             
             # DZ Region
             if dz_boundary < h_img:
-                roi = h_chan[dz_boundary:h_img, :][mask[dz_boundary:h_img, :]]
-                if len(roi) > 0: dz_hue = np.median(roi)
-            
-            # Fallback checks
-            if sz_hue > 100: sz_hue = 10.0 # Sanity check for Red wrapping
+                roi = hsv[dz_boundary:h_img, :, 0][mask[dz_boundary:h_img, :]]
+                if len(roi) > 0: dz_hue = circular_median(hue_histogram(roi))
             
             return {
                 'success': True,
@@ -178,7 +252,8 @@ class ZoneDetector:
                 'sz_hue': round(sz_hue, 1),
                 'mz_hue': round(mz_hue_cen, 1),
                 'dz_hue': round(dz_hue, 1),
-                'debug_method': 'K-Means Clustering'
+                'confidence': confidence,
+                'debug_method': 'Shared K-Means Model' if zone_model is not None else 'K-Means Clustering'
             }
 
         except Exception as e:
@@ -0,0 +1,41 @@
+"""
+Entry point of the /analyze worker processes (see worker_pool.py).
+
+Workers are spawned, so everything a task refers to is imported again in every
+worker. This module imports only the analysis pipeline (zone_analysis.py) and,
+on the first `use_ai` task, the zone detector; the Flask app, its caches and
+its stores are never loaded in a worker.
+"""
+import threading
+
+import zone_analysis
+
+_detector = None
+_detector_error = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    """This worker's ZoneDetector, created on first use; None if it cannot be loaded."""
+    global _detector, _detector_error
+    with _detector_lock:
+        if _detector is None and _detector_error is None:
+            try:
+                from ai_model import ZoneDetector
+                _detector = ZoneDetector()
+            except Exception as e:
+                print(f"AI Model not available in worker: {e}")
+                _detector_error = str(e)
+    return _detector
+
+
+def analyze(img, params):
+    """
+    Analyse a (shared-memory) image with normalised analysis parameters.
+
+    Returns:
+        (analysis dict of zone_analysis.analyze, annotated JPEG bytes)
+    """
+    analysis = zone_analysis.analyze(img, params, get_detector() if params['use_ai'] else None)
+    annotated = zone_analysis.render_annotated(img, analysis['z1_h'], analysis['z2_h'])
+    return analysis, zone_analysis.encode_jpeg(annotated)
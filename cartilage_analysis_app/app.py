@@ -1,129 +1,428 @@
 import os
 import io
+import re
+import json
+import time
 import base64
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import CancelledError
 import numpy as np
 import cv2
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
+from werkzeug.wsgi import ClosingIterator
 from openpyxl import Workbook
+from admission import AdmissionRejected, controller_from_env, image_dimensions, streams_from_env
+from render_cache import RenderCache, cache_from_env, image_fingerprint, render_key
+from image_store import recipes_from_env, resize_to_width, store_from_env
+from tiles import store_from_env as tile_store_from_env
+from block_grid import OrientationIntegrals
+import structure_tensor
+import param_sweep
+import zone_analysis
+import analysis_worker
+from zone_analysis import (PROFILE_MASK, ZONE_MASK, analyze_rows, analyze_zone, encode_jpeg, hue_to_angle,
+                           mask_thresholds, render_annotated, row_statistics, zone_model_param)
+from result_cache import cache_from_env as result_cache_from_env, content_hash, result_key
+from single_flight import SingleFlight
+from worker_pool import pool_from_env
+from batch_runs import RunNotFound, store_from_env as batch_store_from_env
+from results_db import database_from_env as results_db_from_env
+from quality_gate import QualityRejected, decode_cost, decode_small, gate_from_env, shrink
+from progressive import deviation, jobs_from_env as refinements_from_env
+from tuning_sessions import DEFAULT_PARAMS, TUNABLE, SessionNotFound, apply_deltas, sessions_from_env
 
-# Attempt to import the AI model
-try:
-    from ai_model import ZoneDetector
-    # Initialize global detector (loads ResNet50)
-    print("Initializing AI Model...")
-    detector = ZoneDetector()
-    AI_AVAILABLE = True
-    print("AI Model Initialized Successfully.")
-except Exception as e:
-    print(f"AI Model not available: {e}")
-    AI_AVAILABLE = False
-    detector = None
+# The AI zone detector is loaded lazily on the first `use_ai` request (or by warm_up()),
+# so importing this module stays cheap for CLI runs, tests and every server worker.
+_detector = None
+_detector_error = None
+_detector_lock = threading.Lock()
+
+def get_detector():
+    """
+    Return the shared ZoneDetector, creating it on first use.
+    Returns None if the model cannot be loaded (the error is kept for /readyz).
+    """
+    global _detector, _detector_error
+    if _detector is not None or _detector_error is not None:
+        return _detector
+
+    with _detector_lock:
+        if _detector is None and _detector_error is None:
+            try:
+                from ai_model import ZoneDetector
+                print("Initializing AI Model...")
+                _detector = ZoneDetector()
+                print("AI Model Initialized Successfully.")
+            except Exception as e:
+                print(f"AI Model not available: {e}")
+                _detector_error = str(e)
+    return _detector
 
 app = Flask(__name__)
 
-def hue_to_angle(hue, zero_hue=0, ninety_hue=60):
+def lazy(factory):
     """
-    Convert OpenCV HSV Hue (0-179) to fiber orientation angle (0-90 degrees)
-    using dynamic anchors.
-    
-    Args:
-        hue: input hue value or array
-        zero_hue: Hue value corresponding to 0 degrees (SZ)
-        ninety_hue: Hue value corresponding to 90 degrees (DZ)
-    """
-    # Avoid division by zero
-    if abs(ninety_hue - zero_hue) < 1.0:
-        # Fallback to defaults or return 0
-        denom = 60.0
-    else:
-        denom = ninety_hue - zero_hue
-        
-    angle = (hue - zero_hue) / denom * 90.0
-    return np.clip(angle, 0, 90)
-
-def analyze_zone(image_zone, zero_hue=0, ninety_hue=60):
-    """
-    Analyze a specific zone of the image using dynamic HSV hue-to-angle mapping.
-    """
-    if image_zone.size == 0:
-         return {
-            "avg_color_hex": "#000000",
-            "angle_histogram": [0]*91,
-            "angle_labels": list(range(91)),
-            "mean_angle": 0,
-            "std_angle": 0,
-            "avg_hue": 0,
-            "avg_r": 0,
-            "avg_g": 0,
-            "avg_b": 0,
-            "avg_intensity": 0
-        }
+    Getter for a process-wide resource built by `factory()` on first use. Resources
+    that create files, databases or processes are built this way, so importing this
+    module (serve.py, tools, tests) has no side effects.
+    """
+    lock = threading.Lock()
+    built = []
 
-    # Convert to HSV
-    hsv = cv2.cvtColor(image_zone, cv2.COLOR_BGR2HSV)
-    h_channel = hsv[:, :, 0].flatten()
-    s_channel = hsv[:, :, 1].flatten()
-    v_channel = hsv[:, :, 2].flatten()
-    
-    # Masking
-    mask = (v_channel > 10) & (s_channel > 10) # Lowered threshold to include dark MZ
-    
-    valid_hues = h_channel[mask]
-    valid_values = v_channel[mask]
-    
-    if len(valid_hues) == 0:
-         return {
-            "avg_color_hex": "#000000",
-            "angle_histogram": [0]*91,
-            "angle_labels": list(range(91)),
-            "mean_angle": 0,
-            "std_angle": 0,
-            "avg_hue": 0,
-            "avg_r": 0,
-            "avg_g": 0,
-            "avg_b": 0,
-            "avg_intensity": 0
-        }
-    
-    # Convert hues to angles using DYNAMIC mapping
-    angles = hue_to_angle(valid_hues.astype(float), zero_hue, ninety_hue)
-    
-    # Calculate Histogram
-    hist_angle, _ = np.histogram(angles, bins=91, range=(0, 91))
-    
-    # Normalize
-    hist_sum = hist_angle.sum()
-    if hist_sum > 0:
-        hist_angle = hist_angle / hist_sum
-        
-    # Calculate Average Color
-    pixels = image_zone.reshape(-1, 3)
-    valid_pixels = pixels[mask]
-    
-    if len(valid_pixels) > 0:
-        avg_b = np.mean(valid_pixels[:, 0])
-        avg_g = np.mean(valid_pixels[:, 1])
-        avg_r = np.mean(valid_pixels[:, 2])
-        avg_hex = '#{:02x}{:02x}{:02x}'.format(int(avg_r), int(avg_g), int(avg_b))
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(factory())
+        return built[0]
+    return get
+
+# Bounds how many image pixels are being analysed at once (see admission.py)
+ADMISSION = controller_from_env()
+
+# Rendered overlays, keyed by image content + render parameters (see render_cache.py)
+RENDERS = cache_from_env()
+
+# Decoded source images kept for on-demand rendering (see image_store.py)
+IMAGES = store_from_env()
+
+# How to decode an analysed image again once IMAGES has dropped it (see image_store.py)
+RECIPES = recipes_from_env()
+
+# Concurrent views of the same dropped image wait for one re-decode
+RESTORES = SingleFlight()
+
+# Memory-mapped deep-zoom pyramids on local disk (see tiles.py)
+tile_store = lazy(tile_store_from_env)
+
+# Bump whenever /analyze output changes for the same input; cached results of
+# other versions are discarded
+ANALYSIS_VERSION = '2026.10-5'
+
+# Finished /analyze results in memory + SQLite, keyed by image hash + parameters + version
+result_cache = lazy(lambda: result_cache_from_env(ANALYSIS_VERSION))
+
+# Worker processes for /analyze (ANALYSIS_WORKERS, default 0 = request thread)
+analysis_pool = lazy(pool_from_env)
+
+# Identical /analyze requests in flight at the same time share one computation
+ANALYSES = SingleFlight()
+
+# Original bytes of images uploaded through /convert_image, for full-resolution analysis
+SOURCES = RenderCache(float(os.environ.get('SOURCE_CACHE_MB', 1024)) * 1024 * 1024)
+
+# Server-side batch runs, checkpointed per image on disk (see batch_runs.py)
+batch_run_store = lazy(lambda: batch_store_from_env(batch_analysis, fit_pooled_zone_model))
+
+# Every analysis, indexed for cross-study queries (see results_db.py); None if disabled
+results_db = lazy(results_db_from_env)
+
+# Cheap checks on a downsampled decode before a full analysis (see quality_gate.py); None if off
+QUALITY = gate_from_env()
+
+# Background full-resolution refinements of progressive /analyze previews (see progressive.py)
+REFINEMENTS = refinements_from_env()
+PROGRESSIVE_SIDE = int(os.environ.get('PROGRESSIVE_SIDE', 512))
+
+# Live tuning: decoded image + row statistics kept server-side, parameter deltas in, results pushed out
+SESSIONS = sessions_from_env()
+
+# Open server-sent event streams (refinements, tuning sessions); each holds a server thread
+EVENT_STREAMS = streams_from_env()
+
+# Warm-up state reported by /healthz and /readyz
+WARMUP_STATE = {
+    'ready': False,
+    'started_at': None,
+    'finished_at': None,
+    'duration_s': None,
+    'error': None
+}
+
+# Value used in uint8 angle maps for pixels outside the V>10 & S>10 mask
+ANGLE_NODATA = 255
+
+def angle_lut(zero_hue=0, ninety_hue=60):
+    """
+    256-entry uint8 lookup table hue -> whole-degree angle (0-90) for a calibration,
+    so a full-resolution angle map is a single cv2.LUT pass over the hue plane.
+    """
+    return np.rint(hue_to_angle(np.arange(256, dtype=np.float64), zero_hue, ninety_hue)).astype(np.uint8)
+
+def _angle_color_lut():
+    # JET colour for 0-90 deg (stretched over the full colormap), black for no-data
+    gradient = np.clip(np.rint(np.arange(256) * (255.0 / 90.0)), 0, 255).astype(np.uint8)
+    colors = cv2.applyColorMap(gradient.reshape(256, 1), cv2.COLORMAP_JET).reshape(1, 256, 3)
+    colors[0, 91:] = 0
+    return colors
+
+ANGLE_COLOR_LUT = _angle_color_lut()
+
+def angle_map(img, zero_hue=0, ninety_hue=60):
+    """
+    Per-pixel fiber angle map of a BGR image.
+
+    Returns:
+        uint8 array (H, W) with angles 0-90 and ANGLE_NODATA where the pixel is masked out
+    """
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    angles = cv2.LUT(cv2.extractChannel(hsv, 0), angle_lut(zero_hue, ninety_hue))
+    # V > 10 and S > 10; invalid pixels become 255 via max(angle, ~mask)
+    mask = cv2.inRange(hsv, (0, 11, 11), (255, 255, 255))
+    return cv2.max(angles, cv2.bitwise_not(mask))
+
+def colorize_angle_map(angles):
+    """Pseudo-colour an angle map (JET over 0-90 deg, no-data black) with one LUT pass."""
+    return cv2.LUT(cv2.merge([angles, angles, angles]), ANGLE_COLOR_LUT)
+
+def render_angle_map(img, zero_hue=0, ninety_hue=60):
+    """Pseudo-coloured per-pixel fiber angle of a BGR image."""
+    return colorize_angle_map(angle_map(img, zero_hue, ninety_hue))
+
+def decode_image_payload(data_url):
+    """Return the raw image bytes of a `data:image/...;base64,` URL."""
+    return base64.b64decode(data_url.split(',')[1])
+
+def request_image_bytes(data):
+    """
+    Encoded bytes of the image a request refers to: a base64 data URL in `image`,
+    or the full-resolution original of a /convert_image preview in `image_key`.
+    Returns None if the referenced upload has expired.
+    """
+    if data.get('image_key'):
+        entry = SOURCES.get(data['image_key'])
+        return entry[0] if entry else None
+    return decode_image_payload(data['image'])
+
+def decode_image(image_bytes):
+    """Decode encoded image bytes to a BGR array (None if undecodable)."""
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+@contextmanager
+def admitted_image(image_bytes):
+    """
+    Decode an uploaded image while holding its share of the analysis pixel budget.
+
+    The budget is reserved from the header dimensions *before* decoding. If the
+    header cannot be read, the image is decoded first and reserved by its
+    decoded size. Yields None if the bytes are not a decodable image.
+    """
+    dims = image_dimensions(image_bytes)
+    img = None
+    if dims is None:
+        img = decode_image(image_bytes)
+        if img is None:
+            yield None
+            return
+        dims = (img.shape[1], img.shape[0])
+
+    with ADMISSION.admit(dims[0] * dims[1]):
+        if img is None:
+            img = decode_image(image_bytes)
+        yield img
+
+def remember_source(fingerprint, image_bytes, data):
+    """Register how to decode the (cropped) image of an analysis again, without decoding it."""
+    options = {'crop': data.get('crop'), 'preview_scale': float(data.get('preview_scale') or 1.0)}
+    if data.get('image_key'):
+        # The upload is kept in SOURCES already; only reference it
+        RECIPES.put(fingerprint, None, dict(options, image_key=data['image_key']))
     else:
-        avg_r, avg_g, avg_b = 0, 0, 0
-        avg_hex = '#000000'
-    
-    avg_hue = float(np.mean(valid_hues))
-    avg_intensity = float(np.mean(valid_values))
-    
+        RECIPES.put(fingerprint, image_bytes, options)
+
+def stored_image(fingerprint):
+    """
+    Decoded image of an analysis: from the image store, or decoded again (under
+    admission control) from its registered source if the store has dropped it.
+    Returns a StoredImage, or None if neither is available.
+    """
+    stored = IMAGES.get(fingerprint)
+    if stored is not None:
+        return stored
+    recipe = RECIPES.get(fingerprint)
+    if recipe is None:
+        return None
+
+    def restore():
+        image_bytes, options = recipe
+        if image_bytes is None:
+            entry = SOURCES.get(options['image_key'])
+            if entry is None:
+                return False
+            image_bytes = entry[0]
+        with admitted_image(image_bytes) as img:
+            if img is None:
+                return False
+            if options['crop']:
+                img = crop_preview_rect(img, options['crop'], options['preview_scale'])
+            IMAGES.put(fingerprint, img)
+        return True
+
+    RESTORES.run(fingerprint, restore)
+    return IMAGES.get(fingerprint)
+
+def busy_response(rejection):
+    """429 response for a request the admission controller turned away."""
+    response = jsonify({'error': rejection.reason, 'retry_after': rejection.retry_after})
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response, 429
+
+# Angle-map renderings: file name -> (render kind, mimetype)
+ANGLE_MAP_FILES = {
+    'angle.png': ('angle_png', 'image/png'),
+    'angle.npz': ('angle_npz', 'application/octet-stream'),
+    'colored.png': ('angle_color', 'image/png')
+}
+
+def angle_map_outputs(fingerprint, zero_hue, ninety_hue, width, height):
+    """
+    URLs of the full-resolution angle map of an analysed image, rendered on first
+    request (see angle_map_render): an 8-bit grayscale PNG (pixel value = degrees,
+    255 = no data), a compressed NPZ (angle, mask and calibration) and a
+    pseudo-coloured PNG.
+    """
+    query = f"zero={round(float(zero_hue), 3):g}&ninety={round(float(ninety_hue), 3):g}"
+    return {
+        'png_url': f"/angle_map/{fingerprint}/angle.png?{query}",
+        'npz_url': f"/angle_map/{fingerprint}/angle.npz?{query}",
+        'colored_url': f"/angle_map/{fingerprint}/colored.png?{query}",
+        'nodata': ANGLE_NODATA,
+        'width': int(width),
+        'height': int(height)
+    }
+
+def render_angle_map_files(img, zero_hue, ninety_hue):
+    """Encoded angle-map renderings of `img`, by render kind (see ANGLE_MAP_FILES)."""
+    angles = angle_map(img, zero_hue, ninety_hue)
+    npz = io.BytesIO()
+    np.savez_compressed(npz, angle=angles, valid=angles != ANGLE_NODATA,
+                        zero_hue=float(zero_hue), ninety_hue=float(ninety_hue))
     return {
-        "avg_color_hex": avg_hex,
-        "angle_histogram": hist_angle.tolist(),
-        "angle_labels": list(range(91)),
-        "mean_angle": float(np.mean(angles)),
-        "std_angle": float(np.std(angles)),
-        "avg_hue": avg_hue,
-        "avg_r": int(avg_r),
-        "avg_g": int(avg_g),
-        "avg_b": int(avg_b),
-        "avg_intensity": avg_intensity
+        'angle_png': cv2.imencode('.png', angles, [cv2.IMWRITE_PNG_COMPRESSION, 6])[1],
+        'angle_npz': npz.getvalue(),
+        'angle_color': cv2.imencode('.png', colorize_angle_map(angles))[1]
+    }
+
+def jpeg_data_url(jpeg_bytes):
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg_bytes).decode('utf-8')
+
+def warm_up(load_detector=True):
+    """
+    Pre-load the zone detector and exercise the OpenCV/NumPy code paths once
+    so the first real request of a worker does not pay the start-up cost.
+    Safe to call more than once; only the first call does any work.
+
+    Args:
+        load_detector: also build the AI zone detector now instead of on the
+            first `use_ai` request
+    """
+    if WARMUP_STATE['ready']:
+        return WARMUP_STATE
+
+    WARMUP_STATE['started_at'] = time.time()
+    try:
+        # Small synthetic PLM-like gradient: red (SZ) -> green (DZ)
+        hsv = np.zeros((96, 64, 3), dtype=np.uint8)
+        hsv[:, :, 0] = np.linspace(0, 60, 96, dtype=np.uint8)[:, None]
+        hsv[:, :, 1] = 200
+        hsv[:, :, 2] = 200
+        sample = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+        analyze_zone(sample)
+        cv2.imencode('.jpg', sample)
+        if load_detector:
+            detector = get_detector()
+            if detector:
+                detector.detect_zones_and_colors(sample)
+        if analysis_pool() is not None:
+            analysis_pool().start()
+        if os.environ.get('BATCH_RUN_RESUME', '1') != '0':
+            batch_run_store().resume_interrupted()
+
+        WARMUP_STATE['ready'] = True
+        WARMUP_STATE['error'] = None
+    except Exception as e:
+        print(f"Warm-up Error: {e}")
+        WARMUP_STATE['error'] = str(e)
+    finally:
+        WARMUP_STATE['finished_at'] = time.time()
+        WARMUP_STATE['duration_s'] = round(WARMUP_STATE['finished_at'] - WARMUP_STATE['started_at'], 3)
+
+    return WARMUP_STATE
+
+@app.route('/healthz')
+def healthz():
+    """Liveness probe: the process is up and serving requests."""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: 200 once this worker has finished warming up, 503 before."""
+    status = {
+        'ready': WARMUP_STATE['ready'],
+        'pid': os.getpid(),
+        'ai_loaded': _detector is not None,
+        'ai_error': _detector_error,
+        'warmup_duration_s': WARMUP_STATE['duration_s'],
+        'error': WARMUP_STATE['error']
     }
+    return jsonify(status), (200 if WARMUP_STATE['ready'] else 503)
+
+@app.route('/metrics/admission')
+def admission_metrics():
+    """Queue depth, in-flight work and rejection counters of the analysis admission controller."""
+    return jsonify(ADMISSION.metrics())
+
+@app.route('/metrics/render_cache')
+def render_cache_metrics():
+    return jsonify(RENDERS.metrics())
+
+@app.route('/metrics/result_cache')
+def result_cache_metrics():
+    return jsonify(result_cache().metrics())
+
+@app.route('/metrics/coalescing')
+def coalescing_metrics():
+    return jsonify(ANALYSES.metrics())
+
+@app.route('/metrics/workers')
+def worker_metrics():
+    return jsonify(analysis_pool().metrics() if analysis_pool() is not None else {'workers': 0})
+
+@app.route('/metrics/results_db')
+def results_db_metrics():
+    return jsonify(results_db().metrics() if results_db() is not None else {'samples': 0})
+
+@app.route('/metrics/quality_gate')
+def quality_gate_metrics():
+    return jsonify(QUALITY.metrics() if QUALITY is not None else {'mode': 'off'})
+
+@app.route('/metrics/progressive')
+def progressive_metrics():
+    return jsonify(REFINEMENTS.metrics())
+
+@app.route('/metrics/tuning_sessions')
+def tuning_session_metrics():
+    return jsonify(SESSIONS.metrics())
+
+@app.route('/metrics/event_streams')
+def event_stream_metrics():
+    return jsonify(EVENT_STREAMS.metrics())
+
+@app.route('/render/<key>.<ext>')
+def serve_render(key, ext):
+    """Serve a cached rendering. Keys are content-addressed, so responses never change."""
+    entry = RENDERS.get(key)
+    if entry is None:
+        return jsonify({'error': 'Rendering expired from cache, please re-run the analysis'}), 404
+    data, mimetype = entry
+    response = send_file(io.BytesIO(data), mimetype=mimetype, etag=key,
+                         conditional=True, max_age=86400,
+                         as_attachment=(ext == 'npz'), download_name=f"{key}.{ext}")
+    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    return response
 
 @app.route('/')
 def index():
@@ -146,39 +445,89 @@ def analyze_scientific():
         if not data or 'image' not in data:
             return jsonify({'error': 'No image data provided'}), 400
         
-        # Decode base64 
-        image_data = data['image'].split(',')[1]
         sz_b_pct = int(data.get('sz_boundary', 10))
         mz_b_pct = int(data.get('mz_boundary', 30))
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            return jsonify({'error': 'Failed to decode image'}), 400
+        image_bytes = decode_image_payload(data['image'])
+        with admitted_image(image_bytes) as img:
+            if img is None:
+                return jsonify({'error': 'Failed to decode image'}), 400
+            return jsonify(scientific_analysis(img, sz_b_pct, mz_b_pct))
 
-        # 1. Processing
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        h_chan = hsv[:, :, 0]
-        s_chan = hsv[:, :, 1]
-        v_chan = hsv[:, :, 2]
-        
-        # 2. Masking (V > 10 and S > 10)
-        mask = (v_chan > 10) & (s_chan > 10)
-        mask_uint8 = (mask * 255).astype(np.uint8)
-        
-        # 3. Create Visualizations
-        
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Scientific Analysis Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def scientific_analysis(img, sz_b_pct, mz_b_pct):
+    """
+    Valid-pixel hue histogram plus handles for the hue/mask/zone visualisations.
+
+    Only the histogram is computed here. The decoded image is kept in the image
+    store and each visualisation is rendered when the browser requests it, at
+    the requested display width (see /scientific/<key>/<kind>.jpg).
+    """
+    # 1. Processing
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    h_chan = hsv[:, :, 0]
+    s_chan = hsv[:, :, 1]
+    v_chan = hsv[:, :, 2]
+    
+    # 2. Masking (V > 10 and S > 10)
+    mask = (v_chan > 10) & (s_chan > 10)
+    
+    # 3. Histogram Calculation (ONLY Valid Pixels)
+    valid_hues = h_chan[mask]
+    # Histogram 0-179
+    hist_counts, _ = np.histogram(valid_hues, bins=180, range=(0, 180))
+
+    # 4. Keep the image (and the full-resolution hue range used to scale the
+    # heatmap) so the visualisations can be rendered on demand
+    h_min, h_max, _, _ = cv2.minMaxLoc(h_chan)
+    fingerprint = image_fingerprint(img)
+    IMAGES.put(fingerprint, img, {'h_min': h_min, 'h_max': h_max})
+
+    base = f"/scientific/{fingerprint}"
+    return {
+        'success': True,
+        'image_key': fingerprint,
+        'original_url': f"{base}/original.jpg",
+        'hue_url': f"{base}/hue.jpg",
+        'mask_url': f"{base}/mask.jpg",
+        'zone_url': f"{base}/zones.jpg?sz={sz_b_pct}&mz={mz_b_pct}",
+        'histogram': hist_counts.tolist()
+    }
+
+def render_scientific(kind, img, meta, sz_b_pct=10, mz_b_pct=30):
+    """
+    Render one scientific visualisation of `img` (any pyramid level).
+
+    Args:
+        kind: 'original', 'hue', 'mask' or 'zones'
+        meta: stored metadata with the full-resolution hue range (h_min, h_max)
+    """
+    if kind == 'original':
+        return img
+
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+    if kind == 'hue':
         # A. Hue Channel (Heatmap)
-        # Apply colormap to Hue channel for better visualization
-        # Normalize H (0-179) to 0-255
-        h_norm = cv2.normalize(h_chan, None, 0, 255, cv2.NORM_MINMAX)
-        hue_heatmap = cv2.applyColorMap(h_norm, cv2.COLORMAP_JET)
-        
+        # Scale H to 0-255 with the full-resolution min/max (same as NORM_MINMAX
+        # on the full image), so every display size shows the same colours
+        h_min, h_max = meta.get('h_min', 0), meta.get('h_max', 179)
+        scale = 255.0 / (h_max - h_min) if h_max - h_min > 0 else 0.0
+        h_norm = np.clip(np.rint((hsv[:, :, 0].astype(np.float32) - h_min) * scale), 0, 255).astype(np.uint8)
+        return cv2.applyColorMap(h_norm, cv2.COLORMAP_JET)
+
+    if kind == 'mask':
         # B. Mask Visualization
         # Show original image where mask is valid, Black otherwise
-        masked_img = cv2.bitwise_and(img, img, mask=mask_uint8)
-        
+        mask = (hsv[:, :, 2] > 10) & (hsv[:, :, 1] > 10)
+        mask_uint8 = (mask * 255).astype(np.uint8)
+        return cv2.bitwise_and(img, img, mask=mask_uint8)
+
+    if kind == 'zones':
         # C. Zone Overlay Visualization
         zone_img = img.copy()
         h, w = img.shape[:2]
@@ -192,359 +541,985 @@ def analyze_scientific():
         cv2.putText(zone_img, "SZ", (10, min(y_sz - 10, 30)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,255), 2)
         cv2.putText(zone_img, "MZ", (10, min(y_mz - 10, y_sz+30)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,255), 2)
         cv2.putText(zone_img, "DZ", (10, min(h - 10, y_mz+30)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,255), 2)
+        return zone_img
+
+    raise ValueError(f"Unknown visualisation '{kind}'")
+
+@app.route('/scientific/<key>/<kind>.jpg')
+def scientific_render(key, kind):
+    """
+    Render a scientific visualisation on demand.
+
+    Query args:
+        w: display width in pixels (rounded up to a multiple of 64); omitted = full resolution
+        sz, mz: zone boundaries in percent (zones view only)
+    """
+    try:
+        if kind not in ('original', 'hue', 'mask', 'zones'):
+            return jsonify({'error': f"Unknown visualisation '{kind}'"}), 404
+        stored = stored_image(key)
+        if stored is None:
+            return jsonify({'error': 'Image expired from cache, please re-run the analysis'}), 404
+
+        full_w = stored.shape[1]
+        width = request.args.get('w', type=int)
+        if width:
+            width = min(full_w, -(-width // 64) * 64)
+        else:
+            width = full_w
+        params = {'w': width}
+        if kind == 'zones':
+            params['sz'] = request.args.get('sz', 10, type=int)
+            params['mz'] = request.args.get('mz', 30, type=int)
+
+        def render():
+            _, level_img = stored.level_for_width(width)
+            view = render_scientific(kind, level_img, stored.meta,
+                                     params.get('sz', 10), params.get('mz', 30))
+            return encode_jpeg(resize_to_width(view, width))
+
+        cache_key = render_key(key, 'sc_' + kind, **params)
+        data = RENDERS.get_or_render(cache_key, render)
+        response = send_file(io.BytesIO(data), mimetype='image/jpeg', etag=cache_key,
+                             conditional=True, max_age=86400)
+        response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+        return response
+
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Scientific Render Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+TILE_LAYER_PATTERN = re.compile(r'^(original|hue|angle-(\d+(?:\.\d+)?)-(\d+(?:\.\d+)?))$')
+
+def tile_urls(key, zero_hue, ninety_hue):
+    """Deep-zoom descriptors of an analysed image; the angle layer uses its calibration."""
+    angle_layer = f"angle-{round(float(zero_hue), 2):g}-{round(float(ninety_hue), 2):g}"
+    return {
+        'viewer_url': f"/viewer/{key}?angle={angle_layer}",
+        'original': f"/tiles/{key}/original.dzi",
+        'hue': f"/tiles/{key}/hue.dzi",
+        'angle': f"/tiles/{key}/{angle_layer}.dzi"
+    }
+
+def tile_source(key):
+    """
+    Deep-zoom source for an analysed image, built from the (restored) stored image on
+    first use; a context manager that keeps the pyramid from being pruned while in use.
+    """
+    def load():
+        stored = stored_image(key)
+        if stored is None:
+            return None
+        hue = cv2.cvtColor(stored.image, cv2.COLOR_BGR2HSV)[:, :, 0]
+        h_min, h_max, _, _ = cv2.minMaxLoc(hue)
+        return stored.image, {'h_min': h_min, 'h_max': h_max}
+    return tile_store().reading(key, load)
+
+@app.route('/tiles/<key>/<layer>.dzi')
+def tile_descriptor(key, layer):
+    if not TILE_LAYER_PATTERN.match(layer):
+        return jsonify({'error': f"Unknown tile layer '{layer}'"}), 404
+    try:
+        with tile_source(key) as source:
+            if source is None:
+                return jsonify({'error': 'Image expired from cache, please re-run the analysis'}), 404
+            return app.response_class(source.descriptor(), mimetype='application/xml')
+    except AdmissionRejected as e:
+        return busy_response(e)
+
+@app.route('/tiles/<key>/<layer>_files/<int:level>/<int:col>_<int:row>.jpg')
+def tile(key, layer, level, col, row):
+    """One 256x256 tile of the original, hue heatmap or angle map at a DZI level."""
+    try:
+        match = TILE_LAYER_PATTERN.match(layer)
+        if not match:
+            return jsonify({'error': f"Unknown tile layer '{layer}'"}), 404
+        with tile_source(key) as source:
+            if source is None:
+                return jsonify({'error': 'Image expired from cache, please re-run the analysis'}), 404
+
+            def render():
+                pixels = source.tile(level, col, row)
+                if pixels is None:
+                    raise KeyError('tile out of range')
+                if layer == 'original':
+                    view = pixels
+                elif layer == 'hue':
+                    view = render_scientific('hue', pixels, source.meta)
+                else:
+                    view = render_angle_map(pixels, float(match.group(2)), float(match.group(3)))
+                return encode_jpeg(view)
+
+            cache_key = render_key(key, 'tile', layer=layer, level=level, col=col, row=row)
+            try:
+                data = RENDERS.get_or_render(cache_key, render)
+            except KeyError:
+                return jsonify({'error': 'Tile out of range'}), 404
+            response = send_file(io.BytesIO(data), mimetype='image/jpeg', etag=cache_key,
+                                 conditional=True, max_age=86400)
+            response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+            return response
+
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Tile Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/viewer/<key>')
+def tile_viewer(key):
+    """Deep-zoom viewer for an analysed image (original / hue / angle layers)."""
+    angle_layer = request.args.get('angle', 'angle-0-60')
+    if not TILE_LAYER_PATTERN.match(angle_layer):
+        angle_layer = 'angle-0-60'
+    return render_template('tile_viewer.html', key=key, angle_layer=angle_layer)
+
+@app.route('/angle_map/<key>/<name>')
+def angle_map_render(key, name):
+    """
+    One angle-map rendering of an analysed image (see angle_map_outputs), computed
+    on first request from the stored image and then served from the render cache.
+
+    Query args:
+        zero, ninety: hue calibration (0° and 90° anchors)
+    """
+    try:
+        if name not in ANGLE_MAP_FILES:
+            return jsonify({'error': f"Unknown angle map '{name}'"}), 404
+        zero_hue = request.args.get('zero', 0, type=float)
+        ninety_hue = request.args.get('ninety', 60, type=float)
+        params = {'zero': round(zero_hue, 3), 'ninety': round(ninety_hue, 3)}
+        kind, mimetype = ANGLE_MAP_FILES[name]
+        cache_key = render_key(key, kind, **params)
+
+        def render():
+            stored = stored_image(key)
+            if stored is None:
+                raise KeyError('image expired')
+            files = render_angle_map_files(stored.image, zero_hue, ninety_hue)
+            # The other renderings come from the same pass; keep them for their URLs
+            for other_kind, other_type in ANGLE_MAP_FILES.values():
+                if other_kind != kind:
+                    RENDERS.put(render_key(key, other_kind, **params), files[other_kind], other_type)
+            return bytes(files[kind])
+
+        try:
+            data = RENDERS.get_or_render(cache_key, render, mimetype)
+        except KeyError:
+            return jsonify({'error': 'Image expired from cache, please re-run the analysis'}), 404
+        response = send_file(io.BytesIO(data), mimetype=mimetype, etag=cache_key,
+                             conditional=True, max_age=86400, as_attachment=name.endswith('.npz'),
+                             download_name=f"{cache_key}.{name.rsplit('.', 1)[1]}")
+        response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+        return response
+
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Angle Map Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Largest /analyze_grid layout: blocks per side of a grid, blocks in total
+MAX_GRID_SIDE = 1000
+MAX_GRID_BLOCKS = MAX_GRID_SIDE * MAX_GRID_SIDE
+
+def int_param(data, key, default, low=1, high=None):
+    """Integer request parameter `key` within [low, high]; raises ValueError naming it."""
+    value = data.get(key, default)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = float('nan')
+    if isinstance(value, bool) or not number.is_integer():
+        raise ValueError(f"{key} must be an integer")
+    if number < low or (high is not None and number > high):
+        raise ValueError(f"{key} must be between {low} and {high}" if high is not None else f"{key} must be at least {low}")
+    return int(number)
+
+def float_param(data, key, default, low, high):
+    """Finite number request parameter `key` within [low, high]; raises ValueError naming it."""
+    value = data.get(key, default)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = float('nan')
+    if isinstance(value, bool) or not low <= number <= high:
+        raise ValueError(f"{key} must be a number between {low:g} and {high:g}")
+    return number
+
+def grid_params(data):
+    """
+    Validated layout and ROIs of an /analyze_grid request, checked before decoding:
+    ({'block_height', 'block_width'} or {'rows', 'cols'}, [(x, y, width, height), ...]).
+    Raises ValueError for malformed values.
+    """
+    if data.get('block_height') and data.get('block_width'):
+        layout = {'block_height': int_param(data, 'block_height', None),
+                  'block_width': int_param(data, 'block_width', None)}
+    else:
+        layout = {'rows': int_param(data, 'grid_rows', 10, high=MAX_GRID_SIDE),
+                  'cols': int_param(data, 'grid_cols', 10, high=MAX_GRID_SIDE)}
+    rois = data.get('rois') or []
+    if not isinstance(rois, list):
+        raise ValueError("rois must be a list of {x, y, width, height} rectangles")
+    parsed = []
+    for i, roi in enumerate(rois):
+        if not isinstance(roi, dict):
+            raise ValueError(f"rois[{i}] must be an {{x, y, width, height}} rectangle")
+        try:
+            rect = tuple(float(roi.get(k, 0)) for k in ('x', 'y', 'width', 'height'))
+        except (TypeError, ValueError):
+            raise ValueError(f"rois[{i}] coordinates must be numbers")
+        if not all(np.isfinite(rect)) or rect[2] < 0 or rect[3] < 0:
+            raise ValueError(f"rois[{i}] must have finite coordinates and a non-negative size")
+        parsed.append(rect)
+    return layout, parsed
+
+@app.route('/analyze_grid', methods=['POST'])
+def analyze_grid():
+    """
+    2-D orientation map: mean/std angle, circular mean hue and valid-pixel count
+    for every block of a grid and for any number of rectangular ROIs.
+
+    JSON body:
+        image / image_key (+ crop, preview_scale): as for /analyze
+        zero_hue, ninety_hue: calibration (also accepts force_zero_hue/force_ninety_hue; default 0/60)
+        grid_rows, grid_cols: evenly spread grid (default 10 x 10), or
+        block_height, block_width: fixed block size in pixels
+        rois: optional list of {x, y, width, height} rectangles in image pixels
+    """
+    try:
+        data = request.json
+        if not data or ('image' not in data and 'image_key' not in data):
+            return jsonify({'error': 'No image data provided'}), 400
+
+        zero_hue = float(data.get('zero_hue', data.get('force_zero_hue')) or 0)
+        ninety_hue = data.get('ninety_hue', data.get('force_ninety_hue'))
+        ninety_hue = float(ninety_hue) if ninety_hue is not None else 60.0
+        layout, roi_rects = grid_params(data)
+
+        image_bytes = request_image_bytes(data)
+        if image_bytes is None:
+            return jsonify({'error': 'Uploaded image expired, please upload it again'}), 404
+
+        with admitted_image(image_bytes) as img:
+            if img is None:
+                return jsonify({'error': 'Failed to decode image'}), 400
+            if data.get('crop'):
+                img = crop_preview_rect(img, data['crop'], float(data.get('preview_scale') or 1.0))
+
+            if 'block_height' in layout:
+                blocks = (-(-img.shape[0] // layout['block_height'])) * (-(-img.shape[1] // layout['block_width']))
+                if blocks > MAX_GRID_BLOCKS:
+                    raise ValueError(f"Block size gives {blocks} blocks (limit {MAX_GRID_BLOCKS})")
+
+            # One pass over the pixels; every block/ROI below is O(1)
+            integrals = OrientationIntegrals(img, lambda h: hue_to_angle(h, zero_hue, ninety_hue))
+            if 'block_height' in layout:
+                grid = integrals.blocks(layout['block_height'], layout['block_width'])
+            else:
+                grid = integrals.grid(layout['rows'], layout['cols'])
+            rois = [integrals.region(*rect) for rect in roi_rects]
 
-        # Save images to static/uploads
-        def save_temp_img(image_array, prefix):
-            filename = f"{prefix}_{np.random.randint(10000, 99999)}.jpg"
-            filepath = os.path.join('static', 'uploads', filename)
-            cv2.imwrite(filepath, image_array)
-            return f"/static/uploads/{filename}"
-            
-        original_url = save_temp_img(img, "sc_orig")
-        hue_url = save_temp_img(hue_heatmap, "sc_hue")
-        mask_url = save_temp_img(masked_img, "sc_mask")
-        zone_url = save_temp_img(zone_img, "sc_zones")
-        
-        # 4. Histogram Calculation (ONLY Valid Pixels)
-        valid_hues = h_chan[mask]
-        # Histogram 0-179
-        hist_counts, _ = np.histogram(valid_hues, bins=180, range=(0, 180))
-        
         return jsonify({
             'success': True,
-            'original_url': original_url,
-            'hue_url': hue_url,
-            'mask_url': mask_url,
-            'zone_url': zone_url,
-            'histogram': hist_counts.tolist()
+            'width': integrals.width,
+            'height': integrals.height,
+            'grid': grid,
+            'rois': rois,
+            'color_calibration': {'zero_hue': zero_hue, 'ninety_hue': ninety_hue}
         })
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except AdmissionRejected as e:
+        return busy_response(e)
     except Exception as e:
-        print(f"Scientific Analysis Error: {e}")
+        print(f"Grid Analysis Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analyze_structure_tensor', methods=['POST'])
+def analyze_structure_tensor():
+    """
+    Texture-based orientation (structure tensor) in the zone/depth-profile layout of /analyze.
+
+    JSON body:
+        image / image_key (+ crop, preview_scale): as for /analyze
+        sz_boundary, mz_boundary: zone boundaries in percent of depth (default 33 / 66)
+        sigma_grad, sigma_int: gradient and integration scales in pixels (default 1.5 / 6)
+        maps: also render per-pixel angle and coherence maps
+    """
+    try:
+        data = request.json
+        if not data or ('image' not in data and 'image_key' not in data):
+            return jsonify({'error': 'No image data provided'}), 400
+
+        # Parameters are validated before decoding; malformed values are a 400
+        sigma_grad = float_param(data, 'sigma_grad', 1.5, 0.3, 20)
+        sigma_int = float_param(data, 'sigma_int', 6.0, 0.5, 50)
+        s1 = float_param(data, 'sz_boundary', 33, 0, 100) / 100.0
+        s2 = float_param(data, 'mz_boundary', 66, 0, 100) / 100.0
+
+        image_bytes = request_image_bytes(data)
+        if image_bytes is None:
+            return jsonify({'error': 'Uploaded image expired, please upload it again'}), 404
+
+        with admitted_image(image_bytes) as img:
+            if img is None:
+                return jsonify({'error': 'Failed to decode image'}), 400
+            if data.get('crop'):
+                img = crop_preview_rect(img, data['crop'], float(data.get('preview_scale') or 1.0))
+            rows = structure_tensor.row_statistics(img, sigma_grad, sigma_int, keep_maps=bool(data.get('maps')))
+
+        height = img.shape[0]
+        if s1 > s2: s1 = s2
+        z1_h, z2_h = int(height * s1), int(height * s2)
+
+        response = {
+            'success': True,
+            'method': 'structure_tensor',
+            'parameters': {'sigma_grad': sigma_grad, 'sigma_int': sigma_int},
+            'results': {
+                'SZ': structure_tensor.zone_statistics(rows, 0, z1_h),
+                'MZ': structure_tensor.zone_statistics(rows, z1_h, z2_h),
+                'DZ': structure_tensor.zone_statistics(rows, z2_h, height)
+            },
+            'depth_profile': structure_tensor.depth_profile(rows),
+            'zone_boundaries': {
+                'sz_end': round(s1, 3),
+                'mz_end': round(s2, 3),
+                'sz_boundary': round(s1, 3),
+                'mz_boundary': round(s2, 3)
+            }
+        }
+        if data.get('maps'):
+            fingerprint = image_fingerprint(img)
+            params = {'sg': sigma_grad, 'si': sigma_int}
+            angle_key = render_key(fingerprint, 'st_angle', **params)
+            coherence_key = render_key(fingerprint, 'st_coherence', **params)
+            RENDERS.put(angle_key, cv2.imencode('.png', colorize_angle_map(rows['angle_map']))[1], 'image/png')
+            RENDERS.put(coherence_key, cv2.imencode('.png', rows['coherence_map'])[1], 'image/png')
+            response['maps'] = {
+                'angle_url': f'/render/{angle_key}.png',
+                'coherence_url': f'/render/{coherence_key}.png'
+            }
+        return jsonify(response)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Structure Tensor Analysis Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Upper bound on threshold x calibration x boundary combinations per sweep
+MAX_SWEEP_COMBINATIONS = int(os.environ.get('MAX_SWEEP_COMBINATIONS', 2000))
+
+@app.route('/analyze_sweep', methods=['POST'])
+def analyze_sweep():
+    """
+    Sensitivity analysis: zone statistics and depth profiles for every combination
+    of mask thresholds, calibrations and zone boundaries, from one pass over the image.
+
+    JSON body:
+        image / image_key (+ crop, preview_scale): as for /analyze
+        zone_masks: list of {value, saturation} thresholds for zone statistics (default [V>10 & S>10])
+        profile_masks: list of thresholds for profile and auto calibration (default [V>20])
+        calibrations: list of {zero_hue, ninety_hue} and/or "auto" (default ["auto"])
+        boundaries: list of [sz_boundary, mz_boundary] percentages (default [[33, 66]])
+    """
+    try:
+        data = request.json
+        if not data or ('image' not in data and 'image_key' not in data):
+            return jsonify({'error': 'No image data provided'}), 400
+
+        for key in ('zone_masks', 'profile_masks', 'calibrations', 'boundaries'):
+            if data.get(key) is not None and not isinstance(data[key], list):
+                raise ValueError(f"{key} must be a list")
+        for key in ('zone_masks', 'profile_masks'):
+            if not all(isinstance(m, dict) for m in data.get(key) or []):
+                raise ValueError(f"{key} entries must be {{value, saturation}} thresholds")
+        zone_masks = [mask_thresholds(m, ZONE_MASK) for m in data.get('zone_masks') or [{}]]
+        profile_masks = [mask_thresholds(m, PROFILE_MASK) for m in data.get('profile_masks') or [{}]]
+        calibrations = [param_sweep.calibration_param(c, i) for i, c in enumerate(data.get('calibrations') or ['auto'])]
+        boundaries = [param_sweep.boundary_param(b, i) for i, b in enumerate(data.get('boundaries') or [(33, 66)])]
+        for mask in zone_masks + profile_masks:
+            param_sweep.threshold_index(mask['value'])
+            param_sweep.threshold_index(mask['saturation'])
+        total = len(zone_masks) * len(profile_masks) * len(calibrations) * len(boundaries)
+        if total > MAX_SWEEP_COMBINATIONS:
+            return jsonify({'error': f'Sweep has {total} combinations (limit {MAX_SWEEP_COMBINATIONS})'}), 400
+
+        image_bytes = request_image_bytes(data)
+        if image_bytes is None:
+            return jsonify({'error': 'Uploaded image expired, please upload it again'}), 404
+
+        with admitted_image(image_bytes) as img:
+            if img is None:
+                return jsonify({'error': 'Failed to decode image'}), 400
+            if data.get('crop'):
+                img = crop_preview_rect(img, data['crop'], float(data.get('preview_scale') or 1.0))
+            sweep = param_sweep.run_sweep(img, zone_masks, profile_masks, calibrations, boundaries, analyze_rows)
+
+        sweep['success'] = True
+        sweep['supported_thresholds'] = list(param_sweep.THRESHOLD_STEPS)
+        return jsonify(sweep)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Sweep Error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
         data = request.json
-        if not data or 'image' not in data:
+        if not data or ('image' not in data and 'image_key' not in data):
             return jsonify({'error': 'No image data provided'}), 400
         
-        # Decode base64 
-        image_data = data['image'].split(',')[1] 
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
+        image_bytes = request_image_bytes(data)
+        if image_bytes is None:
+            return jsonify({'error': 'Uploaded image expired, please upload it again'}), 404
+
+        if data.get('progressive'):
+            preview = progressive_preview(image_bytes, data)
+            if preview is not None:
+                return jsonify(preview)
+
+        response = full_analysis(image_bytes, data)
+        if response is None:
             return jsonify({'error': 'Failed to decode image'}), 400
+        return jsonify(response)
 
-        height, width, _ = img.shape
-        
-        # Default Mapping
-        zero_hue = 0   # Red
-        ninety_hue = 60 # Green
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except QualityRejected as e:
+        return jsonify({'error': e.reason, 'quality': e.report}), 422
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        # Check for overrides
-        force_zero = data.get('force_zero_hue')
-        force_ninety = data.get('force_ninety_hue')
-        
-        if force_zero is not None and force_ninety is not None:
-             zero_hue = float(force_zero)
-             ninety_hue = float(force_ninety)
-             print(f"Using forced color calibration: 0°={zero_hue}, 90°={ninety_hue}")
+def full_analysis(image_bytes, data):
+    """
+    The complete /analyze response for an image: the (cached / coalesced) analysis
+    plus the per-request image outputs. Returns None if the image cannot be decoded.
+    """
+    # Interactive tweaks are not recorded; a request opts in with `record: true`,
+    # or by naming its `filename` / `tags` for the results database
+    record = bool(data.get('record') or data.get('filename') or data.get('tags'))
+    analysed = analyze_bytes(image_bytes, data, use_cache=data.get('cache', True),
+                             record=record, source=data.get('filename'), tags=data.get('tags'))
+    if analysed is None:
+        return None
+    response, annotated_jpg = analysed
 
-        
-        # AI Auto-Detection Logic
-        # New flag from frontend
-        use_ai = data.get('use_ai', False)
-        ai_result_info = {}
-        
-        split1_pct = float(data.get('sz_boundary', 33))
-        split2_pct = float(data.get('mz_boundary', 66))
+    # Tiles, angle maps and views decode the image again only when they are
+    # requested (see stored_image); a cached analysis never decodes here
+    remember_source(response['image_fingerprint'], image_bytes, data)
+    add_image_outputs(response, data, annotated_jpg)
+    return response
 
-        if use_ai and AI_AVAILABLE and detector:
-            print("Running AI Detection...")
-            ai_results = detector.detect_zones_and_colors(img)
-            
-            if ai_results.get('success'):
-                # Update boundaries
-                split1_pct = ai_results['sz_boundary']
-                split2_pct = ai_results['mz_boundary']
-                
-                # Update Color Mapping
-                detected_sz_hue = ai_results['sz_hue']
-                detected_dz_hue = ai_results['dz_hue']
-                
-                print(f"AI Detected: SZ Bound={split1_pct}%, MZ Bound={split2_pct}%")
-                print(f"AI Detected Colors: SZ Hue={detected_sz_hue:.1f}, DZ Hue={detected_dz_hue:.1f}")
-                
-                # Update logic if separation is sufficient
-                # Update logic if separation is sufficient AND we aren't using forced values
-                if abs(detected_dz_hue - detected_sz_hue) > 5:
-                    # Only update if NOT forced
-                    if force_zero is None or force_ninety is None:
-                        zero_hue = detected_sz_hue
-                        ninety_hue = detected_dz_hue
-                    else:
-                        print("AI detected colors ignored in favor of forced calibration.")
-                
-                ai_result_info = {
-                    'detected': True,
-                    'sz_hue': round(detected_sz_hue, 1),
-                    'dz_hue': round(detected_dz_hue, 1),
-                    'sz_boundary': split1_pct,
-                    'mz_boundary': split2_pct
-                }
-            else:
-                print("AI Detection returned failure.")
-        
-        # Ensure splits are sorted and within bounds
-        s1 = np.clip(split1_pct / 100.0, 0.0, 1.0)
-        s2 = np.clip(split2_pct / 100.0, 0.0, 1.0)
-        if s1 > s2: s1 = s2
-        
-        if not use_ai and force_zero is None and force_ninety is None:
-             print(f"Manual Recalculation: Detecting colors from zones s1={s1}, s2={s2}")
-             # Get SZ ROI
-             h_px, w_px, _ = img.shape
-             
-             # Helper for circular mean
-             def circular_hue_mean(h_values):
-                 # Hues are 0-179 in OpenCV. Convert to radians 0-2pi
-                 rads = np.deg2rad(h_values * 2.0)
-                 sin_sum = np.sum(np.sin(rads))
-                 cos_sum = np.sum(np.cos(rads))
-                 mean_rad = np.arctan2(sin_sum, cos_sum)
-                 mean_deg = np.rad2deg(mean_rad)
-                 if mean_deg < 0: mean_deg += 360
-                 return mean_deg / 2.0
-
-             # Calculate SZ Hue (0 to s1)
-             z1_h = int(h_px * s1)
-             if z1_h > 0:
-                 roi_sz = img[0:z1_h, :]
-                 hsv_sz = cv2.cvtColor(roi_sz, cv2.COLOR_BGR2HSV)
-                 h_sz = hsv_sz[:, :, 0]
-                 v_sz = hsv_sz[:, :, 2]
-                 mask_sz = v_sz > 20
-                 if np.any(mask_sz):
-                     zero_hue = circular_hue_mean(h_sz[mask_sz])
-            
-             # Calculate DZ Hue (s2 to 1.0)
-             z2_h = int(h_px * s2)
-             if z2_h < h_px:
-                 roi_dz = img[z2_h:h_px, :]
-                 hsv_dz = cv2.cvtColor(roi_dz, cv2.COLOR_BGR2HSV)
-                 h_dz = hsv_dz[:, :, 0]
-                 v_dz = hsv_dz[:, :, 2]
-                 mask_dz = v_dz > 20
-                 if np.any(mask_dz):
-                     ninety_hue = circular_hue_mean(h_dz[mask_dz])
-             
-             print(f"Manually Detected: Zero={zero_hue:.1f}, Ninety={ninety_hue:.1f}") 
-        
-        z1_h = int(height * s1)
-        z2_h = int(height * s2)
-        
-        zone_sz = img[0:z1_h, :]
-        zone_mz = img[z1_h:z2_h, :]
-        zone_dz = img[z2_h:height, :]
-        
-        results = {
-            "SZ": analyze_zone(zone_sz, zero_hue, ninety_hue),
-            "MZ": analyze_zone(zone_mz, zero_hue, ninety_hue),
-            "DZ": analyze_zone(zone_dz, zero_hue, ninety_hue)
-        }
+def progressive_preview(image_bytes, data):
+    """
+    Fast preview /analyze response from a reduced decode (long side about
+    PROGRESSIVE_SIDE pixels, 1/4 - 1/8 of a typical slide) with a heuristic error
+    estimate, and queue the exact full-resolution analysis as a refinement job.
+    `replaces` (the job of the user's previous preview) is released, and cancelled
+    if no other request shares it and it has not started yet. Returns None when a
+    preview would not help: the exact result is already cached or the image is
+    small enough to analyse directly.
+    """
+    job_id = result_key(content_hash(image_bytes), analysis_params(data), ANALYSIS_VERSION)
+    if data.get('replaces') and data['replaces'] != job_id:
+        REFINEMENTS.cancel(data['replaces'])
+    if data.get('cache', True) and result_cache().get(job_id) is not None:
+        return None
+    dims = image_dimensions(image_bytes)
+    if dims is None or max(dims) < 2 * PROGRESSIVE_SIDE:
+        return None
 
-        # Create Annotated Image
-        annotated_img = img.copy()
-        line_color = (0, 255, 255) 
-        thickness = 2
-        cv2.line(annotated_img, (0, z1_h), (width, z1_h), line_color, thickness)
-        cv2.line(annotated_img, (0, z2_h), (width, z2_h), line_color, thickness)
-        
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        cv2.putText(annotated_img, "SZ", (10, min(z1_h - 10, 30)), font, 0.8, (255,255,255), 2)
-        cv2.putText(annotated_img, "MZ", (10, min(z2_h - 10, z1_h + 30)), font, 0.8, (255,255,255), 2)
-        cv2.putText(annotated_img, "DZ", (10, min(height - 10, z2_h + 30)), font, 0.8, (255,255,255), 2)
-        
-        filename = f"analyzed_{np.random.randint(1000, 9999)}.jpg"
-        filepath = os.path.join('static', 'uploads', filename)
-        cv2.imwrite(filepath, annotated_img)
-        
-        # Calculate Depth Profile
-        bins = 100
-        raw_profile = []
-        
-        for i in range(bins):
-            t_start = i / float(bins)
-            t_end = (i + 1) / float(bins)
-            
-            # Top is 0, Bottom is 1
-            y_start = int(height * t_start)
-            y_end = int(height * t_end)
-            
-            y_start = max(0, y_start)
-            y_end = min(height, y_end)
-            
-            if y_end <= y_start:
-                 # Fallback for very small images or rounding
-                 y_end = y_start + 1
-            
-            roi = img[y_start:y_end, :]
-            
-            # Analyze this slice
-            hsv_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-            h_roi = hsv_roi[:, :, 0]
-            v_roi = hsv_roi[:, :, 2]
-            
-            mask = v_roi > 20
-            
-            if np.any(mask):
-                 valid_hues = h_roi[mask]
-                 
-                 # Circular mean for hue
-                 rads = np.deg2rad(valid_hues * 2.0)
-                 sin_sum = np.sum(np.sin(rads))
-                 cos_sum = np.sum(np.cos(rads))
-                 mean_rad = np.arctan2(sin_sum, cos_sum)
-                 mean_hue = np.rad2deg(mean_rad)
-                 if mean_hue < 0: mean_hue += 360
-                 mean_hue /= 2.0
-                 
-                 # Colors
-                 avg_b = np.mean(roi[:,:,0][mask])
-                 avg_g = np.mean(roi[:,:,1][mask])
-                 avg_r = np.mean(roi[:,:,2][mask])
-                 intensity = np.mean(v_roi[mask])
-                 
-                 # Std Dev (Angle)
-                 # Map hue to angle first, then std? 
-                 # Angle = (Hue - Zero) / (Ninety - Zero) * 90
-                 # For simplicity, calculate std of hues then convert scale
-                 std_hue = np.std(valid_hues)
-                 scale_factor = 90.0 / (abs(ninety_hue - zero_hue) if abs(ninety_hue - zero_hue) > 1 else 1.0)
-                 std_angle = std_hue * scale_factor
-                 
-                 # Angle Calculation
-                 # Helper to map hue to angle
-                 def hue_to_angle(h, z, n):
-                      # Handle wrapping if needed, but simple linear for now as per previous logic
-                      # dist logic:
-                      # if z < n: 0 at z, 90 at n
-                      total_range = n - z
-                      if abs(total_range) < 0.1: return 0
-                      
-                      curr = h - z
-                      ratio = curr / total_range
-                      ang = ratio * 90.0
-                      return np.clip(ang, 0, 90)
-
-                 angle = hue_to_angle(mean_hue, zero_hue, ninety_hue)
-                 
-                 # Hex
-                 def rgb_to_hex(r, g, b):
-                     return "#{:02x}{:02x}{:02x}".format(int(r), int(g), int(b))
-                     
-                 raw_profile.append({
-                     'thickness': round((t_start + t_end)/2, 3),
-                     'angle': round(angle, 2),
-                     'std': round(std_angle, 2),
-                     'mean_hue': round(mean_hue, 1),
-                     'avg_r': int(avg_r),
-                     'avg_g': int(avg_g),
-                     'avg_b': int(avg_b),
-                     'avg_hex': rgb_to_hex(avg_r, avg_g, avg_b),
-                     'intensity': int(intensity)
-                 })
-            else:
-                 # Empty bin
-                 raw_profile.append(None)
-
-        # Interpolation to fill gaps
-        filled_profile = []
-        for i in range(bins):
-            item = raw_profile[i]
-            thickness = round(((i / float(bins)) + ((i + 1) / float(bins))) / 2, 3)
-            
-            if item is None:
-                # Find previous valid
-                prev_valid = None
-                for k in range(i-1, -1, -1):
-                    if raw_profile[k] is not None:
-                        prev_valid = raw_profile[k]
-                        break
-                
-                # Find next valid
-                next_valid = None
-                for k in range(i+1, bins):
-                    if raw_profile[k] is not None:
-                        next_valid = raw_profile[k]
-                        break
-                
-                # Interpolate
-                if prev_valid and next_valid:
-                     # Simple linear average for middle gap
-                     # Improve to proper weighted interp if needed, but average is safe for small gaps
-                     fill_item = {
-                         'thickness': thickness,
-                         'angle': round((prev_valid['angle'] + next_valid['angle'])/2, 2),
-                         'std': round((prev_valid['std'] + next_valid['std'])/2, 2),
-                         'mean_hue': round((prev_valid['mean_hue'] + next_valid['mean_hue'])/2, 1),
-                         'avg_r': int((prev_valid['avg_r'] + next_valid['avg_r'])/2),
-                         'avg_g': int((prev_valid['avg_g'] + next_valid['avg_g'])/2),
-                         'avg_b': int((prev_valid['avg_b'] + next_valid['avg_b'])/2),
-                         'avg_hex': prev_valid['avg_hex'], # Just reuse hex
-                         'intensity': int((prev_valid['intensity'] + next_valid['intensity'])/2)
-                     }
-                     filled_profile.append(fill_item)
-                elif prev_valid:
-                    # propagate forward
-                    new_item = prev_valid.copy()
-                    new_item['thickness'] = thickness
-                    filled_profile.append(new_item)
-                elif next_valid:
-                    # propagate backward
-                    new_item = next_valid.copy()
-                    new_item['thickness'] = thickness
-                    filled_profile.append(new_item)
-                else:
-                     # No data at all?
-                     filled_profile.append({
-                         'thickness': thickness,
-                         'angle': 0, 'std': 0, 'mean_hue': 0, 
-                         'avg_r':0, 'avg_g':0, 'avg_b':0, 'avg_hex':'#000000', 'intensity':0
-                     })
-            else:
-                filled_profile.append(item)
+    started = time.perf_counter()
+    img, scale = reduced_image(image_bytes, data, PROGRESSIVE_SIDE)
+    if img is None:
+        return None
+    if data.get('crop'):
+        img = crop_preview_rect(img, data['crop'], float(data.get('preview_scale') or 1.0) / scale)
+    # The quality gate runs on the same decode (raises QualityRejected)
+    quality = None
+    if QUALITY is not None and data.get('quality_gate', True):
+        quality = QUALITY.check(shrink(img, QUALITY.max_side), started)
+    response, annotated_jpg = analyze_image(img, data)
+    if quality is not None:
+        response['quality'] = quality
+    if data.get('inline_images'):
+        response['annotated_image_data'] = jpeg_data_url(annotated_jpg)
+    # Tiles and angle maps need the full-resolution image; they come with the final result
+    response['tiles'] = None
 
-        depth_profile = filled_profile
-            
-        zone_boundaries = {
-            'sz_end': round(s1, 3), # Top boundary (0 to s1)
-            'mz_end': round(s2, 3), # Middle boundary (s1 to s2)
-            'sz_boundary': round(s1, 3), 
-            'mz_boundary': round(s2, 3)
-        }
-            
-        return jsonify({
-            'success': True, 
-            'results': results, 
-            'annotated_image_url': f'/static/uploads/{filename}',
-            'depth_profile': depth_profile,
-            'zone_boundaries': zone_boundaries,
-            'ai_info': ai_result_info,
-            'color_calibration': {
-                'zero_hue': zero_hue,
-                'ninety_hue': ninety_hue
-            }
-        })
-        
+    # The same analysis at half the preview resolution: twice the change estimates the
+    # preview's error (resolution error roughly halves with every doubling); a heuristic, not a bound
+    half = cv2.resize(img, (max(1, img.shape[1] // 2), max(1, img.shape[0] // 2)), interpolation=cv2.INTER_AREA)
+    coarse, _ = analyze_image(half, data)
+    error_estimate = deviation(response, coarse, factor=2)
+
+    final_data = {k: v for k, v in data.items() if k not in ('progressive', 'replaces')}
+    REFINEMENTS.submit(job_id, response, lambda: refine(image_bytes, final_data))
+    response['progressive'] = {
+        'stage': 'preview',
+        'job': job_id,
+        'scale': round(scale, 4),
+        'error_estimate': error_estimate,
+        'refined_url': f'/analyze/refined/{job_id}',
+        'events_url': f'/analyze/refined/{job_id}/events'
+    }
+    return response
+
+def reduced_image(image_bytes, data, side):
+    """
+    The image at reduced resolution (long side at least `side` where possible) and its
+    scale relative to the original. Uploads from /convert_image reuse their stored
+    preview pyramid; other images are decoded at 1/2 - 1/8 size under admission control.
+    Returns (None, None) if the image cannot be decoded.
+    """
+    if data.get('image_key'):
+        stored = load_preview(data['image_key'], image_bytes)
+        if stored is None:
+            return None, None
+        height, width = stored.shape[:2]
+        level, img = stored.level_for_width(int(side * width / max(height, width)))
+        img = shrink(img, side)
+        return img, stored.meta['scale'] * img.shape[1] / float(width)
+    with ADMISSION.admit(decode_cost(image_bytes, side)):
+        return decode_small(image_bytes, side)
+
+def refine(image_bytes, data):
+    """Full-resolution analysis of a refinement job; waits out admission rejections."""
+    while True:
+        try:
+            return full_analysis(image_bytes, data)
+        except AdmissionRejected as e:
+            time.sleep(e.retry_after)
+
+def refined_payload(job_id, job):
+    """(JSON body, HTTP status) of a finished refinement job."""
+    if isinstance(job.error, QualityRejected):
+        return {'error': job.error.reason, 'quality': job.error.report}, 422
+    if isinstance(job.error, CancelledError):
+        return {'error': str(job.error)}, 409
+    if job.error is not None:
+        return {'error': str(job.error)}, 500
+    if job.result is None:
+        return {'error': 'Failed to decode image'}, 400
+    return dict(job.result, progressive={
+        'stage': 'final',
+        'job': job_id,
+        'preview_deviation': deviation(job.preview, job.result)
+    }), 200
+
+@app.route('/analyze/refined/<job_id>')
+def analyze_refined(job_id):
+    """Final result of a progressive /analyze request; ?wait=seconds long-polls (max 60)."""
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), 60)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    job = REFINEMENTS.wait(job_id, wait)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired refinement job'}), 404
+    if not job.done.is_set():
+        return jsonify({'status': job.state()}), 202
+    payload, status = refined_payload(job_id, job)
+    return jsonify(payload), status
+
+def event_stream(generate):
+    """
+    Server-sent events response for the generator function `generate`, holding one of
+    EVENT_STREAMS until the client disconnects or the stream ends. When all are taken
+    the answer is 503: EventSource gives up on it and the pages long-poll instead.
+    """
+    release = EVENT_STREAMS.acquire()
+    if release is None:
+        response = jsonify({'error': 'Too many open event streams; poll for the result instead',
+                            'retry_after': 5})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    # The WSGI server closes the iterable on disconnect as well as at the end
+    return Response(ClosingIterator(generate(), release), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/analyze/refined/<job_id>/events')
+def analyze_refined_events(job_id):
+    """Server-sent events: one `final` (or `failed`) event when the refinement finishes."""
+    job = REFINEMENTS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired refinement job'}), 404
+
+    def stream():
+        while not job.done.wait(15):
+            yield ': keep-alive\n\n'
+        payload, status = refined_payload(job_id, job)
+        yield f"event: {'final' if status == 200 else 'failed'}\ndata: {json.dumps(payload)}\n\n"
+
+    return event_stream(stream)
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """
+    Open a live tuning session. The image is sent once: `image`, `image_key`, or the
+    `image_fingerprint` of an /analyze result whose image is still in memory or
+    can be decoded again from its source (no upload at all). Accepts crop /
+    preview_scale, zone_mask / profile_mask and the initial tuning parameters
+    (sz_boundary, mz_boundary, force_zero_hue, force_ninety_hue). Returns the first result with the session's URLs.
+    """
+    try:
+        data = request.json or {}
+        params = {k: data[k] for k in TUNABLE if k in data}
+        apply_deltas(DEFAULT_PARAMS, params)
+        masks = {'zone': mask_thresholds(data.get('zone_mask'), ZONE_MASK),
+                 'profile': mask_thresholds(data.get('profile_mask'), PROFILE_MASK)}
+
+        stored = stored_image(data['image_fingerprint']) if data.get('image_fingerprint') else None
+        if stored is not None:
+            img = stored.image
+        elif 'image' in data or 'image_key' in data:
+            image_bytes = request_image_bytes(data)
+            if image_bytes is None:
+                return jsonify({'error': 'Uploaded image expired, please upload it again'}), 404
+            if QUALITY is not None and data.get('quality_gate', True):
+                quality_report(image_bytes, data)
+            with admitted_image(image_bytes) as img:
+                if img is not None and data.get('crop'):
+                    img = crop_preview_rect(img, data['crop'], float(data.get('preview_scale') or 1.0))
+            if img is None:
+                return jsonify({'error': 'Failed to decode image'}), 400
+        elif data.get('image_fingerprint'):
+            return jsonify({'error': 'Image is no longer in memory, please send it again'}), 404
+        else:
+            return jsonify({'error': 'No image data provided'}), 400
+
+        with ADMISSION.admit(img.shape[0] * img.shape[1]):
+            stats = row_statistics(img, masks['zone'], masks['profile'])
+        session = SESSIONS.create(img, stats, params, session_result,
+                                  meta={'masks': masks, 'image_fingerprint': image_fingerprint(img)})
+        return jsonify(dict(session.result, version=session.version,
+                            params_url=f'/sessions/{session.id}/params',
+                            events_url=f'/sessions/{session.id}/events'))
+
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except QualityRejected as e:
+        return jsonify({'error': e.reason, 'quality': e.report}), 422
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def session_result(session):
+    """/analyze-shaped result for a tuning session's current parameters, from its row statistics."""
+    params = session.params
+    zero, ninety = params['force_zero_hue'], params['force_ninety_hue']
+    forced = zero is not None and ninety is not None
+    analysis = analyze_rows(session.stats, params['sz_boundary'], params['mz_boundary'],
+                            zero if forced else 0, ninety if forced else 60,
+                            calibrate=zero is None and ninety is None)
+    return {
+        'success': True,
+        'session': session.id,
+        'params': dict(params),
+        'results': analysis['results'],
+        'annotated_image_url': f"/sessions/{session.id}/annotated.jpg?z1={analysis['z1_h']}&z2={analysis['z2_h']}",
+        'depth_profile': analysis['depth_profile'],
+        'zone_boundaries': analysis['zone_boundaries'],
+        'ai_info': {},
+        'color_calibration': {
+            'zero_hue': analysis['zero_hue'],
+            'ninety_hue': analysis['ninety_hue']
+        },
+        'masks': session.meta['masks'],
+        'image_fingerprint': session.meta['image_fingerprint']
+    }
+
+@app.route('/sessions/<session_id>/params', methods=['POST'])
+def session_params(session_id):
+    """Apply tuning parameter deltas; the new result is pushed to the session's event stream."""
+    try:
+        version = SESSIONS.update(session_id, request.json or {}, session_result)
+    except SessionNotFound:
+        return jsonify({'error': 'Unknown or expired tuning session'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'version': version})
+
+@app.route('/sessions/<session_id>', methods=['GET', 'DELETE'])
+def tuning_session(session_id):
+    """
+    Latest result of a tuning session; ?after=version&wait=seconds long-polls for a
+    newer one (max 60). DELETE closes the session.
+    """
+    try:
+        if request.method == 'DELETE':
+            SESSIONS.close(session_id)
+            return jsonify({'closed': session_id})
+        session = SESSIONS.get(session_id)
+    except SessionNotFound:
+        return jsonify({'error': 'Unknown or expired tuning session'}), 404
+    try:
+        after = int(request.args.get('after', 0))
+        wait = min(max(float(request.args.get('wait', 0)), 0), 60)
+    except ValueError:
+        return jsonify({'error': 'after must be a version number and wait a number of seconds'}), 400
+    version, result = session.wait(after, wait)
+    if session.closed:
+        return jsonify({'error': 'Unknown or expired tuning session'}), 404
+    return jsonify(dict(result, version=version))
+
+@app.route('/sessions/<session_id>/events')
+def session_events(session_id):
+    """
+    Server-sent events: a `result` event for every newer result than ?after=version
+    (only the latest one when several updates land between two sends), `closed`
+    when the session is closed or expires.
+    """
+    try:
+        session = SESSIONS.get(session_id)
+        after = int(request.args.get('after', 0))
+    except SessionNotFound:
+        return jsonify({'error': 'Unknown or expired tuning session'}), 404
+    except ValueError:
+        return jsonify({'error': 'after must be a version number'}), 400
+
+    def stream():
+        sent = after
+        while True:
+            version, result = session.wait(sent, 15)
+            if session.closed:
+                yield 'event: closed\ndata: {}\n\n'
+                return
+            if version == sent:
+                yield ': keep-alive\n\n'
+                continue
+            sent = version
+            yield f"event: result\ndata: {json.dumps(dict(result, version=version))}\n\n"
+
+    return event_stream(stream)
+
+@app.route('/sessions/<session_id>/annotated.jpg')
+def session_annotated(session_id):
+    """Annotated image of a tuning session for the boundary rows ?z1=&z2= (rendered on request)."""
+    try:
+        session = SESSIONS.get(session_id)
+    except SessionNotFound:
+        return jsonify({'error': 'Unknown or expired tuning session'}), 404
+    height = session.image.shape[0]
+    z1 = min(max(request.args.get('z1', 0, type=int), 0), height)
+    z2 = min(max(request.args.get('z2', height, type=int), z1), height)
+    key = render_key(session.meta['image_fingerprint'], 'annotated', z1=z1, z2=z2)
+    jpg = RENDERS.get_or_render(key, lambda: encode_jpeg(render_annotated(session.image, z1, z2)))
+    return send_file(io.BytesIO(jpg), mimetype='image/jpeg', etag=key, conditional=True, max_age=3600)
+
+def analysis_params(data):
+    """
+    Normalised parameters that determine an /analyze result, for cache keys:
+    equivalent requests (defaults spelled out or not, ints vs floats, a lone
+    forced hue that is ignored anyway) map to the same dict. The quality gate is
+    part of it, so a result computed with `quality_gate: false` (or under other
+    gate settings) is never served to, or shared with, a gated request.
+    """
+    forced = data.get('force_zero_hue') is not None and data.get('force_ninety_hue') is not None
+    crop = data.get('crop')
+    use_ai = bool(data.get('use_ai', False))
+    return {
+        'sz_boundary': float(data.get('sz_boundary', 33)),
+        'mz_boundary': float(data.get('mz_boundary', 66)),
+        'use_ai': use_ai,
+        'zone_model': zone_model_param(data.get('zone_model')) if use_ai else None,
+        'force_zero_hue': float(data['force_zero_hue']) if forced else None,
+        'force_ninety_hue': float(data['force_ninety_hue']) if forced else None,
+        'zone_mask': mask_thresholds(data.get('zone_mask'), ZONE_MASK),
+        'profile_mask': mask_thresholds(data.get('profile_mask'), PROFILE_MASK),
+        'crop': {k: round(float(v), 3) for k, v in sorted(crop.items())} if crop else None,
+        'preview_scale': float(data.get('preview_scale') or 1.0) if crop else None,
+        'quality_gate': quality_gate_param(data)
+    }
+
+def quality_gate_param(data):
+    """Settings of the quality gate a request passes (mode, limits, check size), or None if off."""
+    if QUALITY is None or not data.get('quality_gate', True):
+        return None
+    return {'mode': QUALITY.mode, 'limits': QUALITY.limits, 'max_side': QUALITY.max_side}
+
+def fit_pooled_zone_model(sources, samples_per_image=20000):
+    """
+    Fit one SZ/MZ/DZ colour model on a stratified sample pooled from several images.
+
+    Args:
+        sources: iterable of (encoded image bytes, {crop, preview_scale}); images are
+            decoded one at a time under admission control
+        samples_per_image: pixels sampled from each image
+    """
+    detector = get_detector()
+    if detector is None:
+        raise RuntimeError(f"AI zone detector is not available: {_detector_error}")
+
+    def images():
+        for image_bytes, options in sources:
+            with admitted_image(image_bytes) as img:
+                if img is None:
+                    continue
+                if options.get('crop'):
+                    img = crop_preview_rect(img, options['crop'], float(options.get('preview_scale') or 1.0))
+                yield img
+
+    return zone_model_param(detector.fit_zone_model(images(), samples_per_image))
+
+def analyze_bytes(image_bytes, data, use_cache=True, keep_image=True, record=False, source=None, tags=None):
+    """
+    /analyze without the HTTP layer (also used by batch runs and the watch-folder
+    daemon): result cache, coalescing of identical concurrent analyses, admission
+    control and the worker pool. With `record`, the result is recorded in the
+    results database under `source` (file name) with `tags`. Sets `cached`,
+    `coalesced` and `sample_id` (None unless recorded) on the response.
+    Returns (response, annotated JPEG bytes), or None if the image cannot be decoded.
+    """
+    image_hash = content_hash(image_bytes)
+    params = analysis_params(data)
+    cache_key = result_key(image_hash, params, ANALYSIS_VERSION)
+    cached = result_cache().get(cache_key) if use_cache else None
+    if cached is not None:
+        response, annotated_jpg = cached
+        response['cached'], response['coalesced'] = True, False
+        RENDERS.put(annotated_render_key(response), annotated_jpg)
+    else:
+        # Concurrent identical requests wait for one analysis and share it
+        analysed, coalesced = ANALYSES.run(
+            cache_key, lambda: run_analysis(image_bytes, data, cache_key, keep_image))
+        if analysed is None:
+            return None
+        response, annotated_jpg = analysed
+        response['cached'], response['coalesced'] = False, coalesced
+
+    response['sample_id'] = None
+    if record and results_db() is not None:
+        try:
+            response['sample_id'] = results_db().record(
+                cache_key, image_hash, ANALYSIS_VERSION, response, params['use_ai'], source, tags)
+        except Exception as e:
+            print(f"Results DB Error: {e}")
+    return response, annotated_jpg
+
+def run_analysis(image_bytes, data, cache_key, keep_image=True):
+    """
+    Decode and analyse an image under admission control, store the result in the
+    result cache and (with `keep_image`) keep the decoded image for tiles and angle maps.
+    Unless the request sends `quality_gate: false`, the image first passes the
+    quality gate, which raises QualityRejected for blank or washed-out images.
+    Returns (response, annotated JPEG bytes), or None if the image cannot be decoded.
+    """
+    quality = None
+    if QUALITY is not None and data.get('quality_gate', True):
+        quality = quality_report(image_bytes, data)
+    with admitted_image(image_bytes) as img:
+        if img is None:
+            return None
+        if data.get('crop'):
+            img = crop_preview_rect(img, data['crop'], float(data.get('preview_scale') or 1.0))
+        if analysis_pool() is not None:
+            # The worker maps the decoded image from shared memory and gets only the
+            # normalised parameters (never the uploaded image payload)
+            analysis, annotated_jpg = analysis_pool().run(analysis_worker.analyze, img, analysis_params(data))
+            fingerprint = image_fingerprint(img)
+            RENDERS.put(annotated_key(fingerprint, analysis), annotated_jpg)
+            response = analysis_response(img, fingerprint, analysis)
+        else:
+            response, annotated_jpg = analyze_image(img, data)
+        if keep_image:
+            IMAGES.put(response['image_fingerprint'], img)
+    if quality is not None:
+        response['quality'] = quality
+    result_cache().put(cache_key, response, annotated_jpg)
+    return response, annotated_jpg
+
+def quality_report(image_bytes, data):
+    """
+    Quality gate report for the image (and crop) of an /analyze request, measured on
+    a downsampled decode in a few milliseconds. Raises QualityRejected in reject mode;
+    returns None if the image cannot be decoded.
+    """
+    started = time.perf_counter()
+    with ADMISSION.admit(decode_cost(image_bytes, QUALITY.max_side)):
+        img, scale = decode_small(image_bytes, QUALITY.max_side)
+    if img is None:
+        return None
+    if data.get('crop'):
+        img = crop_preview_rect(img, data['crop'], float(data.get('preview_scale') or 1.0) / scale)
+    return QUALITY.check(img, started)
+
+def annotated_render_key(response):
+    """Render-cache key of an /analyze response's annotated image (from its /render URL)."""
+    return response['annotated_image_url'].rsplit('/', 1)[1].split('.')[0]
+
+def add_image_outputs(response, data, annotated_jpg):
+    """
+    Add the per-request parts of an /analyze response that are not cached: the
+    optional angle map URLs and inline annotated image.
+    """
+    calibration = response['color_calibration']
+    if data.get('angle_map'):
+        response['angle_map'] = angle_map_outputs(
+            response['image_fingerprint'], calibration['zero_hue'], calibration['ninety_hue'],
+            response['image_size']['width'], response['image_size']['height'])
+    if data.get('inline_images'):
+        response['annotated_image_data'] = jpeg_data_url(annotated_jpg)
+
+def analyze_image(img, data):
+    """
+    Run the full zone/depth-profile analysis (see zone_analysis.analyze) on a
+    decoded BGR image on this thread.
+
+    Args:
+        img: BGR image array
+        data: request parameters (sz_boundary, mz_boundary, use_ai,
+            force_zero_hue, force_ninety_hue, zone_mask, profile_mask, zone_model)
+
+    Returns:
+        (response dict, annotated JPEG bytes)
+    """
+    params = analysis_params(data)
+    analysis = zone_analysis.analyze(img, params, get_detector() if params['use_ai'] else None)
+    fingerprint = image_fingerprint(img)
+    # Annotated image: rendered once per (image content, boundaries), served from memory
+    annotated_jpg = RENDERS.get_or_render(
+        annotated_key(fingerprint, analysis),
+        lambda: encode_jpeg(render_annotated(img, analysis['z1_h'], analysis['z2_h'])))
+    return analysis_response(img, fingerprint, analysis), annotated_jpg
+
+def annotated_key(fingerprint, analysis):
+    return render_key(fingerprint, 'annotated', z1=analysis['z1_h'], z2=analysis['z2_h'])
+
+def analysis_response(img, fingerprint, analysis):
+    """/analyze response for an analysis of `img` (see zone_analysis.analyze)."""
+    calibration = analysis['color_calibration']
+    return {
+        'success': True,
+        'results': analysis['results'],
+        'annotated_image_url': f'/render/{annotated_key(fingerprint, analysis)}.jpg',
+        'depth_profile': analysis['depth_profile'],
+        'zone_boundaries': analysis['zone_boundaries'],
+        'ai_info': analysis['ai_info'],
+        'color_calibration': calibration,
+        'masks': analysis['masks'],
+        'tiles': tile_urls(fingerprint, calibration['zero_hue'], calibration['ninety_hue']),
+        'image_fingerprint': fingerprint,
+        'image_size': {'width': int(img.shape[1]), 'height': int(img.shape[0])}
+    }
+
 @app.route('/download_excel', methods=['POST'])
 def download_excel():
     """Generate and download Excel file with depth profile data."""
@@ -628,6 +1603,175 @@ def batch():
     """Batch analysis page for multiple images."""
     return render_template('batch.html')
 
+def batch_analysis(image_bytes, settings, source=None, tags=None):
+    """Analysis of one batch-run image: the /analyze response, or None if undecodable."""
+    analysed = analyze_bytes(image_bytes, settings, keep_image=False, record=True, source=source, tags=tags)
+    return analysed[0] if analysed else None
+
+@app.route('/batch_runs', methods=['GET', 'POST'])
+def batch_runs():
+    """List batch runs, or create one: {name, settings: {sz_boundary, mz_boundary, use_ai, ...}, tags}."""
+    if request.method == 'GET':
+        return jsonify({'runs': [{k: v for k, v in r.items() if k != 'items'} for r in batch_run_store().runs()]})
+    try:
+        data = request.json or {}
+        run = batch_run_store().create(data.get('name'), data.get('settings'), data.get('tags'))
+        return jsonify(batch_run_store().status(run['id']))
+    except Exception as e:
+        print(f"Batch Run Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/batch_runs/<run_id>', methods=['GET'])
+def batch_run_status(run_id):
+    """Progress of a batch run; add ?results=1 for the finished results."""
+    try:
+        return jsonify(batch_run_store().status(run_id, include_results=request.args.get('results') == '1'))
+    except RunNotFound:
+        return jsonify({'error': 'Unknown batch run'}), 404
+
+@app.route('/batch_runs/<run_id>/items', methods=['POST'])
+def batch_run_items(run_id):
+    """Upload images to a run: {images: [{filename, image | image_key, crop?, preview_scale?}]}."""
+    try:
+        data = request.json or {}
+        added = []
+        for entry in data.get('images', []):
+            image_bytes = request_image_bytes(entry)
+            if image_bytes is None:
+                return jsonify({'error': f"Uploaded image {entry.get('filename')} expired, please upload it again"}), 404
+            added.append(batch_run_store().add_item(run_id, entry.get('filename') or 'image', image_bytes, entry))
+        return jsonify({'items': added})
+    except RunNotFound:
+        return jsonify({'error': 'Unknown batch run'}), 404
+    except Exception as e:
+        print(f"Batch Run Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/batch_runs/<run_id>/start', methods=['POST'])
+def batch_run_start(run_id):
+    """Start or resume a run; images that already have a result are skipped."""
+    try:
+        started = batch_run_store().start(run_id)
+        return jsonify(dict(batch_run_store().status(run_id), started=started))
+    except RunNotFound:
+        return jsonify({'error': 'Unknown batch run'}), 404
+
+@app.route('/batch_runs/<run_id>/pause', methods=['POST'])
+def batch_run_pause(run_id):
+    """Stop a run after the image in progress."""
+    try:
+        batch_run_store().pause(run_id)
+        return jsonify(batch_run_store().status(run_id))
+    except RunNotFound:
+        return jsonify({'error': 'Unknown batch run'}), 404
+
+@app.route('/batch_runs/<run_id>/export.xlsx')
+def batch_run_export(run_id):
+    """Excel export of the results finished so far (same workbook as /batch_download_excel)."""
+    try:
+        results = batch_run_store().results(run_id)
+        if not results:
+            return jsonify({'error': 'No finished results yet'}), 404
+        return send_file(
+            batch_workbook(results),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'batch_{run_id}_results.xlsx'
+        )
+    except RunNotFound:
+        return jsonify({'error': 'Unknown batch run'}), 404
+    except Exception as e:
+        print(f"Batch Excel Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/zone_model', methods=['POST'])
+def zone_model():
+    """
+    Fit the shared SZ/MZ/DZ colour model of a batch, or of one reference image:
+    {images: [{image | image_key, crop?, preview_scale?}], samples_per_image?}.
+    Send the returned `zone_model` with `use_ai` to /analyze or in batch-run settings.
+    """
+    try:
+        data = request.json or {}
+        entries = data.get('images') or []
+        if not entries:
+            return jsonify({'error': 'No image data provided'}), 400
+        sources = []
+        for entry in entries:
+            image_bytes = request_image_bytes(entry)
+            if image_bytes is None:
+                return jsonify({'error': 'Uploaded image expired, please upload it again'}), 404
+            sources.append((image_bytes, entry))
+        model = fit_pooled_zone_model(sources, int(data.get('samples_per_image', 20000)))
+        return jsonify({'zone_model': model, 'images': len(sources)})
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Zone Model Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def results_db_disabled():
+    return jsonify({'error': 'Results database is disabled (RESULTS_DB is empty)'}), 404
+
+@app.route('/results/query', methods=['POST'])
+def results_query():
+    """Recorded analyses matching the filters in the body (see results_db.py), newest first."""
+    if results_db() is None:
+        return results_db_disabled()
+    try:
+        data = request.json or {}
+        limit = min(int(data.get('limit', 100)), 10000)
+        return jsonify(results_db().query(data, limit, int(data.get('offset', 0))))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Results Query Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/results/aggregate', methods=['POST'])
+def results_aggregate():
+    """
+    Aggregated depth profile and zone angles of one cohort (filters in the body)
+    or of several: {cohorts: {name: filters, ...}, include_filled: true}.
+    """
+    if results_db() is None:
+        return results_db_disabled()
+    try:
+        data = request.json or {}
+        include_filled = bool(data.get('include_filled', True))
+        if 'cohorts' in data:
+            if not isinstance(data['cohorts'], dict):
+                raise ValueError('cohorts must map cohort names to filters')
+            return jsonify({'cohorts': {name: results_db().aggregate(filters, include_filled)
+                                        for name, filters in data['cohorts'].items()}})
+        return jsonify(results_db().aggregate(data, include_filled))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Results Query Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/results/<int:sample_id>', methods=['GET'])
+def results_sample(sample_id):
+    """One recorded analysis with its depth profile."""
+    if results_db() is None:
+        return results_db_disabled()
+    sample = results_db().sample(sample_id)
+    if sample is None:
+        return jsonify({'error': 'Unknown sample'}), 404
+    return jsonify(sample)
+
+@app.route('/results/<int:sample_id>/tags', methods=['POST'])
+def results_tags(sample_id):
+    """Add/remove tags of a recorded analysis: {add: [...], remove: [...]}."""
+    if results_db() is None:
+        return results_db_disabled()
+    data = request.json or {}
+    tags = results_db().tag(sample_id, data.get('add'), data.get('remove'))
+    if tags is None:
+        return jsonify({'error': 'Unknown sample'}), 404
+    return jsonify({'id': sample_id, 'tags': tags})
+
 @app.route('/batch_download_excel', methods=['POST'])
 def batch_download_excel():
     """Generate and download Excel file with batch analysis results."""
@@ -639,198 +1783,7 @@ def batch_download_excel():
         if not results and not ref_data:
             return jsonify({'error': 'No results provided'}), 400
         
-        wb = Workbook()
-        
-        # --- REFERENCE SHEET (First if exists) ---
-        if ref_data:
-            ws_ref = wb.active
-            ws_ref.title = "Reference Profile"
-            
-            # Metadata
-            ws_ref['A1'] = "Reference Analysis Data"
-            ws_ref['A2'] = f"0-Degree Hue: {ref_data.get('color_calibration',{}).get('zero_hue','N/A')}"
-            ws_ref['A3'] = f"90-Degree Hue: {ref_data.get('color_calibration',{}).get('ninety_hue','N/A')}"
-            ws_ref['B1'] = f"SZ Boundary: {ref_data.get('zone_boundaries',{}).get('sz_boundary',0)*100}%"
-            ws_ref['B2'] = f"MZ Boundary: {ref_data.get('zone_boundaries',{}).get('mz_boundary',0)*100}%"
-            
-            # Headers
-            headers = ['Normalized Thickness', 'Angle', 'Std Dev', 'Zone', 'Avg Hue', 'Intensity']
-            for c, h in enumerate(headers, 1):
-                ws_ref.cell(row=5, column=c, value=h)
-            
-            # Ref Boundaries for Zone calc
-            rb_sz = ref_data.get('zone_boundaries',{}).get('sz_boundary', 0.33)
-            rb_mz = ref_data.get('zone_boundaries',{}).get('mz_boundary', 0.66)
-            
-            # Data
-            for idx, dp in enumerate(ref_data.get('depth_profile', []), start=6):
-                t = dp.get('thickness', 0)
-                ws_ref.cell(row=idx, column=1, value=t)
-                ws_ref.cell(row=idx, column=2, value=dp.get('angle'))
-                ws_ref.cell(row=idx, column=3, value=dp.get('std'))
-
-                
-                # Zone Logic
-                z = 'Unknown'
-                if t <= rb_sz: z='SZ'
-                elif t <= rb_mz: z='MZ'
-                else: z='DZ'
-                
-                ws_ref.cell(row=idx, column=4, value=z)
-                ws_ref.cell(row=idx, column=5, value=dp.get('mean_hue'))
-                ws_ref.cell(row=idx, column=6, value=dp.get('mean_intensity'))
-                
-            # Create next sheet for Summary
-            ws1 = wb.create_sheet("Batch Summary")
-        else:
-            ws1 = wb.active
-            ws1.title = "Summary"
-        
-        # --- BATCH SUMMARY ---
-        ws1['A1'] = 'Filename'
-        ws1['B1'] = 'SZ Mean Angle'
-        ws1['C1'] = 'SZ Std Dev'
-        ws1['D1'] = 'MZ Mean Angle'
-        ws1['E1'] = 'MZ Std Dev'
-        ws1['F1'] = 'DZ Mean Angle'
-        ws1['G1'] = 'DZ Std Dev'
-        
-        sz_means = []
-        mz_means = []
-        dz_means = []
-        
-        for i, result in enumerate(results, start=2):
-            ws1[f'A{i}'] = result.get('filename', f'Image {i-1}')
-            
-            sz_data = result.get('results', {}).get('SZ', {})
-            mz_data = result.get('results', {}).get('MZ', {})
-            dz_data = result.get('results', {}).get('DZ', {})
-            
-            sz_mean = sz_data.get('mean_angle', 0)
-            mz_mean = mz_data.get('mean_angle', 0)
-            dz_mean = dz_data.get('mean_angle', 0)
-            
-            ws1[f'B{i}'] = round(sz_mean, 2)
-            ws1[f'C{i}'] = round(sz_data.get('std_angle', 0), 2)
-            ws1[f'D{i}'] = round(mz_mean, 2)
-            ws1[f'E{i}'] = round(mz_data.get('std_angle', 0), 2)
-            ws1[f'F{i}'] = round(dz_mean, 2)
-            ws1[f'G{i}'] = round(dz_data.get('std_angle', 0), 2)
-            
-            sz_means.append(sz_mean)
-            mz_means.append(mz_mean)
-            dz_means.append(dz_mean)
-        
-        # Add summary rows
-        row = len(results) + 2
-        ws1[f'A{row}'] = 'MEAN'
-        ws1[f'B{row}'] = round(np.mean(sz_means), 2) if sz_means else 0
-        ws1[f'D{row}'] = round(np.mean(mz_means), 2) if mz_means else 0
-        ws1[f'F{row}'] = round(np.mean(dz_means), 2) if dz_means else 0
-        
-        row += 1
-        ws1[f'A{row}'] = 'STD DEV'
-        ws1[f'B{row}'] = round(np.std(sz_means), 2) if sz_means else 0
-        ws1[f'D{row}'] = round(np.std(mz_means), 2) if mz_means else 0
-        ws1[f'F{row}'] = round(np.std(dz_means), 2) if dz_means else 0
-        
-        # Sheet 2: Combined Depth Profile
-        ws2 = wb.create_sheet("Combined Depth Profile")
-        ws2['A1'] = 'Normalized Thickness'
-        
-        from openpyxl.utils import get_column_letter
-
-        # Add columns for each image
-        for i, result in enumerate(results):
-            col = get_column_letter(i + 2)
-            ws2[f'{col}1'] = result.get('filename', f'Image {i+1}')
-        
-        # Add Mean and Std columns
-        mean_col_idx = len(results) + 2
-        std_col_idx = len(results) + 3
-        ws2.cell(row=1, column=mean_col_idx, value='Mean')
-        ws2.cell(row=1, column=std_col_idx, value='Std Dev')
-        
-        # Normalize all depth profiles to 100 bins
-        bins = 100
-        all_profiles = []
-        
-        for result in results:
-            profile = [None] * bins
-            for dp in result.get('depth_profile', []):
-                idx = int(round(dp.get('thickness', 0) * (bins - 1)))
-                if 0 <= idx < bins:
-                    profile[idx] = dp.get('angle')
-            all_profiles.append(profile)
-        
-        # Fill in data
-        for bin_idx in range(bins):
-            row = bin_idx + 2
-            thickness = bin_idx / (bins - 1)
-            ws2.cell(row=row, column=1, value=round(thickness, 3))
-            
-            values = []
-            for i, profile in enumerate(all_profiles):
-                val = profile[bin_idx]
-                ws2.cell(row=row, column=i+2, value=round(val, 2) if val is not None else None)
-                if val is not None:
-                    values.append(val)
-            
-            # Calculate mean and std
-            if values:
-                ws2.cell(row=row, column=mean_col_idx, value=round(np.mean(values), 2))
-                ws2.cell(row=row, column=std_col_idx, value=round(np.std(values), 2))
-        
-        # Save to BytesIO
-        output = io.BytesIO()
-        
-        # Add detailed sheets for EACH image
-        for result in results:
-            fname = result.get('filename', 'Unknown')
-            # Clean filename for Excel sheet naming (max 31 chars, no illegal chars)
-            clean_name = "".join([c for c in fname if c.isalnum() or c in (' ','_','-')]) 
-            sheet_name = clean_name[:30] if len(clean_name)>30 else clean_name
-            
-            ws_detail = wb.create_sheet(sheet_name)
-            
-            # Match Reference Excel Format Headers
-            # Format: Thickness, Mean Angle, Std Dev, Zone, Hue, R, G, B, Hex, Value
-            headers = ['Normalized Thickness', 'Mean Angle (Degrees)', 'Std Dev', 'Zone', 'Avg Hue', 'Red', 'Green', 'Blue', 'Hex', 'Intensity']
-            for c, h in enumerate(headers, 1):
-                ws_detail.cell(row=1, column=c, value=h)
-            
-            sz_b = result.get('zone_boundaries',{}).get('sz_boundary', 0.33)
-            mz_b = result.get('zone_boundaries',{}).get('mz_boundary', 0.66)
-            
-            # Rows
-            for idx, dp in enumerate(result.get('depth_profile', []), start=2):
-                t = dp.get('thickness', 0)
-                ws_detail.cell(row=idx, column=1, value=t)
-                ws_detail.cell(row=idx, column=2, value=dp.get('angle'))
-                ws_detail.cell(row=idx, column=3, value=dp.get('std'))
-                
-                if t <= sz_b: z='SZ'
-                elif t <= mz_b: z='MZ'
-                else: z='DZ'
-                     
-                ws_detail.cell(row=idx, column=4, value=z)
-                ws_detail.cell(row=idx, column=5, value=dp.get('mean_hue')) # Avg Hue
-                
-                # Colors might not be in depth profile for batch? 
-                # analyze_zone -> get_depth_profile currently only packs: thickness, angle, std, mean_hue, mean_intensity
-                # We should try to pack RGB if available, but if not put placeholders
-                
-                ws_detail.cell(row=idx, column=6, value=dp.get('avg_r', 0)) # Red
-                ws_detail.cell(row=idx, column=7, value=dp.get('avg_g', 0)) # Green
-                ws_detail.cell(row=idx, column=8, value=dp.get('avg_b', 0)) # Blue
-                ws_detail.cell(row=idx, column=9, value=dp.get('avg_hex', '#000000')) # Hex
-                ws_detail.cell(row=idx, column=10, value=dp.get('intensity', dp.get('mean_intensity', 0))) # Intensity
-
-
-        wb.save(output)
-        output.seek(0)
-
-        
+        output = batch_workbook(results, ref_data)
         return send_file(
             output,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
@@ -844,37 +1797,333 @@ def batch_download_excel():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def batch_workbook(results, ref_data=None):
+    """
+    Build the batch Excel workbook (summary, combined depth profile and one
+    sheet per image, plus an optional reference sheet) and return it as BytesIO.
+    """
+    wb = Workbook()
+    
+    # --- REFERENCE SHEET (First if exists) ---
+    if ref_data:
+        ws_ref = wb.active
+        ws_ref.title = "Reference Profile"
+        
+        # Metadata
+        ws_ref['A1'] = "Reference Analysis Data"
+        ws_ref['A2'] = f"0-Degree Hue: {ref_data.get('color_calibration',{}).get('zero_hue','N/A')}"
+        ws_ref['A3'] = f"90-Degree Hue: {ref_data.get('color_calibration',{}).get('ninety_hue','N/A')}"
+        ws_ref['B1'] = f"SZ Boundary: {ref_data.get('zone_boundaries',{}).get('sz_boundary',0)*100}%"
+        ws_ref['B2'] = f"MZ Boundary: {ref_data.get('zone_boundaries',{}).get('mz_boundary',0)*100}%"
+        
+        # Headers
+        headers = ['Normalized Thickness', 'Angle', 'Std Dev', 'Zone', 'Avg Hue', 'Intensity']
+        for c, h in enumerate(headers, 1):
+            ws_ref.cell(row=5, column=c, value=h)
+        
+        # Ref Boundaries for Zone calc
+        rb_sz = ref_data.get('zone_boundaries',{}).get('sz_boundary', 0.33)
+        rb_mz = ref_data.get('zone_boundaries',{}).get('mz_boundary', 0.66)
+        
+        # Data
+        for idx, dp in enumerate(ref_data.get('depth_profile', []), start=6):
+            t = dp.get('thickness', 0)
+            ws_ref.cell(row=idx, column=1, value=t)
+            ws_ref.cell(row=idx, column=2, value=dp.get('angle'))
+            ws_ref.cell(row=idx, column=3, value=dp.get('std'))
+
+            
+            # Zone Logic
+            z = 'Unknown'
+            if t <= rb_sz: z='SZ'
+            elif t <= rb_mz: z='MZ'
+            else: z='DZ'
+            
+            ws_ref.cell(row=idx, column=4, value=z)
+            ws_ref.cell(row=idx, column=5, value=dp.get('mean_hue'))
+            ws_ref.cell(row=idx, column=6, value=dp.get('mean_intensity'))
+            
+        # Create next sheet for Summary
+        ws1 = wb.create_sheet("Batch Summary")
+    else:
+        ws1 = wb.active
+        ws1.title = "Summary"
+    
+    # --- BATCH SUMMARY ---
+    ws1['A1'] = 'Filename'
+    ws1['B1'] = 'SZ Mean Angle'
+    ws1['C1'] = 'SZ Std Dev'
+    ws1['D1'] = 'MZ Mean Angle'
+    ws1['E1'] = 'MZ Std Dev'
+    ws1['F1'] = 'DZ Mean Angle'
+    ws1['G1'] = 'DZ Std Dev'
+    
+    sz_means = []
+    mz_means = []
+    dz_means = []
+    
+    for i, result in enumerate(results, start=2):
+        ws1[f'A{i}'] = result.get('filename', f'Image {i-1}')
+        
+        sz_data = result.get('results', {}).get('SZ', {})
+        mz_data = result.get('results', {}).get('MZ', {})
+        dz_data = result.get('results', {}).get('DZ', {})
+        
+        sz_mean = sz_data.get('mean_angle', 0)
+        mz_mean = mz_data.get('mean_angle', 0)
+        dz_mean = dz_data.get('mean_angle', 0)
+        
+        ws1[f'B{i}'] = round(sz_mean, 2)
+        ws1[f'C{i}'] = round(sz_data.get('std_angle', 0), 2)
+        ws1[f'D{i}'] = round(mz_mean, 2)
+        ws1[f'E{i}'] = round(mz_data.get('std_angle', 0), 2)
+        ws1[f'F{i}'] = round(dz_mean, 2)
+        ws1[f'G{i}'] = round(dz_data.get('std_angle', 0), 2)
+        
+        sz_means.append(sz_mean)
+        mz_means.append(mz_mean)
+        dz_means.append(dz_mean)
+    
+    # Add summary rows
+    row = len(results) + 2
+    ws1[f'A{row}'] = 'MEAN'
+    ws1[f'B{row}'] = round(np.mean(sz_means), 2) if sz_means else 0
+    ws1[f'D{row}'] = round(np.mean(mz_means), 2) if mz_means else 0
+    ws1[f'F{row}'] = round(np.mean(dz_means), 2) if dz_means else 0
+    
+    row += 1
+    ws1[f'A{row}'] = 'STD DEV'
+    ws1[f'B{row}'] = round(np.std(sz_means), 2) if sz_means else 0
+    ws1[f'D{row}'] = round(np.std(mz_means), 2) if mz_means else 0
+    ws1[f'F{row}'] = round(np.std(dz_means), 2) if dz_means else 0
+    
+    # Sheet 2: Combined Depth Profile
+    ws2 = wb.create_sheet("Combined Depth Profile")
+    ws2['A1'] = 'Normalized Thickness'
+    
+    from openpyxl.utils import get_column_letter
+
+    # Add columns for each image
+    for i, result in enumerate(results):
+        col = get_column_letter(i + 2)
+        ws2[f'{col}1'] = result.get('filename', f'Image {i+1}')
+    
+    # Add Mean and Std columns
+    mean_col_idx = len(results) + 2
+    std_col_idx = len(results) + 3
+    ws2.cell(row=1, column=mean_col_idx, value='Mean')
+    ws2.cell(row=1, column=std_col_idx, value='Std Dev')
+    
+    # Normalize all depth profiles to 100 bins
+    bins = 100
+    all_profiles = []
+    
+    for result in results:
+        profile = [None] * bins
+        for dp in result.get('depth_profile', []):
+            idx = int(round(dp.get('thickness', 0) * (bins - 1)))
+            if 0 <= idx < bins:
+                profile[idx] = dp.get('angle')
+        all_profiles.append(profile)
+    
+    # Fill in data
+    for bin_idx in range(bins):
+        row = bin_idx + 2
+        thickness = bin_idx / (bins - 1)
+        ws2.cell(row=row, column=1, value=round(thickness, 3))
+        
+        values = []
+        for i, profile in enumerate(all_profiles):
+            val = profile[bin_idx]
+            ws2.cell(row=row, column=i+2, value=round(val, 2) if val is not None else None)
+            if val is not None:
+                values.append(val)
+        
+        # Calculate mean and std
+        if values:
+            ws2.cell(row=row, column=mean_col_idx, value=round(np.mean(values), 2))
+            ws2.cell(row=row, column=std_col_idx, value=round(np.std(values), 2))
+    
+    # Save to BytesIO
+    output = io.BytesIO()
+    
+    # Add detailed sheets for EACH image
+    for result in results:
+        fname = result.get('filename', 'Unknown')
+        # Clean filename for Excel sheet naming (max 31 chars, no illegal chars)
+        clean_name = "".join([c for c in fname if c.isalnum() or c in (' ','_','-')]) 
+        sheet_name = clean_name[:30] if len(clean_name)>30 else clean_name
+        
+        ws_detail = wb.create_sheet(sheet_name)
+        
+        # Match Reference Excel Format Headers
+        # Format: Thickness, Mean Angle, Std Dev, Zone, Hue, R, G, B, Hex, Value
+        headers = ['Normalized Thickness', 'Mean Angle (Degrees)', 'Std Dev', 'Zone', 'Avg Hue', 'Red', 'Green', 'Blue', 'Hex', 'Intensity']
+        for c, h in enumerate(headers, 1):
+            ws_detail.cell(row=1, column=c, value=h)
+        
+        sz_b = result.get('zone_boundaries',{}).get('sz_boundary', 0.33)
+        mz_b = result.get('zone_boundaries',{}).get('mz_boundary', 0.66)
+        
+        # Rows
+        for idx, dp in enumerate(result.get('depth_profile', []), start=2):
+            t = dp.get('thickness', 0)
+            ws_detail.cell(row=idx, column=1, value=t)
+            ws_detail.cell(row=idx, column=2, value=dp.get('angle'))
+            ws_detail.cell(row=idx, column=3, value=dp.get('std'))
+            
+            if t <= sz_b: z='SZ'
+            elif t <= mz_b: z='MZ'
+            else: z='DZ'
+                 
+            ws_detail.cell(row=idx, column=4, value=z)
+            ws_detail.cell(row=idx, column=5, value=dp.get('mean_hue')) # Avg Hue
+            
+            # Colors might not be in depth profile for batch? 
+            # analyze_zone -> get_depth_profile currently only packs: thickness, angle, std, mean_hue, mean_intensity
+            # We should try to pack RGB if available, but if not put placeholders
+            
+            ws_detail.cell(row=idx, column=6, value=dp.get('avg_r', 0)) # Red
+            ws_detail.cell(row=idx, column=7, value=dp.get('avg_g', 0)) # Green
+            ws_detail.cell(row=idx, column=8, value=dp.get('avg_b', 0)) # Blue
+            ws_detail.cell(row=idx, column=9, value=dp.get('avg_hex', '#000000')) # Hex
+            ws_detail.cell(row=idx, column=10, value=dp.get('intensity', dp.get('mean_intensity', 0))) # Intensity
+
+
+    wb.save(output)
+    output.seek(0)
+    return output
+
 @app.route('/convert_image', methods=['POST'])
 def convert_image():
-    """Convert uploaded image (e.g. TIFF) to PNG base64 for browser display."""
+    """
+    Make an uploaded image (e.g. a large TIFF) displayable in the browser.
+
+    The original bytes are kept server-side for full-resolution analysis. The
+    browser gets a multi-level preview pyramid instead: the largest level is
+    at most PREVIEW_MAX_SIDE pixels and is decoded directly at reduced size
+    (IMREAD_REDUCED_*) when the format allows, each further level halves it.
+    Crops made on a preview are mapped back to full resolution by /analyze
+    (send image_key, crop and preview_scale).
+    """
     try:
         file = request.files.get('image')
         if not file:
             return jsonify({'error': 'No file uploaded'}), 400
             
         # Read image to memory
-        in_memory_file = io.BytesIO()
-        file.save(in_memory_file)
-        in_memory_file.seek(0)
-        file_bytes = np.asarray(bytearray(in_memory_file.read()), dtype=np.uint8)
-        
-        # Decode using OpenCV
-        img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        if img is None:
+        image_bytes = file.read()
+        image_key = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+        SOURCES.put(image_key, image_bytes, file.mimetype or 'application/octet-stream')
+
+        stored = load_preview(image_key, image_bytes)
+        if stored is None:
              return jsonify({'error': 'Failed to decode image'}), 400
-             
-        # Encode as PNG
-        _, buffer = cv2.imencode('.png', img)
-        png_base64 = base64.b64encode(buffer).decode('utf-8')
-        
+
+        full_w, full_h = stored.meta['full_width'], stored.meta['full_height']
+        base_scale = stored.meta['scale']
+        levels = []
+        n = 0
+        while True:
+            scale = base_scale / (2 ** n)
+            w, h = int(round(full_w * scale)), int(round(full_h * scale))
+            levels.append({
+                'level': n,
+                'scale': scale,
+                'width': w,
+                'height': h,
+                'url': f"/preview/{image_key}/{n}.jpg"
+            })
+            if max(w, h) <= 256 or min(w, h) < 4:
+                break
+            n += 1
+
         return jsonify({
             'success': True,
-            'image_url': f"data:image/png;base64,{png_base64}"
+            'image_key': image_key,
+            'width': full_w,
+            'height': full_h,
+            'levels': levels,
+            # Default level for display/cropping
+            'image_url': levels[0]['url'],
+            'preview_scale': levels[0]['scale']
         })
         
     except Exception as e:
         print(f"Conversion Error: {e}")
         return jsonify({'error': str(e)}), 500
+
+def load_preview(image_key, image_bytes=None):
+    """
+    Return the stored preview pyramid for an uploaded image, decoding it at
+    reduced resolution if it is not in the image store (None if undecodable).
+    """
+    stored = IMAGES.get('preview:' + image_key)
+    if stored is not None:
+        return stored
+    if image_bytes is None:
+        entry = SOURCES.get(image_key)
+        if entry is None:
+            return None
+        image_bytes = entry[0]
+
+    dims = image_dimensions(image_bytes)
+    max_side = int(os.environ.get('PREVIEW_MAX_SIDE', 2048))
+    factor = 1
+    if dims:
+        while factor < 8 and max(dims) / factor > max_side:
+            factor *= 2
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+             4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[factor]
+    preview = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+    if preview is None:
+        return None
+    full_w, full_h = dims if dims else (preview.shape[1] * factor, preview.shape[0] * factor)
+
+    # Beyond 1/8 (or without a readable header) shrink the decoded image further
+    if max(preview.shape[:2]) > max_side:
+        preview = resize_to_width(preview, int(preview.shape[1] * max_side / max(preview.shape[:2])))
+
+    return IMAGES.put('preview:' + image_key, preview, {
+        'full_width': full_w,
+        'full_height': full_h,
+        'scale': preview.shape[1] / float(full_w)
+    })
+
+def crop_preview_rect(img, crop, preview_scale=1.0):
+    """
+    Crop a full-resolution image with a rectangle drawn on a preview.
+
+    Args:
+        crop: dict with x, y, width, height in preview pixels
+        preview_scale: preview size / full size
+    """
+    scale = 1.0 / preview_scale if preview_scale > 0 else 1.0
+    h, w = img.shape[:2]
+    x0 = int(np.clip(round(float(crop.get('x', 0)) * scale), 0, w - 1))
+    y0 = int(np.clip(round(float(crop.get('y', 0)) * scale), 0, h - 1))
+    x1 = int(np.clip(round((float(crop.get('x', 0)) + float(crop.get('width', w))) * scale), x0 + 1, w))
+    y1 = int(np.clip(round((float(crop.get('y', 0)) + float(crop.get('height', h))) * scale), y0 + 1, h))
+    return img[y0:y1, x0:x1]
+
+@app.route('/preview/<key>/<int:level>.jpg')
+def preview_level(key, level):
+    """Serve one level of a /convert_image preview pyramid (fast, quality-85 JPEG)."""
+    stored = load_preview(key)
+    if stored is None:
+        return jsonify({'error': 'Uploaded image expired, please upload it again'}), 404
+
+    def render():
+        ok, buffer = cv2.imencode('.jpg', stored.level(level), [cv2.IMWRITE_JPEG_QUALITY, 85])
+        return buffer.tobytes()
+
+    cache_key = render_key(key, 'preview', level=level)
+    data = RENDERS.get_or_render(cache_key, render)
+    response = send_file(io.BytesIO(data), mimetype='image/jpeg', etag=cache_key,
+                         conditional=True, max_age=86400)
+    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    return response
+
 @app.route('/download_excel_origin', methods=['POST'])
 def download_excel_origin():
     """Generate Excel file formatted specifically for OriginPro (X Y XErr)."""
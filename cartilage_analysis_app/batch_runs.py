@@ -0,0 +1,422 @@
+"""
+Server-side batch runs with per-image checkpoints.
+
+batch.html used to keep its results only in the browser, so a failure or a
+server restart at image 180 of 200 lost the whole run. A batch run lives on the
+server instead, in its own directory under BATCH_RUN_DIR:
+
+    run.json        name, analysis settings, items (filename, content hash, crop) and state
+    sources/        the uploaded images, one file per content hash
+    results.jsonl   one line per finished image, appended and fsynced as soon as the
+                    image is done; a torn last line after a crash is ignored
+
+The latest checkpoint of every item is kept in memory: the file is read in full
+once per run and process (on resume, or the first status request), and after
+that only the lines appended since, so progress polls and the runner loop do
+not re-read a growing file for every image.
+
+A run is processed by one background thread. Starting it again (or restarting
+the server while it was running) resumes it: images whose content hash (and crop) already
+has a result are skipped, failed images are retried. Results are readable at any
+time, so a partial export works while the run is still going.
+
+Only one process works on a run at a time: the runner holds `runner.lock`
+(containing its PID); a lock left by a process that no longer exists is taken over.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+from result_cache import content_hash
+from zone_analysis import SETTING_KEYS
+
+RUN_FILE = 'run.json'
+RESULTS_FILE = 'results.jsonl'
+LOCK_FILE = 'runner.lock'
+# Per-image options; everything else comes from the run's settings
+ITEM_KEYS = ('crop', 'preview_scale')
+
+
+class RunNotFound(KeyError):
+    """Raised for an unknown batch run id."""
+
+
+def _write_json(path, payload):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def item_key(image_hash, options):
+    """Identity of a run item: its content hash, plus the crop if it is analysed cropped."""
+    if not options:
+        return image_hash
+    payload = json.dumps(options, sort_keys=True).encode()
+    return f"{image_hash}-{hashlib.blake2b(payload, digest_size=6).hexdigest()}"
+
+
+class _Checkpoints:
+    """Latest checkpoint per item key of one run, read incrementally from its results file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0  # end of the last complete line read
+        self.latest = {}
+
+    def refresh(self):
+        """Read the lines appended since the last call (by this or another process)."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return self.latest
+        if size < self.offset:
+            self.offset, self.latest = 0, {}
+        if size > self.offset:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                chunk = f.read(size - self.offset)
+            end = chunk.rfind(b'\n') + 1  # a torn last line stays unread
+            for line in chunk[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn write of a crashed process
+                self.latest[entry['key']] = entry
+            self.offset += end
+        return self.latest
+
+    def append(self, entry):
+        self.refresh()
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+        with open(self.path, 'ab') as f:
+            if f.tell() > self.offset:
+                line = b'\n' + line  # end the torn line of a crashed process first
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            self.offset = f.tell()
+        self.latest[entry['key']] = entry
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class BatchRunStore:
+    """
+    Batch runs stored under `root`.
+
+    Args:
+        root: directory holding one subdirectory per run
+        analyze: callable(image_bytes, settings, filename, tags) -> /analyze response dict,
+            or None if the image cannot be decoded; may raise AdmissionRejected while
+            the server is busy
+        fit_zone_model: callable(iterable of (image_bytes, item options)) -> shared AI
+            zone model, used for runs whose settings ask for `"zone_model": "pooled"`
+    """
+
+    def __init__(self, root, analyze, fit_zone_model=None):
+        self.root = root
+        self.analyze = analyze
+        self.fit_zone_model = fit_zone_model
+        self._lock = threading.Lock()
+        self._runners = {}  # run id -> thread of this process
+        self._results = {}  # run id -> _Checkpoints
+        os.makedirs(root, exist_ok=True)
+
+    # --- storage -----------------------------------------------------------------
+
+    def _dir(self, run_id):
+        path = os.path.join(self.root, os.path.basename(run_id))
+        if not run_id or not os.path.exists(os.path.join(path, RUN_FILE)):
+            raise RunNotFound(run_id)
+        return path
+
+    def _load(self, run_id):
+        with open(os.path.join(self._dir(run_id), RUN_FILE)) as f:
+            return json.load(f)
+
+    def _save(self, run):
+        _write_json(os.path.join(self.root, run['id'], RUN_FILE), run)
+
+    def _update(self, run_id, **fields):
+        with self._lock:
+            run = self._load(run_id)
+            run.update(fields)
+            self._save(run)
+            return run
+
+    def _run_results(self, run_id):
+        # Caller holds self._lock
+        results = self._results.get(run_id)
+        if results is None:
+            results = self._results[run_id] = _Checkpoints(os.path.join(self._dir(run_id), RESULTS_FILE))
+        return results
+
+    def _checkpoints(self, run_id):
+        """Latest checkpoint per item key (kept up to date in place; look entries up, don't iterate)."""
+        with self._lock:
+            return self._run_results(run_id).refresh()
+
+    def _checkpoint(self, run_id, entry):
+        with self._lock:
+            self._run_results(run_id).append(entry)
+
+    # --- runs --------------------------------------------------------------------
+
+    def create(self, name=None, settings=None, tags=None):
+        """New run; its results are recorded with `tags` plus 'batch:<run id>'."""
+        run_id = uuid.uuid4().hex[:12]
+        os.makedirs(os.path.join(self.root, run_id, 'sources'))
+        run = {
+            'id': run_id,
+            'name': name or run_id,
+            'created': time.time(),
+            'settings': {k: v for k, v in (settings or {}).items() if k in SETTING_KEYS},
+            'tags': list(tags or []) + [f'batch:{run_id}'],
+            'state': 'created',
+            'items': []
+        }
+        self._save(run)
+        return run
+
+    def add_item(self, run_id, filename, image_bytes, options=None):
+        """
+        Store an uploaded image; an image (with the same crop) already in the run
+        is not added twice. `options` may hold the `crop` / `preview_scale` of /analyze.
+        """
+        options = {k: v for k, v in (options or {}).items() if k in ITEM_KEYS and v is not None}
+        if 'crop' not in options:
+            options = {}
+        image_hash = content_hash(image_bytes)
+        key = item_key(image_hash, options)
+        source = os.path.join(self._dir(run_id), 'sources', image_hash)
+        if not os.path.exists(source):
+            tmp = f"{source}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(image_bytes)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, source)
+        with self._lock:
+            run = self._load(run_id)
+            duplicate = any(item['key'] == key for item in run['items'])
+            if not duplicate:
+                run['items'].append({'key': key, 'filename': filename, 'content_hash': image_hash,
+                                     'options': options})
+                self._save(run)
+        return {'key': key, 'filename': filename, 'content_hash': image_hash, 'duplicate': duplicate}
+
+    def runs(self):
+        found = []
+        for run_id in sorted(os.listdir(self.root)):
+            try:
+                found.append(self.status(run_id))
+            except (RunNotFound, OSError, ValueError):
+                continue
+        return sorted(found, key=lambda r: r['created'], reverse=True)
+
+    def status(self, run_id, include_results=False):
+        run = self._load(run_id)
+        checkpoints = self._checkpoints(run_id)
+        items, done, failed = [], 0, 0
+        for item in run['items']:
+            entry = checkpoints.get(item['key'])
+            state = entry['status'] if entry else 'pending'
+            done += state == 'done'
+            failed += state == 'failed'
+            items.append({'key': item['key'], 'filename': item['filename'], 'content_hash': item['content_hash'],
+                          'status': state, 'error': entry.get('error') if entry else None})
+        info = {
+            'run_id': run['id'],
+            'name': run['name'],
+            'created': run['created'],
+            'settings': run['settings'],
+            'tags': run.get('tags', []),
+            'state': run['state'],
+            'active': self._runner_alive(run_id),
+            'total': len(items),
+            'done': done,
+            'failed': failed,
+            'pending': len(items) - done - failed,
+            'items': items
+        }
+        if include_results:
+            info['results'] = self.results(run_id, run, checkpoints)
+        return info
+
+    def results(self, run_id, run=None, checkpoints=None):
+        """Finished results in upload order, each with its `filename`."""
+        run = run or self._load(run_id)
+        checkpoints = self._checkpoints(run_id) if checkpoints is None else checkpoints
+        results = []
+        for item in run['items']:
+            entry = checkpoints.get(item['key'])
+            if entry and entry['status'] == 'done':
+                result = dict(entry['result'])
+                result['filename'] = item['filename']
+                results.append(result)
+        return results
+
+    # --- processing --------------------------------------------------------------
+
+    def _lock_path(self, run_id):
+        return os.path.join(self._dir(run_id), LOCK_FILE)
+
+    def _runner_alive(self, run_id):
+        try:
+            with open(self._lock_path(run_id)) as f:
+                pid = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return False
+        if pid == os.getpid():
+            # Also covers a restarted server that got the PID of the crashed one
+            thread = self._runners.get(run_id)
+            return thread is not None and thread.is_alive()
+        return _pid_alive(pid)
+
+    def _acquire(self, run_id):
+        path = self._lock_path(run_id)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._runner_alive(run_id):
+                    return False
+                try:
+                    os.unlink(path)  # left by a process that died
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def start(self, run_id):
+        """Start or resume a run in a background thread; False if it is already being processed."""
+        with self._lock:
+            thread = self._runners.get(run_id)
+            if thread is not None and thread.is_alive():
+                return False
+            if not self._acquire(run_id):
+                return False
+            thread = threading.Thread(target=self._run, args=(run_id,), name=f'batch-{run_id}', daemon=True)
+            self._runners[run_id] = thread
+        self._update(run_id, state='running')
+        thread.start()
+        return True
+
+    def pause(self, run_id):
+        """Stop a run after the image in progress (in whichever process runs it)."""
+        return self._update(run_id, state='paused')
+
+    def resume_interrupted(self):
+        """Restart runs that were still running when their process stopped."""
+        resumed = []
+        for run_id in os.listdir(self.root):
+            try:
+                if self._load(run_id)['state'] == 'running' and self.start(run_id):
+                    resumed.append(run_id)
+            except (RunNotFound, OSError, ValueError):
+                continue
+        if resumed:
+            print(f"Batch runs: resumed {', '.join(resumed)}")
+        return resumed
+
+    def _source(self, run_id, item):
+        with open(os.path.join(self._dir(run_id), 'sources', item['content_hash']), 'rb') as f:
+            return f.read()
+
+    def _pooled_zone_model(self, run_id):
+        """
+        Replace `"zone_model": "pooled"` in the run settings by one AI zone model fitted
+        on all images of the run, so each image only needs the row-voting step. If
+        fitting fails the images fall back to their own clustering.
+        """
+        from admission import AdmissionRejected
+
+        run = self._load(run_id)
+        while True:
+            try:
+                sources = ((self._source(run_id, item), item['options']) for item in run['items'])
+                model, error = self.fit_zone_model(sources), None
+                break
+            except AdmissionRejected as e:
+                time.sleep(e.retry_after)
+            except Exception as e:
+                print(f"Batch run {run_id}: pooled zone model failed, fitting per image: {e}")
+                model, error = None, str(e)
+                break
+        self._update(run_id, settings=dict(run['settings'], zone_model=model),
+                     zone_model_images=len(run['items']), zone_model_error=error)
+
+    def _run(self, run_id):
+        from admission import AdmissionRejected
+
+        attempted = set()
+        try:
+            if self._load(run_id)['settings'].get('zone_model') == 'pooled' and self.fit_zone_model:
+                self._pooled_zone_model(run_id)
+            while True:
+                run = self._load(run_id)
+                if run['state'] != 'running':
+                    return
+                checkpoints = self._checkpoints(run_id)
+                todo = [item for item in run['items']
+                        if item['key'] not in attempted
+                        and checkpoints.get(item['key'], {}).get('status') != 'done']
+                if not todo:
+                    self._update(run_id, state='complete', finished=time.time())
+                    return
+
+                item = todo[0]
+                attempted.add(item['key'])
+                entry = {'key': item['key'], 'content_hash': item['content_hash'], 'filename': item['filename'],
+                         'finished': None, 'status': 'failed', 'error': None, 'result': None}
+                try:
+                    image_bytes = self._source(run_id, item)
+                    while True:
+                        try:
+                            response = self.analyze(image_bytes, dict(run['settings'], **item['options']),
+                                                    item['filename'], run.get('tags'))
+                            break
+                        except AdmissionRejected as e:
+                            # Interactive users come first; try again when there is room
+                            time.sleep(e.retry_after)
+                    if response is None:
+                        entry['error'] = 'Failed to decode image'
+                    else:
+                        entry['status'], entry['result'] = 'done', response
+                except Exception as e:
+                    print(f"Batch run {run_id}: {item['filename']} failed: {e}")
+                    entry['error'] = str(e)
+                entry['finished'] = time.time()
+                self._checkpoint(run_id, entry)
+        except Exception as e:
+            print(f"Batch run {run_id} stopped: {e}")
+        finally:
+            try:
+                os.unlink(self._lock_path(run_id))
+            except OSError:
+                pass
+            with self._lock:
+                self._runners.pop(run_id, None)
+
+
+def store_from_env(analyze, fit_zone_model=None):
+    """Batch run store under BATCH_RUN_DIR (default: batch_runs next to this file)."""
+    root = os.environ.get('BATCH_RUN_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch_runs')
+    return BatchRunStore(root, analyze, fit_zone_model)
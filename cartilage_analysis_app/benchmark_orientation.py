@@ -0,0 +1,85 @@
+"""
+Throughput benchmark: hue mapping vs structure tensor, in milliseconds per megapixel.
+
+The sample slide is resized to several sizes and each method is timed on it:
+    hue /analyze       full zone + depth-profile analysis (forced calibration, no AI)
+    hue angle map      per-pixel hue -> angle map (cv2.LUT)
+    structure tensor   structure_tensor.row_statistics + zones + depth profile
+
+Usage:
+    python benchmark_orientation.py
+    python benchmark_orientation.py --sizes 1 4 16 --runs 3 --image "../Sample_Data/F H1.bmp"
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_IMAGE = os.path.join(HERE, '..', 'Sample_Data', 'F H1.bmp')
+
+
+def best_time(fn, runs):
+    best = None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def resized(img, megapixels):
+    scale = np.sqrt(megapixels * 1e6 / float(img.shape[0] * img.shape[1]))
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hue vs structure-tensor orientation.")
+    parser.add_argument('--image', default=DEFAULT_IMAGE)
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 16], help="image sizes in megapixels")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--sigma-grad', type=float, default=1.5)
+    parser.add_argument('--sigma-int', type=float, default=6.0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    import app
+    import structure_tensor
+
+    base = cv2.imread(args.image)
+    if base is None:
+        print(f"Could not read {args.image}")
+        return 1
+    params = {'force_zero_hue': 0, 'force_ninety_hue': 60}
+
+    def tensor(img):
+        rows = structure_tensor.row_statistics(img, args.sigma_grad, args.sigma_int)
+        h = img.shape[0]
+        for y0, y1 in ((0, h // 3), (h // 3, 2 * h // 3), (2 * h // 3, h)):
+            structure_tensor.zone_statistics(rows, y0, y1)
+        structure_tensor.depth_profile(rows)
+
+    cases = [
+        ('hue /analyze', lambda img: app.analyze_image(img, params)),
+        ('hue angle map', lambda img: app.angle_map(img)),
+        ('structure tensor', tensor),
+    ]
+
+    print(f"OpenCV {cv2.__version__}, {cv2.getNumThreads()} threads, best of {args.runs}\n")
+    print(f"{'method':<20}" + ''.join(f"{f'{mp:g} MP':>14}" for mp in args.sizes) + "   (ms / MP)")
+    images = [resized(base, mp) for mp in args.sizes]
+    for label, fn in cases:
+        cells = []
+        for img in images:
+            seconds = best_time(lambda: fn(img), args.runs)
+            cells.append(seconds * 1000.0 / (img.shape[0] * img.shape[1] / 1e6))
+        print(f"{label:<20}" + ''.join(f"{c:14.1f}" for c in cells))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Startup-time benchmark for the Cartilage Analysis App.
+
+Measures, in fresh interpreter processes, how long `import app` takes and how
+much memory it costs, and checks that heavy deep-learning runtimes (torch,
+torchvision) are NOT imported on the default path. For comparison it also
+times `import torch` on its own when torch is installed.
+
+Usage:
+    python benchmark_startup.py            # 5 runs
+    python benchmark_startup.py --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = r"""
+import sys, time, json
+t0 = time.perf_counter()
+{stmt}
+elapsed = time.perf_counter() - t0
+try:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss_kb //= 1024
+except ImportError:
+    rss_kb = None
+heavy = sorted(m for m in ('torch', 'torchvision', 'sklearn') if m in sys.modules)
+print(json.dumps({{'seconds': elapsed, 'max_rss_mb': rss_kb / 1024 if rss_kb else None, 'heavy_modules': heavy}}))
+"""
+
+
+def run_probe(stmt):
+    """Run `stmt` in a fresh interpreter and return the probe's measurements."""
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE.format(stmt=stmt)],
+        cwd=HERE, capture_output=True, text=True, check=True
+    )
+    # The app prints status lines on import; the probe result is the last line
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(label, samples):
+    times = sorted(s['seconds'] for s in samples)
+    rss = [s['max_rss_mb'] for s in samples if s['max_rss_mb'] is not None]
+    median = times[len(times) // 2]
+    rss_txt = f"{max(rss):7.1f} MB" if rss else "    n/a"
+    print(f"{label:<28} median {median * 1000:8.1f} ms   min {times[0] * 1000:8.1f} ms   max RSS {rss_txt}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app import time and memory.")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        ('import app', 'import app'),
+        ('import app + warm_up(lazy)', 'import app; app.warm_up(load_detector=False)'),
+        ('import app + warm_up(AI)', 'import app; app.warm_up(load_detector=True)'),
+    ]
+    try:
+        import importlib.util
+        if importlib.util.find_spec('torch') is not None:
+            cases.append(('import torch (reference)', 'import torch'))
+    except Exception:
+        pass
+
+    print(f"Python {sys.version.split()[0]}, {args.runs} runs per case\n")
+    ok = True
+    for label, stmt in cases:
+        samples = [run_probe(stmt) for _ in range(args.runs)]
+        summarize(label, samples)
+        if stmt.startswith('import app'):
+            heavy = samples[-1]['heavy_modules']
+            if heavy:
+                ok = False
+                print(f"    !! heavy modules imported on this path: {', '.join(heavy)}")
+
+    print("\nDefault path free of torch/torchvision/sklearn:", "YES" if ok else "NO")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
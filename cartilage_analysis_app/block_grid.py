@@ -0,0 +1,111 @@
+"""
+Block-wise 2-D orientation statistics from summed-area tables.
+
+/analyze averages whole rows, so lateral variation (defects, repair tissue)
+is smeared into the depth profile. `OrientationIntegrals` makes one pass over
+the image and builds integral images of the masked per-pixel quantities; any
+rectangle's valid-pixel count, mean/std angle and circular mean hue can then
+be read in O(1), and a whole N x M grid in O(N * M).
+"""
+import numpy as np
+import cv2
+
+
+class OrientationIntegrals:
+    """
+    Summed-area tables of a BGR image for one hue->angle calibration.
+
+    Args:
+        img: BGR image
+        angle_fn: callable mapping a float hue array to angles in degrees
+            (e.g. `lambda h: hue_to_angle(h, zero_hue, ninety_hue)`)
+        min_value / min_saturation: pixels need V and S above these to count
+    """
+
+    def __init__(self, img, angle_fn, min_value=10, min_saturation=10):
+        self.height, self.width = img.shape[:2]
+
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        hue = hsv[:, :, 0].astype(np.float64)
+        mask = ((hsv[:, :, 2] > min_value) & (hsv[:, :, 1] > min_saturation)).astype(np.float64)
+
+        angle = angle_fn(hue) * mask
+        rads = np.deg2rad(hue * 2.0)
+
+        # cv2.integral returns (H+1, W+1) tables with a zero first row/column
+        self.count = cv2.integral(mask, sdepth=cv2.CV_64F)
+        self.angle = cv2.integral(angle, sdepth=cv2.CV_64F)
+        self.angle_sq = cv2.integral(angle * angle, sdepth=cv2.CV_64F)
+        self.sin = cv2.integral(np.sin(rads) * mask, sdepth=cv2.CV_64F)
+        self.cos = cv2.integral(np.cos(rads) * mask, sdepth=cv2.CV_64F)
+
+    @staticmethod
+    def _sum(table, y0, x0, y1, x1):
+        # Works on scalars and on broadcastable index arrays
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    def _stats(self, y0, x0, y1, x1):
+        n = self._sum(self.count, y0, x0, y1, x1)
+        s = self._sum(self.angle, y0, x0, y1, x1)
+        ss = self._sum(self.angle_sq, y0, x0, y1, x1)
+        sin_sum = self._sum(self.sin, y0, x0, y1, x1)
+        cos_sum = self._sum(self.cos, y0, x0, y1, x1)
+
+        safe_n = np.maximum(n, 1)
+        mean = s / safe_n
+        std = np.sqrt(np.maximum(ss / safe_n - mean * mean, 0))
+        mean_hue = (np.rad2deg(np.arctan2(sin_sum, cos_sum)) % 360.0) / 2.0
+
+        empty = n < 1
+        return {
+            'count': n,
+            'mean_angle': np.where(empty, 0.0, mean),
+            'std_angle': np.where(empty, 0.0, std),
+            'mean_hue': np.where(empty, 0.0, mean_hue)
+        }
+
+    def region(self, x, y, width, height):
+        """Statistics of one rectangle (pixel coordinates, clipped to the image)."""
+        x0 = int(np.clip(x, 0, self.width))
+        y0 = int(np.clip(y, 0, self.height))
+        x1 = int(np.clip(x + width, x0, self.width))
+        y1 = int(np.clip(y + height, y0, self.height))
+        stats = self._stats(y0, x0, y1, x1)
+        result = {k: float(v) for k, v in stats.items()}
+        result['count'] = int(result['count'])
+        result['rect'] = {'x': x0, 'y': y0, 'width': x1 - x0, 'height': y1 - y0}
+        return result
+
+    def grid(self, rows, cols):
+        """
+        Statistics for every block of a rows x cols grid covering the image.
+        Block edges are spread evenly, so blocks differ by at most one pixel.
+        """
+        rows = int(np.clip(rows, 1, self.height))
+        cols = int(np.clip(cols, 1, self.width))
+        ys = np.linspace(0, self.height, rows + 1).round().astype(int)
+        xs = np.linspace(0, self.width, cols + 1).round().astype(int)
+        return self._grid(ys, xs)
+
+    def blocks(self, block_height, block_width):
+        """Statistics for fixed-size blocks (the last row/column may be smaller)."""
+        block_height = max(1, int(block_height))
+        block_width = max(1, int(block_width))
+        ys = np.append(np.arange(0, self.height, block_height), self.height)
+        xs = np.append(np.arange(0, self.width, block_width), self.width)
+        return self._grid(ys, xs)
+
+    def _grid(self, ys, xs):
+        y0, y1 = ys[:-1, None], ys[1:, None]
+        x0, x1 = xs[None, :-1], xs[None, 1:]
+        stats = self._stats(y0, x0, y1, x1)
+        return {
+            'rows': len(ys) - 1,
+            'cols': len(xs) - 1,
+            'y_edges': ys.tolist(),
+            'x_edges': xs.tolist(),
+            'count': stats['count'].astype(int).tolist(),
+            'mean_angle': np.round(stats['mean_angle'], 3).tolist(),
+            'std_angle': np.round(stats['std_angle'], 3).tolist(),
+            'mean_hue': np.round(stats['mean_hue'], 2).tolist()
+        }
@@ -0,0 +1,91 @@
+"""
+Vectorized circular statistics of OpenCV hue on 180-bin histograms.
+
+OpenCV stores hue as 0-179 (half degrees), so hue 179 and hue 0 are neighbours
+(both red). Linear means, medians and standard deviations are wrong for any
+region whose colours straddle that wrap. All functions here work on weighted
+hue histograms of shape (..., 180) rather than on pixel arrays: a region costs
+O(180) however many pixels it has, and N regions are evaluated in one call by
+passing an (N, 180) array.
+
+Results are in hue units (0-180) unless noted; hue h is the angle 2h degrees
+on the colour circle.
+"""
+import numpy as np
+
+HUES = 180
+
+_RADS = np.deg2rad(np.arange(HUES) * 2.0)
+_COS = np.cos(_RADS)
+_SIN = np.sin(_RADS)
+
+
+def hue_histogram(hues, weights=None):
+    """180-bin histogram of hue values (0-179), optionally weighted."""
+    return np.bincount(np.asarray(hues, dtype=np.int64).ravel(), weights=weights, minlength=HUES)[:HUES].astype(np.float64)
+
+
+def row_histograms(hue, mask=None):
+    """
+    Hue histogram of every row of a hue plane: (H, 180).
+
+    Args:
+        hue: (H, W) OpenCV hue plane
+        mask: optional boolean (H, W) mask of pixels to count
+    """
+    height = hue.shape[0]
+    idx = np.arange(height, dtype=np.int64)[:, None] * HUES + hue.astype(np.int64)
+    idx = idx[mask] if mask is not None else idx.ravel()
+    return np.bincount(idx, minlength=height * HUES).reshape(height, HUES).astype(np.float64)
+
+
+def hue_difference(a, b):
+    """Shortest distance between hues around the circle (0-90): hue 178 and hue 2 are 4 apart."""
+    d = np.abs(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)) % HUES
+    return np.minimum(d, HUES - d)
+
+
+def _components(hist):
+    hist = np.asarray(hist, dtype=np.float64)
+    return hist.sum(axis=-1), hist @ _SIN, hist @ _COS
+
+
+def circular_mean(hist):
+    """Circular mean hue (0-180); 0 for empty histograms."""
+    _, s, c = _components(hist)
+    mean = np.rad2deg(np.arctan2(s, c))
+    return np.where(mean < 0, mean + 360.0, mean) / 2.0
+
+
+def resultant_length(hist):
+    """Mean resultant length R (0 = uniform spread, 1 = single hue); 0 for empty histograms."""
+    n, s, c = _components(hist)
+    return np.hypot(s, c) / np.maximum(n, 1e-12)
+
+
+def circular_std(hist):
+    """Circular standard deviation sqrt(-2 ln R) in hue units; 0 for empty histograms."""
+    n = np.asarray(hist, dtype=np.float64).sum(axis=-1)
+    r = np.clip(resultant_length(hist), 1e-12, 1.0)
+    std = np.rad2deg(np.sqrt(-2.0 * np.log(r))) / 2.0
+    return np.where(n > 0, std, 0.0)
+
+
+def circular_median(hist):
+    """
+    Circular median hue: the circle is cut opposite the circular mean and the
+    weighted median is taken along the resulting line, so it never falls on the
+    wrong side of the 0/180 wrap. Returns an integer hue (as float), 0 if empty.
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    batch = hist.reshape(-1, HUES)
+    cut = (np.rint(circular_mean(batch)).astype(np.int64) + HUES // 2) % HUES
+    # Roll every histogram so its cut point is bin 0
+    order = (cut[:, None] + np.arange(HUES)[None, :]) % HUES
+    rolled = np.take_along_axis(batch, order, axis=1)
+    cumulative = np.cumsum(rolled, axis=1)
+    half = cumulative[:, -1:] / 2.0
+    pos = np.argmax(cumulative >= half, axis=1)
+    median = np.take_along_axis(order, pos[:, None], axis=1)[:, 0].astype(np.float64)
+    median = np.where(cumulative[:, -1] > 0, median, 0.0)
+    return median.reshape(hist.shape[:-1]) if hist.ndim > 1 else float(median[0])
@@ -0,0 +1,169 @@
+"""
+In-memory store of decoded source images and their downscaled pyramids.
+
+Endpoints that render views of an uploaded image on demand (scientific
+visualisations, previews, tiles) keep the decoded image here under its content
+fingerprint instead of re-uploading or re-decoding it. Each entry lazily grows
+a 2x pyramid (cv2.pyrDown) so a view can be rendered from the smallest level
+that is still at least as large as the requested display size.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+
+
+class StoredImage:
+    """A decoded BGR image, its lazily built pyramid and free-form metadata."""
+
+    def __init__(self, img, meta=None):
+        self.levels = [img]
+        self.meta = dict(meta or {})
+        self._lock = threading.Lock()
+
+    @property
+    def image(self):
+        return self.levels[0]
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def nbytes(self):
+        # Full pyramid converges to 4/3 of the base level
+        return int(self.levels[0].nbytes * 4 / 3)
+
+    def level(self, n):
+        """Pyramid level n (0 = full resolution, each level halves both sides)."""
+        with self._lock:
+            while len(self.levels) <= n:
+                prev = self.levels[-1]
+                if min(prev.shape[:2]) < 2:
+                    break
+                self.levels.append(cv2.pyrDown(prev))
+            return self.levels[min(n, len(self.levels) - 1)]
+
+    def level_for_width(self, width):
+        """
+        Smallest pyramid level that is still at least `width` pixels wide.
+        Returns (level_index, image). A missing/zero width gives full resolution.
+        """
+        if not width or width >= self.shape[1]:
+            return 0, self.image
+        n = 0
+        while (self.shape[1] >> (n + 1)) >= width:
+            n += 1
+        return n, self.level(n)
+
+
+class ImageStore:
+    """
+    Thread-safe LRU of fingerprint -> StoredImage, bounded by total bytes.
+
+    Args:
+        max_bytes: memory budget for stored images (including pyramids)
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, key, img, meta=None):
+        """Store `img` under `key` (a no-op refresh if it is already stored)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.meta.update(meta or {})
+                self._entries.move_to_end(key)
+                return entry
+            entry = StoredImage(img, meta)
+            self._entries[key] = entry
+            self._bytes += entry.nbytes()
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes()
+            return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+class SourceRecipes:
+    """
+    Thread-safe LRU of fingerprint -> how to decode an analysed image again: its
+    encoded bytes (or the `image_key` of a kept upload) and the crop applied to it.
+
+    A cached /analyze only registers its image here; the image is decoded again
+    (into an ImageStore) when a view of it is first requested, never by the
+    cached request itself.
+
+    Args:
+        max_bytes: budget for the encoded bytes held here (image_key entries are free)
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, key, image_bytes, options):
+        """Register `image_bytes` (None for an image_key reference in `options`) under `key`."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0] or b'')
+            self._entries[key] = (image_bytes, dict(options))
+            self._bytes += len(image_bytes or b'')
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted or b'')
+
+    def get(self, key):
+        """(image_bytes, options) registered under `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+def resize_to_width(img, width):
+    """Downscale `img` to `width` pixels wide (never upscales)."""
+    if not width or width >= img.shape[1]:
+        return img
+    height = max(1, int(round(img.shape[0] * width / float(img.shape[1]))))
+    return cv2.resize(img, (int(width), height), interpolation=cv2.INTER_AREA)
+
+
+def store_from_env():
+    """Build the process-wide image store; size from IMAGE_STORE_MB (default 512)."""
+    return ImageStore(float(os.environ.get('IMAGE_STORE_MB', 512)) * 1024 * 1024)
+
+
+def recipes_from_env():
+    """Build the process-wide source recipes; size from SOURCE_RECIPES_MB (default 256)."""
+    return SourceRecipes(float(os.environ.get('SOURCE_RECIPES_MB', 256)) * 1024 * 1024)
@@ -0,0 +1,194 @@
+"""
+One-pass sensitivity analysis over mask thresholds, calibrations and zone boundaries.
+
+/analyze masks pixels with V > 10 & S > 10 for the zone statistics and with
+V > 20 for the depth profile and the automatic colour calibration. Checking how
+sensitive a result is to those thresholds (or to zero_hue / ninety_hue) used to
+mean re-running /analyze for every combination.
+
+`HueHistograms` reads the pixels once and builds, for every band of rows, a
+joint histogram of hue (all 180 OpenCV values) x saturation x value and the
+B, G, R, V sums per saturation x value cell, with S and V quantised at the
+supported threshold steps (THRESHOLD_STEPS). For any threshold pair this gives
+the cumulative row table of /analyze (see row_table in zone_analysis.py) at
+every band edge, and each combination is then evaluated by the same
+analyze_rows / zone_result code as /analyze. Since hue is not quantised, results equal a
+direct /analyze run with the same settings.
+"""
+import itertools
+
+import numpy as np
+import cv2
+
+from profiles import profile_rows
+
+# Supported thresholds: a mask "V > t" / "S > t" needs t + 1 to be a bin edge
+THRESHOLD_STEPS = (0, 5, 10, 15, 20, 25, 30, 40, 50, 75, 100, 150)
+_EDGES = np.array((0,) + tuple(t + 1 for t in THRESHOLD_STEPS))
+_QUANTISE_LUT = (np.searchsorted(_EDGES, np.arange(256), side='right') - 1).astype(np.uint8)
+LEVELS = len(_EDGES)
+HUES = 180
+# Row table layout of app.row_table: the hue histogram, then masked B, G, R and V sums
+ROW_COLUMNS = HUES + 4
+
+# Depth-profile bins of /analyze
+PROFILE_BINS = 100
+
+# Rows per chunk when building histograms, to bound temporary index arrays
+CHUNK_PIXELS = 1 << 21
+
+
+def threshold_index(threshold):
+    """Histogram bin where 'channel > threshold' starts (None = no test)."""
+    if threshold is None:
+        return 0
+    threshold = int(threshold)
+    if threshold not in THRESHOLD_STEPS:
+        raise ValueError(f"Unsupported threshold {threshold}; use one of {list(THRESHOLD_STEPS)}")
+    return THRESHOLD_STEPS.index(threshold) + 1
+
+
+def _finite(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if np.isfinite(number) and not isinstance(value, bool) else None
+
+
+def calibration_param(calibration, i=0):
+    """Validated sweep calibration: 'auto' or {'zero_hue', 'ninety_hue'} as floats."""
+    if calibration == 'auto':
+        return calibration
+    if isinstance(calibration, dict):
+        zero, ninety = _finite(calibration.get('zero_hue')), _finite(calibration.get('ninety_hue'))
+        if zero is not None and ninety is not None:
+            return {'zero_hue': zero, 'ninety_hue': ninety}
+    raise ValueError(f"calibrations[{i}] must be \"auto\" or {{zero_hue, ninety_hue}} numbers")
+
+
+def boundary_param(boundary, i=0):
+    """Validated sweep boundary pair (sz_boundary, mz_boundary) in percent."""
+    if isinstance(boundary, (list, tuple)) and len(boundary) == 2:
+        sz, mz = _finite(boundary[0]), _finite(boundary[1])
+        if sz is not None and mz is not None:
+            return sz, mz
+    raise ValueError(f"boundaries[{i}] must be a [sz_boundary, mz_boundary] pair of numbers")
+
+
+class HueHistograms:
+    """
+    Per-row-band hue x S x V histograms and B, G, R, V sums of a BGR image.
+
+    Args:
+        img: BGR image
+        row_edges: sorted row indices where bands start (0 and H are added);
+            every zone boundary and profile bin edge that will be queried
+            must be one of them
+    """
+
+    def __init__(self, img, row_edges):
+        self.height = img.shape[0]
+        self.edges = np.unique(np.concatenate([[0, self.height], np.asarray(row_edges, dtype=int)]))
+        self.edges = self.edges[(self.edges >= 0) & (self.edges <= self.height)]
+        bands = len(self.edges) - 1
+        band_of_row = np.searchsorted(self.edges, np.arange(self.height), side='right') - 1
+
+        levels = LEVELS * LEVELS
+        counts = np.zeros(bands * HUES * levels, dtype=np.int64)
+        sums = np.zeros((4, bands * levels))
+        step = max(1, CHUNK_PIXELS // max(1, img.shape[1]))
+        for y0 in range(0, self.height, step):
+            chunk = img[y0:y0 + step]
+            hsv = cv2.cvtColor(chunk, cv2.COLOR_BGR2HSV)
+            h, s, v = cv2.split(hsv)
+            band = band_of_row[y0:y0 + step, None].astype(np.int64)
+            cell = (cv2.LUT(s, _QUANTISE_LUT).astype(np.int64) * LEVELS + cv2.LUT(v, _QUANTISE_LUT)).ravel()
+            band = np.broadcast_to(band, h.shape).ravel()
+            counts += np.bincount((band * HUES + h.ravel()) * levels + cell, minlength=counts.size)
+            for c, channel in enumerate(cv2.split(chunk) + (v,)):
+                sums[c] += np.bincount(band * levels + cell, weights=channel.ravel(), minlength=sums.shape[1])
+        self.counts = counts.reshape(bands, HUES, LEVELS, LEVELS)
+        self.sums = sums.T.reshape(bands, LEVELS, LEVELS, 4)
+
+    def row_table(self, min_value=None, min_saturation=None):
+        """
+        Cumulative row table (see row_table in zone_analysis.py) of the pixels with
+        V > min_value and S > min_saturation: (H + 1, ROW_COLUMNS), exact at every
+        band edge, which are the only rows a sweep queries.
+        """
+        s, v = threshold_index(min_saturation), threshold_index(min_value)
+        bands = np.concatenate([self.counts[:, :, s:, v:].sum(axis=(2, 3)),
+                                self.sums[:, s:, v:].sum(axis=(1, 2))], axis=1)
+        cumulative = np.concatenate([np.zeros((1, ROW_COLUMNS)), np.cumsum(bands, axis=0)])
+        # Row r reads the entry of the last band edge at or above it
+        return cumulative[np.searchsorted(self.edges, np.arange(self.height + 1), side='right') - 1]
+
+
+def zone_rows(height, sz_boundary, mz_boundary):
+    """Zone boundary rows (z1, z2) for boundaries in percent, as /analyze computes them."""
+    s1 = np.clip(sz_boundary / 100.0, 0.0, 1.0)
+    s2 = np.clip(mz_boundary / 100.0, 0.0, 1.0)
+    if s1 > s2: s1 = s2
+    return int(height * s1), int(height * s2)
+
+
+def _mask_label(mask):
+    return {'value': mask.get('value'), 'saturation': mask.get('saturation')}
+
+
+def run_sweep(img, zone_masks, profile_masks, calibrations, boundaries, analyze_rows):
+    """
+    Evaluate every combination of the given settings from one pass over `img`.
+
+    Args:
+        img: BGR image
+        zone_masks: list of {'value': t, 'saturation': t} for zone statistics
+        profile_masks: list of masks for the depth profile and automatic calibration
+        calibrations: list of {'zero_hue', 'ninety_hue'} or the string 'auto'
+            (SZ/DZ circular mean hue under the profile mask, as /analyze without AI)
+        boundaries: list of (sz_boundary, mz_boundary) percent pairs
+        analyze_rows: the /analyze evaluation of row statistics (zone_analysis.analyze_rows)
+
+    Returns:
+        dict with the profile `thickness` and one entry per combination
+    """
+    height = img.shape[0]
+    starts, ends = profile_rows(height, PROFILE_BINS)
+    zone_edges = [zone_rows(height, sz, mz) for sz, mz in boundaries]
+    hists = HueHistograms(img, np.concatenate([starts, ends, np.ravel(zone_edges)]))
+
+    tables = {}
+
+    def table(mask):
+        key = (mask.get('value'), mask.get('saturation'))
+        if key not in tables:
+            tables[key] = hists.row_table(*key)
+        return tables[key]
+
+    combos = []
+    for zone_mask, profile_mask, (sz, mz), calibration in itertools.product(
+            zone_masks, profile_masks, boundaries, calibrations):
+        stats = {'height': height, 'zone': table(zone_mask), 'profile': table(profile_mask)}
+        if calibration == 'auto':
+            analysis = analyze_rows(stats, sz, mz, calibrate=True)
+        else:
+            analysis = analyze_rows(stats, sz, mz, calibration['zero_hue'], calibration['ninety_hue'])
+        profile = analysis['depth_profile']
+
+        combos.append({
+            'zone_mask': _mask_label(zone_mask),
+            'profile_mask': _mask_label(profile_mask),
+            'boundaries': {'sz_boundary': sz, 'mz_boundary': mz},
+            'color_calibration': {'zero_hue': analysis['zero_hue'], 'ninety_hue': analysis['ninety_hue'],
+                                  'auto': calibration == 'auto'},
+            'results': analysis['results'],
+            'zone_boundaries': analysis['zone_boundaries'],
+            'depth_profile': {key: [point[key] for point in profile]
+                              for key in ('angle', 'std', 'mean_hue', 'filled')}
+        })
+
+    return {
+        'thickness': np.round((np.arange(PROFILE_BINS) + 0.5) / PROFILE_BINS, 3).tolist(),
+        'combinations': combos
+    }
@@ -0,0 +1,64 @@
+"""
+Depth-profile helpers shared by /analyze, the parameter sweep and the
+structure-tensor engine: bin layout, profile angle mapping and gap filling.
+"""
+import numpy as np
+
+
+def profile_rows(height, bins=100):
+    """Row ranges [starts, ends) of the depth-profile bins (each at least one row)."""
+    i = np.arange(bins)
+    starts = np.maximum(0, (height * i / float(bins)).astype(int))
+    ends = np.minimum(height, (height * (i + 1) / float(bins)).astype(int))
+    ends = np.maximum(ends, starts + 1)
+    return starts, ends
+
+
+def profile_angle(mean_hue, zero_hue, ninety_hue):
+    """Angle of a profile bin from its mean hue, as in the /analyze depth profile."""
+    total_range = ninety_hue - zero_hue
+    if abs(total_range) < 0.1:
+        return np.zeros_like(mean_hue)
+    return np.clip((mean_hue - zero_hue) / total_range * 90.0, 0, 90)
+
+
+def fill_gaps(values, valid, hue_columns=()):
+    """
+    Fill empty profile bins by linear interpolation between the nearest valid
+    bins; leading/trailing gaps take the first/last valid value.
+
+    Hue columns are interpolated on the colour circle (through their sin/cos
+    components), so a gap between hue 178 and hue 2 is filled with red rather
+    than with the green halfway along the linear scale.
+
+    Args:
+        values: (bins,) or (bins, columns) array; rows of empty bins are ignored
+        valid: (bins,) boolean array of bins that have data
+        hue_columns: indices of columns that hold OpenCV hue (0-180)
+
+    Returns:
+        filled float array of the same shape (unchanged if all or no bins are valid)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.asarray(valid, dtype=bool)
+    known = np.flatnonzero(valid)
+    if len(known) == 0 or len(known) == len(valid):
+        return values.copy()
+
+    # Fractional position of every bin among the valid bins; np.interp clamps at the ends
+    pos = np.interp(np.arange(len(valid)), known, np.arange(len(known), dtype=np.float64))
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, len(known) - 1)
+    frac = pos - lo
+
+    def interpolate(columns):
+        f = frac[:, None] if columns.ndim > 1 else frac
+        return columns[known[lo]] * (1.0 - f) + columns[known[hi]] * f
+
+    filled = interpolate(values)
+    for column in hue_columns:
+        rads = np.deg2rad(values[:, column] * 2.0)
+        s, c = interpolate(np.column_stack([np.sin(rads), np.cos(rads)])).T
+        hue = np.rad2deg(np.arctan2(s, c)) / 2.0
+        filled[:, column] = np.where(hue < 0, hue + 180.0, hue)
+    return filled
@@ -0,0 +1,170 @@
+"""
+Progressive (coarse-to-fine) analysis for interactive use.
+
+A progressive /analyze request is first answered from the image at about 1/4 or
+1/8 scale: the preview pyramid of a /convert_image upload (already decoded, tens
+of milliseconds) or a reduced decode (JPEG is decoded directly at that size).
+The exact full-resolution analysis is queued in the background as a refinement
+job; the browser receives it through a server-sent event stream (or by polling)
+and replaces the preview.
+
+Preview error estimate: the preview is also analysed at half its resolution
+with the same settings. Resolution errors roughly halve with every doubling of
+the resolution, so twice the change between those two levels is reported as a
+heuristic estimate of the preview's deviation from the full-resolution values;
+it is not a bound. The final result reports the actual deviation of the
+preview for comparison.
+
+Identical progressive requests share one job. Each request that is handed the
+job holds a reference to it; `replaces` releases the previous job's reference,
+and the job is only cancelled once no request holds it any more.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from circular_stats import hue_difference
+
+ZONES = ('SZ', 'MZ', 'DZ')
+DEVIATION_KEYS = ('mean_angle', 'std_angle', 'avg_hue')
+
+
+class _Job:
+    def __init__(self, preview):
+        self.done = threading.Event()
+        self.preview = preview
+        self.result = None
+        self.error = None
+        self.future = None
+        self.holders = 1
+        self.created = time.time()
+        self.finished = None
+
+    def state(self):
+        if not self.done.is_set():
+            return 'running' if self.future is not None and self.future.running() else 'queued'
+        return 'failed' if self.error is not None else 'done'
+
+
+class RefinementJobs:
+    """
+    Background full-resolution refinements, keyed by the full analysis' cache key
+    (identical progressive requests share one job, counted in its `holders`).
+
+    Args:
+        workers: refinements that run at the same time
+        ttl: seconds finished jobs are kept for late subscribers
+    """
+
+    def __init__(self, workers=2, ttl=600):
+        self.workers = int(workers)
+        self.ttl = float(ttl)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='refine')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def submit(self, job_id, preview, compute):
+        """
+        Queue `compute()` as job `job_id` unless it is already queued, running or
+        done; a request sharing an existing job adds a holder to it.
+        """
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is not None and job.state() != 'failed':
+                job.holders += 1
+                return job
+            job = self._jobs[job_id] = _Job(preview)
+            self.submitted += 1
+        job.future = self._executor.submit(self._run, job, compute)
+        return job
+
+    def _run(self, job, compute):
+        try:
+            job.result = compute()
+        except BaseException as e:
+            job.error = e
+            with self._lock:
+                self.failed += 1
+        finally:
+            job.finished = time.time()
+            job.done.set()
+
+    def cancel(self, job_id):
+        """
+        Release one holder of a job (its requester moved on). The job is dropped
+        only if nobody else holds it and it has not started yet. Returns True if
+        cancelled.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return False
+            job.holders = max(0, job.holders - 1)
+            if job.holders or job.future is None or not job.future.cancel():
+                return False
+            job.error = CancelledError('Refinement was superseded by a newer request')
+            job.finished = time.time()
+            job.done.set()
+            self.cancelled += 1
+            return True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """The job after waiting up to `timeout` seconds for it to finish (None if unknown)."""
+        job = self.get(job_id)
+        if job is not None:
+            job.done.wait(timeout)
+        return job
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [k for k, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def metrics(self):
+        with self._lock:
+            states = [job.state() for job in self._jobs.values()]
+            return {
+                'workers': self.workers,
+                'jobs': len(states),
+                'queued': states.count('queued'),
+                'running': states.count('running'),
+                'submitted': self.submitted,
+                'cancelled': self.cancelled,
+                'failed': self.failed
+            }
+
+
+def deviation(a, b, factor=1):
+    """
+    Largest absolute differences between two /analyze responses (times `factor`):
+    per zone (mean_angle, std_angle, avg_hue around the hue circle) and over the
+    depth profile angles.
+    """
+    out = {}
+    for zone in ZONES:
+        za, zb = a['results'][zone], b['results'][zone]
+        out[zone] = {}
+        for key in DEVIATION_KEYS:
+            if key == 'avg_hue':
+                diff = float(hue_difference(za[key], zb[key]))
+            else:
+                diff = abs(float(za[key]) - float(zb[key]))
+            out[zone][key] = round(factor * diff, 2)
+    out['depth_profile_angle'] = round(factor * max(
+        (abs(p['angle'] - q['angle']) for p, q in zip(a['depth_profile'], b['depth_profile'])), default=0.0), 2)
+    return out
+
+
+def jobs_from_env():
+    """Refinement jobs with PROGRESSIVE_WORKERS (default 2) and PROGRESSIVE_TTL seconds (default 600)."""
+    return RefinementJobs(int(os.environ.get('PROGRESSIVE_WORKERS', 2)),
+                          float(os.environ.get('PROGRESSIVE_TTL', 600)))
@@ -0,0 +1,200 @@
+"""
+Fast quality gate run before a full analysis.
+
+Blank, overexposed or badly blurred slides used to go through the whole
+/analyze pipeline (HSV conversion, K-Means with AI detection, depth profile)
+and came back as meaningless numbers or "Image appears empty or too dark".
+The gate decodes the image at reduced resolution (JPEG is decoded directly at
+1/2-1/8 size by the codec), shrinks it to at most `max_side` pixels and measures
+in a few milliseconds:
+
+    valid_fraction     share of pixels that pass the zone mask (V > 10, S > 10)
+    saturation_spread  5th-95th percentile range of saturation over those pixels;
+                       a flat, unstained or washed-out frame has (almost) none
+    focus              variance of the Laplacian over those pixels (sharpness)
+
+Too few valid pixels or no saturation spread are blocking issues (the analysis
+could not produce anything meaningful); low focus is not, since a slightly soft
+slide still gives usable zone averages. By default every issue is only reported
+with the result; in 'reject' mode (opt-in) blocking issues stop the analysis.
+"""
+import os
+import time
+import threading
+
+import cv2
+import numpy as np
+
+from admission import image_dimensions
+
+QUALITY_LIMITS = {
+    'min_valid_fraction': 0.02,
+    'min_saturation_spread': 5.0,
+    'min_focus': 10.0
+}
+
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+class QualityRejected(Exception):
+    """Raised when an image fails a blocking quality check; carries the full report."""
+
+    def __init__(self, reason, report):
+        super().__init__(reason)
+        self.reason = reason
+        self.report = report
+
+
+def reduction_factor(dims, max_side):
+    """Largest decoder reduction (1, 2, 4 or 8) that keeps the image at least `max_side`."""
+    factor = 1
+    if dims:
+        while factor < 8 and max(dims) / (factor * 2) >= max_side:
+            factor *= 2
+    return factor
+
+
+def decode_cost(image_bytes, max_side):
+    """Pixels the reduced decode allocates (only JPEG is decoded at reduced size)."""
+    dims = image_dimensions(image_bytes)
+    if dims is None:
+        return max_side * max_side
+    factor = reduction_factor(dims, max_side) if bytes(image_bytes[:2]) == b'\xff\xd8' else 1
+    return dims[0] * dims[1] // (factor * factor)
+
+
+def decode_small(image_bytes, max_side):
+    """
+    Decode to a BGR image no larger than `max_side` on its long side.
+    Returns (image, scale = small size / full size), or (None, None) if undecodable.
+    """
+    dims = image_dimensions(image_bytes)
+    factor = reduction_factor(dims, max_side)
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), REDUCED_FLAGS[factor])
+    if img is None:
+        return None, None
+    full_w = dims[0] if dims else img.shape[1] * factor
+    img = shrink(img, max_side)
+    return img, img.shape[1] / float(full_w)
+
+
+def shrink(img, max_side):
+    """`img` resized (area averaging) so its long side is at most `max_side`."""
+    if max(img.shape[:2]) <= max_side:
+        return img
+    s = max_side / float(max(img.shape[:2]))
+    return cv2.resize(img, (max(1, int(img.shape[1] * s)), max(1, int(img.shape[0] * s))),
+                      interpolation=cv2.INTER_AREA)
+
+
+class QualityGate:
+    """
+    Pre-analysis checks on a downsampled decode.
+
+    Args:
+        mode: 'flag' (never raise, only report) or 'reject' (blocking checks raise
+            QualityRejected)
+        limits: overrides for QUALITY_LIMITS
+        max_side: long side of the image the checks run on
+    """
+
+    def __init__(self, mode='flag', limits=None, max_side=256):
+        self.mode = mode
+        self.limits = dict(QUALITY_LIMITS, **(limits or {}))
+        self.max_side = int(max_side)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+        self.flagged = 0
+
+    def measure(self, img):
+        """Quality measurements of a (small) BGR image."""
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        valid = (hsv[:, :, 2] > 10) & (hsv[:, :, 1] > 10)
+        sat = hsv[:, :, 1][valid]
+        spread = float(np.percentile(sat, 95) - np.percentile(sat, 5)) if sat.size else 0.0
+        focus = 0.0
+        if valid.any():
+            laplacian = cv2.Laplacian(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), cv2.CV_32F)
+            focus = float(laplacian[valid].var())
+        return {
+            'valid_fraction': round(float(valid.mean()), 4),
+            'saturation_spread': round(spread, 1),
+            'focus': round(focus, 1),
+            'mean_value': round(float(hsv[:, :, 2].mean()), 1)
+        }
+
+    def issues(self, metrics):
+        """(blocking reasons, warnings) for a set of measurements."""
+        limits = self.limits
+        blocking, warnings = [], []
+        if metrics['valid_fraction'] < limits['min_valid_fraction']:
+            if metrics['mean_value'] > 200:
+                kind = 'overexposed'
+            elif metrics['mean_value'] < 30:
+                kind = 'blank or too dark'
+            else:
+                kind = 'unstained or grey'
+            blocking.append(f"Image looks {kind}: only {metrics['valid_fraction'] * 100:.1f}% of pixels "
+                            f"are coloured (minimum {limits['min_valid_fraction'] * 100:.0f}%)")
+        elif metrics['saturation_spread'] < limits['min_saturation_spread']:
+            blocking.append(f"Image has no colour variation (saturation spread "
+                            f"{metrics['saturation_spread']:.1f} < {limits['min_saturation_spread']:.0f}): "
+                            f"washed out or a flat frame")
+        if metrics['valid_fraction'] > 0 and metrics['focus'] < limits['min_focus']:
+            warnings.append(f"Image may be out of focus (focus {metrics['focus']:.1f} < {limits['min_focus']:.0f})")
+        return blocking, warnings
+
+    def check(self, img, started=None):
+        """
+        Run the checks on a small BGR image (see decode_small). Returns the report
+        {passed, issues, ms, ...measurements}, with `ms` counted from `started`
+        (a time.perf_counter() value, e.g. taken before decoding) if given.
+        In 'reject' mode raises QualityRejected for blocking failures.
+        """
+        started = started if started is not None else time.perf_counter()
+        metrics = self.measure(img)
+        blocking, warnings = self.issues(metrics)
+        report = dict(metrics, passed=not blocking, issues=blocking + warnings,
+                      ms=round((time.perf_counter() - started) * 1000, 1))
+        reject = bool(blocking) and self.mode == 'reject'
+        with self._lock:
+            self.checked += 1
+            if reject:
+                self.rejected += 1
+            elif blocking or warnings:
+                self.flagged += 1
+        if reject:
+            raise QualityRejected(blocking[0], report)
+        return report
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'limits': self.limits,
+                'max_side': self.max_side,
+                'checked': self.checked,
+                'rejected': self.rejected,
+                'flagged': self.flagged
+            }
+
+
+def gate_from_env():
+    """
+    Quality gate from QUALITY_GATE (flag | reject | off, default flag),
+    QUALITY_MIN_VALID_FRACTION, QUALITY_MIN_SATURATION_SPREAD, QUALITY_MIN_FOCUS and
+    QUALITY_MAX_SIDE (default 256). Returns None when the gate is off.
+    """
+    mode = os.environ.get('QUALITY_GATE', 'flag').lower()
+    if mode in ('off', '0', 'false', ''):
+        return None
+    limits = {}
+    for key, env in (('min_valid_fraction', 'QUALITY_MIN_VALID_FRACTION'),
+                     ('min_saturation_spread', 'QUALITY_MIN_SATURATION_SPREAD'),
+                     ('min_focus', 'QUALITY_MIN_FOCUS')):
+        if os.environ.get(env):
+            limits[key] = float(os.environ[env])
+    return QualityGate('reject' if mode == 'reject' else 'flag', limits,
+                       int(os.environ.get('QUALITY_MAX_SIDE', 256)))
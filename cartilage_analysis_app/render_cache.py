@@ -0,0 +1,100 @@
+"""
+Content-addressed, size-bounded cache for rendered images.
+
+Rendered overlays (annotated zones, hue heatmaps, masks...) used to be written
+to static/uploads under random names on every request, so identical inputs
+were never reused and the folder grew forever. Instead, each rendering is
+stored in memory under a key derived from the *content* of the input image and
+the render parameters, and served from `/render/<key>`. Least recently used
+entries are evicted once the cache exceeds its byte budget.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def image_fingerprint(img):
+    """Stable content hash of a decoded image array (pixels + shape)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((img.shape, str(img.dtype))).encode())
+    digest.update(memoryview(img if img.flags['C_CONTIGUOUS'] else img.copy()).cast('B'))
+    return digest.hexdigest()
+
+
+def render_key(fingerprint, kind, **params):
+    """Key for one rendering of an image: fingerprint + render kind + sorted parameters."""
+    parts = [fingerprint, kind] + [f"{k}={params[k]}" for k in sorted(params)]
+    return hashlib.blake2b('|'.join(parts).encode(), digest_size=16).hexdigest()
+
+
+class RenderCache:
+    """
+    Thread-safe LRU mapping of key -> (encoded bytes, mimetype).
+
+    Args:
+        max_bytes: total size of cached encodings before LRU eviction
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, data, mimetype='image/jpeg'):
+        data = bytes(data)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (data, mimetype)
+            self._bytes += len(data)
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+        return key
+
+    def get_or_render(self, key, render, mimetype='image/jpeg'):
+        """Return cached bytes for `key`, calling `render()` (-> encoded bytes) on a miss."""
+        entry = self.get(key)
+        if entry is not None:
+            return entry[0]
+        data = render()
+        self.put(key, data, mimetype)
+        return data
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+def cache_from_env():
+    """Build the process-wide render cache; size from RENDER_CACHE_MB (default 256)."""
+    return RenderCache(float(os.environ.get('RENDER_CACHE_MB', 256)) * 1024 * 1024)
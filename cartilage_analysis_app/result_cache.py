@@ -0,0 +1,178 @@
+"""
+Two-tier memo of finished /analyze results.
+
+Reloading the reference-batch page or re-exporting sends the same image with
+the same parameters again, and each request used to recompute everything.
+Results are stored under a key made of the image content hash, the normalised
+analysis parameters and the algorithm version:
+
+    memory  thread-safe LRU of encoded results, bounded by bytes
+    disk    SQLite database (shared by all worker processes), bounded by
+            total size and a time-to-live
+
+Rows written by another algorithm version are deleted when the cache is
+opened, and a version mismatch can never produce a hit because the version is
+part of the key. Alongside the JSON result the annotated JPEG is kept, so its
+/render URL can be restored without re-analysing.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def content_hash(data):
+    """Hash of encoded image bytes (before decoding)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def result_key(image_hash, params, version):
+    """Cache key for one analysis: image hash + normalised parameters + algorithm version."""
+    payload = json.dumps([image_hash, params, version], sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """
+    Memory + SQLite cache of (result dict, annotated JPEG bytes).
+
+    Args:
+        path: SQLite file for the disk tier (None = memory only)
+        version: algorithm version; rows of other versions are discarded
+        memory_bytes: budget of the in-memory LRU
+        disk_bytes: budget of the disk tier; least recently used rows are deleted beyond it
+        ttl: seconds a disk entry stays valid after it was written
+    """
+
+    def __init__(self, path, version, memory_bytes, disk_bytes, ttl):
+        self.path = path
+        self.version = version
+        self.memory_bytes = int(memory_bytes)
+        self.disk_bytes = int(disk_bytes)
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' key TEXT PRIMARY KEY, version TEXT, created REAL, accessed REAL,'
+                ' size INTEGER, result BLOB, annotated BLOB)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            with self._db:
+                self._db.execute('DELETE FROM results WHERE version != ?', (version,))
+            self.prune()
+
+    def _remember(self, key, blob, annotated):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[0]) + len(old[1])
+        self._entries[key] = (blob, annotated)
+        self._bytes += len(blob) + len(annotated)
+        while self._bytes > self.memory_bytes and len(self._entries) > 1:
+            _, (b, a) = self._entries.popitem(last=False)
+            self._bytes -= len(b) + len(a)
+
+    def get(self, key):
+        """Return (result dict, annotated JPEG bytes) or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(entry[0]), entry[1]
+            if self._db is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            row = self._db.execute(
+                'SELECT result, annotated FROM results WHERE key = ? AND version = ? AND created > ?',
+                (key, self.version, now - self.ttl)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self._db:
+                self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            blob, annotated = bytes(row[0]), bytes(row[1] or b'')
+            self._remember(key, blob, annotated)
+            self.disk_hits += 1
+            return json.loads(blob), annotated
+
+    def put(self, key, result, annotated=b''):
+        blob = json.dumps(result, separators=(',', ':')).encode()
+        annotated = bytes(annotated or b'')
+        with self._lock:
+            self._remember(key, blob, annotated)
+            if self._db is None:
+                return
+            now = time.time()
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, self.version, now, now, len(blob) + len(annotated), blob, annotated))
+            self._writes += 1
+            prune = self._writes % 50 == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Drop expired disk entries, then least recently used ones beyond the size budget."""
+        if self._db is None:
+            return
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM results WHERE created <= ?', (time.time() - self.ttl,))
+                total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+                if total > self.disk_bytes:
+                    rows = self._db.execute('SELECT key, size FROM results ORDER BY accessed').fetchall()
+                    doomed = []
+                    for key, size in rows:
+                        if total <= self.disk_bytes:
+                            break
+                        doomed.append((key,))
+                        total -= size
+                    self._db.executemany('DELETE FROM results WHERE key = ?', doomed)
+
+    def metrics(self):
+        with self._lock:
+            info = {
+                'version': self.version,
+                'memory_entries': len(self._entries),
+                'memory_bytes': self._bytes,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+            if self._db is not None:
+                count, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+                info.update({'disk_entries': count, 'disk_bytes': size, 'path': self.path})
+            return info
+
+
+def cache_from_env(version):
+    """
+    Result cache from RESULT_CACHE_DIR (default: system temp; empty string disables the
+    disk tier), RESULT_CACHE_MB (memory, default 64), RESULT_CACHE_DISK_MB (default 512)
+    and RESULT_CACHE_TTL_HOURS (default 720).
+    """
+    directory = os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'cartilage_results'))
+    return ResultCache(
+        os.path.join(directory, 'results.sqlite') if directory else None,
+        version,
+        float(os.environ.get('RESULT_CACHE_MB', 64)) * 1024 * 1024,
+        float(os.environ.get('RESULT_CACHE_DISK_MB', 512)) * 1024 * 1024,
+        float(os.environ.get('RESULT_CACHE_TTL_HOURS', 720)) * 3600
+    )
@@ -0,0 +1,325 @@
+"""
+Indexed database of analysis results for cross-study queries.
+
+Comparing studies used to mean collecting downloaded .xlsx files and loading
+them into the Excel plotter. Every analysis is now also recorded in a SQLite
+database (one file shared by all server processes, the batch runs and the
+watch-folder daemon):
+
+    samples   one row per analysis (image content hash + parameters + algorithm
+              version): source name, date, calibration, zone boundaries and the
+              SZ/MZ/DZ mean/std angle and hue as indexed columns
+    profiles  the depth profile, one row per sample and bin
+    tags      free-form labels such as "study:OA-2026" or "healthy", many per sample
+
+Queries filter on tags, date range, source name and zone values. Aggregated
+depth profiles (mean, std and count of the angle per bin) of whole cohorts are
+computed by SQLite in one GROUP BY over the indexed rows, so comparing thousands
+of samples needs no spreadsheet parsing.
+
+Filters (all optional):
+    {"tags": ["study:OA"],                 every tag must be present
+     "since": "2026-01-01", "until": "2026-06-30",
+     "source": "knee",                     substring of the file name
+     "use_ai": false, "version": "2026.10-1",
+     "zones": {"DZ": {"mean_angle": [60, null]}, "SZ": {"std_angle": [null, 25]}}}
+"""
+import os
+import math
+import time
+import sqlite3
+import datetime
+import threading
+
+ZONES = ('SZ', 'MZ', 'DZ')
+ZONE_STATS = {'mean_angle': 'mean', 'std_angle': 'std', 'avg_hue': 'hue'}
+MAX_TAG_LENGTH = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    analysis_key TEXT UNIQUE,
+    content_hash TEXT,
+    version TEXT,
+    source TEXT,
+    analyzed_at REAL,
+    use_ai INTEGER,
+    zero_hue REAL, ninety_hue REAL,
+    sz_end REAL, mz_end REAL,
+    sz_mean REAL, sz_std REAL, sz_hue REAL,
+    mz_mean REAL, mz_std REAL, mz_hue REAL,
+    dz_mean REAL, dz_std REAL, dz_hue REAL
+);
+CREATE INDEX IF NOT EXISTS samples_analyzed_at ON samples (analyzed_at);
+CREATE INDEX IF NOT EXISTS samples_content_hash ON samples (content_hash);
+CREATE INDEX IF NOT EXISTS samples_sz_mean ON samples (sz_mean);
+CREATE INDEX IF NOT EXISTS samples_mz_mean ON samples (mz_mean);
+CREATE INDEX IF NOT EXISTS samples_dz_mean ON samples (dz_mean);
+CREATE TABLE IF NOT EXISTS profiles (
+    sample_id INTEGER, bin INTEGER, thickness REAL,
+    angle REAL, std REAL, mean_hue REAL, intensity REAL, filled INTEGER,
+    PRIMARY KEY (sample_id, bin)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT, sample_id INTEGER,
+    PRIMARY KEY (tag, sample_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_sample ON tags (sample_id);
+"""
+
+
+def _timestamp(value, end_of_day=False):
+    """Unix time of an ISO date/datetime string (a bare `until` date includes that whole day)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = datetime.datetime.fromisoformat(str(value))
+    if end_of_day and len(str(value)) <= 10:
+        parsed += datetime.timedelta(days=1)
+    return parsed.timestamp()
+
+
+def _hue_sin(hue):
+    return None if hue is None else math.sin(math.radians(2.0 * hue))
+
+
+def _hue_cos(hue):
+    return None if hue is None else math.cos(math.radians(2.0 * hue))
+
+
+def circular_hue(mean_sin, mean_cos):
+    """Circular mean hue (0-180) from the mean sine and cosine of hue angles (hue h = 2h degrees)."""
+    if mean_sin is None or mean_cos is None:
+        return None
+    return (math.degrees(math.atan2(mean_sin, mean_cos)) % 360.0) / 2.0
+
+
+def normalize_tags(tags):
+    if isinstance(tags, str):
+        tags = [tags]
+    clean = []
+    for tag in tags or []:
+        tag = str(tag).strip()[:MAX_TAG_LENGTH]
+        if tag and tag not in clean:
+            clean.append(tag)
+    return clean
+
+
+def where_clause(filters):
+    """SQL condition on `samples s` and its parameters for a filter dict."""
+    filters = filters or {}
+    if not isinstance(filters, dict):
+        raise ValueError('Filters must be an object')
+    conditions, params = [], []
+    tags = normalize_tags(filters.get('tags'))
+    if tags:
+        conditions.append(
+            f"s.id IN (SELECT sample_id FROM tags WHERE tag IN ({','.join('?' * len(tags))})"
+            " GROUP BY sample_id HAVING COUNT(*) = ?)")
+        params += tags + [len(tags)]
+    if filters.get('since'):
+        conditions.append('s.analyzed_at >= ?')
+        params.append(_timestamp(filters['since']))
+    if filters.get('until'):
+        conditions.append('s.analyzed_at < ?')
+        params.append(_timestamp(filters['until'], end_of_day=True))
+    if filters.get('source'):
+        conditions.append("s.source LIKE ? ESCAPE '\\'")
+        escaped = str(filters['source']).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params.append(f'%{escaped}%')
+    if filters.get('use_ai') is not None:
+        conditions.append('s.use_ai = ?')
+        params.append(int(bool(filters['use_ai'])))
+    if filters.get('version'):
+        conditions.append('s.version = ?')
+        params.append(str(filters['version']))
+    zones = filters.get('zones') or {}
+    if not isinstance(zones, dict):
+        raise ValueError('zones must map zone names to {value: [min, max]} filters')
+    for zone, stats in zones.items():
+        if zone not in ZONES:
+            raise ValueError(f"Unknown zone {zone!r}; use one of {list(ZONES)}")
+        if not isinstance(stats, dict):
+            raise ValueError(f"zones.{zone} must map zone values to [min, max] bounds")
+        for stat, bounds in stats.items():
+            if stat not in ZONE_STATS:
+                raise ValueError(f"Unknown zone value {stat!r}; use one of {list(ZONE_STATS)}")
+            if not isinstance(bounds, (list, tuple)) or len(bounds) > 2:
+                raise ValueError(f"zones.{zone}.{stat} must be [min, max] (null for no limit)")
+            column = f's.{zone.lower()}_{ZONE_STATS[stat]}'
+            low, high = (list(bounds) + [None, None])[:2]
+            if low is not None:
+                conditions.append(f'{column} >= ?')
+                params.append(float(low))
+            if high is not None:
+                conditions.append(f'{column} <= ?')
+                params.append(float(high))
+    return (' AND '.join(conditions) or '1'), params
+
+
+class ResultsDatabase:
+    """
+    SQLite store of analysis results.
+
+    Args:
+        path: database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        # Hue is circular (179 and 0 are both red): cohort hues average sine and cosine
+        self._db.create_function('HUE_SIN', 1, _hue_sin, deterministic=True)
+        self._db.create_function('HUE_COS', 1, _hue_cos, deterministic=True)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+
+    def record(self, analysis_key, content_hash, version, response, use_ai=False, source=None, tags=None):
+        """
+        Store an /analyze response (once per analysis key) and attach `tags`.
+        Returns the sample id.
+        """
+        zones = response['results']
+        calibration = response['color_calibration']
+        boundaries = response['zone_boundaries']
+        row = [analysis_key, content_hash, version, source, time.time(), int(bool(use_ai)),
+               calibration['zero_hue'], calibration['ninety_hue'],
+               boundaries['sz_end'], boundaries['mz_end']]
+        for zone in ZONES:
+            row += [zones[zone]['mean_angle'], zones[zone]['std_angle'], zones[zone]['avg_hue']]
+
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                f'INSERT OR IGNORE INTO samples (analysis_key, content_hash, version, source, analyzed_at, use_ai,'
+                ' zero_hue, ninety_hue, sz_end, mz_end, sz_mean, sz_std, sz_hue, mz_mean, mz_std, mz_hue,'
+                f' dz_mean, dz_std, dz_hue) VALUES ({",".join("?" * len(row))})', row)
+            if cursor.rowcount:
+                sample_id = cursor.lastrowid
+                self._db.executemany(
+                    'INSERT INTO profiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(sample_id, i, p['thickness'], p['angle'], p['std'], p['mean_hue'],
+                      p.get('intensity'), int(p.get('filled', False)))
+                     for i, p in enumerate(response['depth_profile'])])
+            else:
+                sample_id = self._db.execute(
+                    'SELECT id FROM samples WHERE analysis_key = ?', (analysis_key,)).fetchone()[0]
+                if source:
+                    self._db.execute('UPDATE samples SET source = ? WHERE id = ? AND source IS NULL',
+                                     (source, sample_id))
+            self._db.executemany('INSERT OR IGNORE INTO tags VALUES (?, ?)',
+                                 [(tag, sample_id) for tag in normalize_tags(tags)])
+        return sample_id
+
+    def tag(self, sample_id, add=None, remove=None):
+        """Add/remove tags of a sample; returns its tags, or None if it does not exist."""
+        with self._lock, self._db:
+            if self._db.execute('SELECT 1 FROM samples WHERE id = ?', (sample_id,)).fetchone() is None:
+                return None
+            self._db.executemany('INSERT OR IGNORE INTO tags VALUES (?, ?)',
+                                 [(t, sample_id) for t in normalize_tags(add)])
+            self._db.executemany('DELETE FROM tags WHERE tag = ? AND sample_id = ?',
+                                 [(t, sample_id) for t in normalize_tags(remove)])
+            return self._tags([sample_id])[sample_id]
+
+    def _tags(self, sample_ids):
+        found = {i: [] for i in sample_ids}
+        for start in range(0, len(sample_ids), 500):
+            chunk = sample_ids[start:start + 500]
+            for tag, sample_id in self._db.execute(
+                    f"SELECT tag, sample_id FROM tags WHERE sample_id IN ({','.join('?' * len(chunk))}) ORDER BY tag",
+                    chunk):
+                found[sample_id].append(tag)
+        return found
+
+    @staticmethod
+    def _sample(row, tags):
+        return {
+            'id': row['id'],
+            'source': row['source'],
+            'content_hash': row['content_hash'],
+            'version': row['version'],
+            'analyzed_at': datetime.datetime.fromtimestamp(row['analyzed_at']).isoformat(timespec='seconds'),
+            'use_ai': bool(row['use_ai']),
+            'tags': tags,
+            'color_calibration': {'zero_hue': row['zero_hue'], 'ninety_hue': row['ninety_hue']},
+            'zone_boundaries': {'sz_end': row['sz_end'], 'mz_end': row['mz_end']},
+            'results': {zone: {stat: row[f'{zone.lower()}_{column}'] for stat, column in ZONE_STATS.items()}
+                        for zone in ZONES}
+        }
+
+    def query(self, filters=None, limit=100, offset=0):
+        """Samples matching `filters`, newest first: {'total', 'samples'}."""
+        where, params = where_clause(filters)
+        with self._lock:
+            total = self._db.execute(f'SELECT COUNT(*) FROM samples s WHERE {where}', params).fetchone()[0]
+            rows = self._db.execute(
+                f'SELECT * FROM samples s WHERE {where} ORDER BY s.analyzed_at DESC, s.id DESC LIMIT ? OFFSET ?',
+                params + [int(limit), int(offset)]).fetchall()
+            tags = self._tags([row['id'] for row in rows])
+        return {'total': total, 'samples': [self._sample(row, tags[row['id']]) for row in rows]}
+
+    def sample(self, sample_id):
+        """One sample with its depth profile, or None."""
+        with self._lock:
+            row = self._db.execute('SELECT * FROM samples WHERE id = ?', (sample_id,)).fetchone()
+            if row is None:
+                return None
+            profile = self._db.execute(
+                'SELECT thickness, angle, std, mean_hue, intensity, filled FROM profiles'
+                ' WHERE sample_id = ? ORDER BY bin', (sample_id,)).fetchall()
+            tags = self._tags([sample_id])[sample_id]
+        sample = self._sample(row, tags)
+        sample['depth_profile'] = [dict(p, filled=bool(p['filled'])) for p in profile]
+        return sample
+
+    def aggregate(self, filters=None, include_filled=True):
+        """
+        Cohort summary of the matching samples: per-bin mean/std/count of the
+        profile angle, circular mean of the profile hue, and mean/std of each
+        zone's mean angle.
+        """
+        where, params = where_clause(filters)
+        filled = '' if include_filled else ' AND p.filled = 0'
+        with self._lock:
+            bins = self._db.execute(
+                'SELECT p.bin, MIN(p.thickness), COUNT(*), AVG(p.angle), AVG(p.angle * p.angle),'
+                ' AVG(HUE_SIN(p.mean_hue)), AVG(HUE_COS(p.mean_hue))'
+                f' FROM profiles p JOIN samples s ON s.id = p.sample_id WHERE {where}{filled}'
+                ' GROUP BY p.bin ORDER BY p.bin', params).fetchall()
+            zone_columns = ', '.join(f'AVG(s.{z}_mean), AVG(s.{z}_mean * s.{z}_mean)' for z in ('sz', 'mz', 'dz'))
+            summary = self._db.execute(
+                f'SELECT COUNT(*), {zone_columns} FROM samples s WHERE {where}', params).fetchone()
+
+        def spread(mean, mean_sq):
+            return round(max(mean_sq - mean * mean, 0.0) ** 0.5, 3) if mean is not None else None
+
+        zones = {}
+        for i, zone in enumerate(ZONES):
+            mean, mean_sq = summary[1 + 2 * i], summary[2 + 2 * i]
+            zones[zone] = {'mean_angle': round(mean, 3) if mean is not None else None,
+                           'std_angle': spread(mean, mean_sq)}
+        return {
+            'samples': summary[0],
+            'zones': zones,
+            'profile': {
+                'thickness': [row[1] for row in bins],
+                'count': [row[2] for row in bins],
+                'angle': [round(row[3], 3) for row in bins],
+                'std': [spread(row[3], row[4]) for row in bins],
+                'mean_hue': [round(circular_hue(row[5], row[6]), 2) % 180.0 for row in bins]
+            }
+        }
+
+    def metrics(self):
+        with self._lock:
+            samples = self._db.execute('SELECT COUNT(*) FROM samples').fetchone()[0]
+            tags = self._db.execute('SELECT COUNT(DISTINCT tag) FROM tags').fetchone()[0]
+        return {'path': self.path, 'samples': samples, 'tags': tags}
+
+
+def database_from_env():
+    """Results database at RESULTS_DB (default results.sqlite next to this file; empty = disabled)."""
+    path = os.environ.get('RESULTS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.sqlite'))
+    return ResultsDatabase(path) if path else None
@@ -0,0 +1,82 @@
+"""
+Single-flight coalescing of identical concurrent computations.
+
+When several people open the same reference study, identical /analyze
+requests arrive at the same moment. The first request for a key (the leader)
+runs the computation; requests for the same key that arrive while it is in
+flight wait for it and share its result (or its exception) instead of
+decoding and analysing the image again. Keys are independent: each in-flight
+key has its own event, so unrelated analyses never wait on each other.
+"""
+import copy
+import threading
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Per-key coalescing of concurrent calls within one process."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    def run(self, key, compute):
+        """
+        Return (result, shared): the result of `compute()` for `key`, computed once
+        for all concurrent callers. `shared` is True for callers that waited on
+        another caller's computation; they receive a deep copy, so they may
+        modify it freely.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+                self.max_waiters = max(self.max_waiters, flight.waiters)
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result), True
+
+        try:
+            flight.result = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # No caller can join once the key is removed, so `waiters` is final
+            with self._lock:
+                self._flights.pop(key, None)
+            if flight.error is None and flight.waiters:
+                result = copy.deepcopy(flight.result)
+            else:
+                result = flight.result
+            flight.done.set()
+        return result, False
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'waiting': sum(f.waiters for f in self._flights.values()),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'max_waiters': self.max_waiters
+            }
@@ -0,0 +1,39 @@
+// Progressive /analyze: a request with `progressive: true` is answered with a fast
+// low-resolution preview (data.progressive.stage === 'preview'); the exact
+// full-resolution result follows from a background job.
+
+function isPreview(data) {
+    return !!(data && data.progressive && data.progressive.stage === 'preview');
+}
+
+// Resolves with the final /analyze response (or an {error} object) of a preview
+function waitForRefinement(progressive) {
+    return new Promise(resolve => {
+        if (!window.EventSource) {
+            pollRefinement(progressive.refined_url).then(resolve);
+            return;
+        }
+        const source = new EventSource(progressive.events_url);
+        const finish = e => { source.close(); resolve(JSON.parse(e.data)); };
+        source.addEventListener('final', finish);
+        source.addEventListener('failed', finish);
+        // Stream unavailable (proxy, expired job): fall back to long polling
+        source.onerror = () => { source.close(); pollRefinement(progressive.refined_url).then(resolve); };
+    });
+}
+
+async function pollRefinement(url) {
+    while (true) {
+        const res = await fetch(url + '?wait=25');
+        if (res.status !== 202) return res.json();
+    }
+}
+
+// Short status line for a preview or final result
+function refinementNote(data) {
+    if (!isPreview(data)) return 'Full resolution';
+    const estimate = data.progressive.error_estimate;
+    const worst = Math.max(...['SZ', 'MZ', 'DZ'].map(z => estimate[z].mean_angle));
+    const scale = Math.round(1 / data.progressive.scale);
+    return `Preview at 1/${scale} resolution (zone mean angles about ±${worst.toFixed(1)}°), refining…`;
+}
@@ -8,6 +8,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const loader = document.getElementById('loader');
 
     let cropper = null;
+    let refinementJob = null; // background full-resolution job of the shown preview
 
     // Handle File Selection
     fileInput.addEventListener('change', handleFileSelect);
@@ -197,16 +198,24 @@ document.addEventListener('DOMContentLoaded', () => {
                 image: zonePreviewImg.src,
                 sz_boundary: szThick, // Pass thickness
                 mz_boundary: szThick + mzThick, // Pass absolute split point
-                use_ai: document.getElementById('use-ai-checkbox').checked
+                use_ai: document.getElementById('use-ai-checkbox').checked,
+                // Fast low-resolution preview first, exact result pushed when ready
+                progressive: true,
+                replaces: refinementJob
             })
         })
             .then(response => response.json())
-            .then(data => {
+            .then(function showAnalysis(data) {
                 loader.classList.add('hidden');
+                const preview = isPreview(data);
                 if (data.success) {
+                    // Passed the quality gate but flagged (e.g. soft focus)
+                    if (!preview && data.quality && data.quality.issues.length) {
+                        alert('Image quality warning:\n' + data.quality.issues.join('\n'));
+                    }
                     // check for AI results
                     if (data.ai_info && data.ai_info.detected) {
-                        alert(`AI Auto-Detection Complete!\nDetected SZ Hue: ${data.ai_info.sz_hue}\nDetected MZ Hue: ${data.ai_info.mz_hue || '--'}\nDetected DZ Hue: ${data.ai_info.dz_hue}\nZones adjusted.`);
+                        if (!preview) alert(`AI Auto-Detection Complete!\nDetected SZ Hue: ${data.ai_info.sz_hue}\nDetected MZ Hue: ${data.ai_info.mz_hue || '--'}\nDetected DZ Hue: ${data.ai_info.dz_hue}\nZones adjusted.`);
 
 
                         // Update Inputs with AI results
@@ -223,6 +232,21 @@ document.addEventListener('DOMContentLoaded', () => {
                         zone_boundaries: data.zone_boundaries
                     };
                     renderResults(data.results, data.annotated_image_url, data.depth_profile, data.zone_boundaries, data.color_calibration);
+                    if (data.tiles && data.tiles.viewer_url) {
+                        const zoomLink = document.getElementById('deep-zoom-link');
+                        zoomLink.href = data.tiles.viewer_url;
+                        zoomLink.classList.remove('hidden');
+                    }
+                    const status = document.getElementById('refine-status');
+                    status.textContent = refinementNote(data);
+                    status.classList.remove('hidden');
+                    if (preview) {
+                        const job = refinementJob = data.progressive.job;
+                        waitForRefinement(data.progressive).then(final => {
+                            // Ignore refinements of an analysis the user has replaced
+                            if (refinementJob === job) showAnalysis(final);
+                        });
+                    }
                 } else {
                     alert('Analysis failed: ' + data.error);
                     zoneSection.classList.remove('hidden');
@@ -0,0 +1,82 @@
+// Live tuning session: the image is sent once (POST /sessions), afterwards only
+// parameter deltas (sz_boundary, mz_boundary, force_zero_hue, force_ninety_hue).
+// Recomputed results arrive on the session's event stream.
+
+// How long an update may wait for its event before it is fetched directly
+const TUNING_STREAM_GRACE_MS = 3000;
+
+// Resolves with a session handle, or with the {error} response if it could not be opened
+async function openTuningSession(payload, onResult) {
+    const first = await fetch('/sessions', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+    }).then(r => r.json());
+    if (!first.success) return first;
+
+    const session = { id: first.session, version: first.version, onResult, pending: null, inFlight: false, source: null };
+    if (window.EventSource) {
+        session.source = new EventSource(`${first.events_url}?after=${first.version}`);
+        session.source.addEventListener('result', e => deliverTuning(session, JSON.parse(e.data)));
+        session.source.addEventListener('closed', () => expireTuning(session));
+        // Stream refused (proxy, server without streaming): fetch results directly
+        session.source.onerror = () => {
+            if (session.source && session.source.readyState === EventSource.CLOSED) session.source = null;
+        };
+    }
+    return session;
+}
+
+// Send parameter deltas; while a request is in flight further deltas are merged,
+// so a fast slider sends at most one update per round trip
+function tuneSession(session, deltas) {
+    session.pending = Object.assign(session.pending || {}, deltas);
+    if (session.inFlight || session.expired) return;
+
+    const body = session.pending;
+    session.pending = null;
+    session.inFlight = true;
+    fetch(`/sessions/${session.id}/params`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    }).then(async res => {
+        const data = await res.json();
+        if (res.status === 404) {
+            // Keep the lost change for the caller's fallback
+            session.pending = Object.assign(body, session.pending);
+            return expireTuning(session);
+        }
+        if (data.error) return session.onResult(data);
+        // No event stream, or its event is late (buffering proxy): fetch the result of this update directly
+        const fetchResult = async () => deliverTuning(session, await fetch(`/sessions/${session.id}?after=${data.version - 1}`).then(r => r.json()));
+        if (!session.source) return fetchResult();
+        setTimeout(() => {
+            if (!session.expired && session.version < data.version) fetchResult().catch(() => {});
+        }, TUNING_STREAM_GRACE_MS);
+    }).catch(e => session.onResult({ error: String(e) })).finally(() => {
+        session.inFlight = false;
+        if (session.pending) tuneSession(session, {});
+    });
+}
+
+function deliverTuning(session, data) {
+    if (data.version > session.version) {
+        session.version = data.version;
+        session.onResult(data);
+    }
+}
+
+function expireTuning(session) {
+    if (session.expired) return;
+    session.expired = true;
+    if (session.source) session.source.close();
+    session.onResult({ error: 'Tuning session expired', expired: true, pending: session.pending });
+}
+
+function closeTuningSession(session) {
+    if (!session) return;
+    session.expired = true;
+    if (session.source) session.source.close();
+    fetch(`/sessions/${session.id}`, { method: 'DELETE', keepalive: true }).catch(() => {});
+}
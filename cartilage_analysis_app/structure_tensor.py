@@ -0,0 +1,215 @@
+"""
+Texture-based fiber orientation from the image structure tensor.
+
+The hue method reads orientation from the polarisation colour. This module
+gives an independent estimate from the image texture itself:
+
+    J = G_rho * [[Ix*Ix, Ix*Iy], [Ix*Iy, Iy*Iy]]
+
+with Ix, Iy derivative-of-Gaussian gradients (scale sigma_grad) and G_rho a
+Gaussian integration window (scale sigma_int). All filters are separable and
+run through cv2.sepFilter2D over whole tiles at once. The dominant gradient
+direction is 0.5 * atan2(2 Jxy, Jxx - Jyy); fibers run perpendicular to it.
+Angles are folded to 0-90 degrees against the articular surface (image rows),
+matching the convention of the hue mapping (0 = parallel, 90 = perpendicular).
+Coherence (lambda1 - lambda2) / (lambda1 + lambda2) in [0, 1] says how strongly
+oriented the texture is and weights every statistic.
+
+Large slides are processed in tiles with a halo of the combined filter radius,
+so the result is identical to filtering the whole image, while memory stays
+bounded by the tile size. Only per-row accumulators (and optional uint8 maps)
+are kept, from which zone statistics and depth profiles are read like /analyze.
+"""
+import math
+
+import numpy as np
+import cv2
+
+from profiles import fill_gaps, profile_rows
+
+ANGLE_BINS = 91
+# Value used in uint8 maps for pixels outside the V>10 & S>10 mask
+NODATA = 255
+
+
+def kernel_radius(sigma):
+    return max(1, int(math.ceil(3.0 * sigma)))
+
+
+def gaussian_kernels(sigma):
+    """1-D Gaussian and derivative-of-Gaussian kernels (float32) for `sigma`."""
+    r = kernel_radius(sigma)
+    x = np.arange(-r, r + 1, dtype=np.float64)
+    g = np.exp(-x * x / (2.0 * sigma * sigma))
+    g /= g.sum()
+    dg = -x / (sigma * sigma) * g
+    # Unit response to a unit ramp, so gradients are in grey levels per pixel
+    dg /= -np.sum(x * dg)
+    return g.astype(np.float32), dg.astype(np.float32)
+
+
+def halo_size(sigma_grad, sigma_int):
+    """Overlap needed around a tile so its inner pixels match whole-image filtering."""
+    return kernel_radius(sigma_grad) + kernel_radius(sigma_int)
+
+
+def orientation_fields(gray, sigma_grad=1.5, sigma_int=6.0):
+    """
+    Per-pixel fiber angle (degrees, 0-90) and coherence (0-1) of a grayscale image.
+
+    Returns:
+        (angle, coherence) float32 arrays of the input shape
+    """
+    gray = np.asarray(gray, dtype=np.float32)
+    g, dg = gaussian_kernels(sigma_grad)
+    gi, _ = gaussian_kernels(sigma_int)
+    border = cv2.BORDER_REFLECT_101
+
+    ix = cv2.sepFilter2D(gray, cv2.CV_32F, dg, g, borderType=border)
+    iy = cv2.sepFilter2D(gray, cv2.CV_32F, g, dg, borderType=border)
+    jxx = cv2.sepFilter2D(ix * ix, cv2.CV_32F, gi, gi, borderType=border)
+    jyy = cv2.sepFilter2D(iy * iy, cv2.CV_32F, gi, gi, borderType=border)
+    jxy = cv2.sepFilter2D(ix * iy, cv2.CV_32F, gi, gi, borderType=border)
+
+    diff = jxx - jyy
+    # Gradient direction in (-90, 90]; fibers are perpendicular, so fold to 90 - |phi|
+    phi = 0.5 * np.degrees(np.arctan2(2.0 * jxy, diff))
+    angle = 90.0 - np.abs(phi)
+    trace = jxx + jyy
+    coherence = np.sqrt(diff * diff + 4.0 * jxy * jxy) / np.maximum(trace, 1e-6)
+    return angle.astype(np.float32), np.clip(coherence, 0.0, 1.0).astype(np.float32)
+
+
+def iter_tiles(height, width, tile, halo):
+    """
+    Yield (inner, outer, offset) for a tiling of an image: `inner` and `outer`
+    are (y0, y1, x0, x1) boxes, `offset` is the inner box position inside the
+    outer (halo-padded) box.
+    """
+    for y0 in range(0, height, tile):
+        for x0 in range(0, width, tile):
+            y1, x1 = min(y0 + tile, height), min(x0 + tile, width)
+            oy0, ox0 = max(0, y0 - halo), max(0, x0 - halo)
+            oy1, ox1 = min(height, y1 + halo), min(width, x1 + halo)
+            yield (y0, y1, x0, x1), (oy0, oy1, ox0, ox1), (y0 - oy0, x0 - ox0)
+
+
+def row_statistics(img, sigma_grad=1.5, sigma_int=6.0, tile=2048, keep_maps=False):
+    """
+    Coherence-weighted orientation statistics of every image row.
+
+    Args:
+        img: BGR image
+        sigma_grad: gradient scale in pixels (fibril texture size)
+        sigma_int: integration window in pixels (neighbourhood of one estimate)
+        tile: tile side for processing large images (halo added automatically)
+        keep_maps: also return uint8 per-pixel `angle_map` (degrees, NODATA
+            outside the mask) and `coherence_map` (coherence * 255)
+
+    Returns:
+        dict of per-row arrays: weight (coherence summed over valid pixels),
+        weighted angle sum and square sum, valid-pixel count and (H, 91)
+        weighted angle histogram
+    """
+    height, width = img.shape[:2]
+    halo = halo_size(sigma_grad, sigma_int)
+
+    rows = {
+        'weight': np.zeros(height),
+        'angle_sum': np.zeros(height),
+        'angle_sq_sum': np.zeros(height),
+        'count': np.zeros(height),
+        'histogram': np.zeros((height, ANGLE_BINS))
+    }
+    if keep_maps:
+        rows['angle_map'] = np.full((height, width), NODATA, dtype=np.uint8)
+        rows['coherence_map'] = np.zeros((height, width), dtype=np.uint8)
+
+    for (y0, y1, x0, x1), (oy0, oy1, ox0, ox1), (dy, dx) in iter_tiles(height, width, tile, halo):
+        outer = img[oy0:oy1, ox0:ox1]
+        gray = cv2.cvtColor(outer, cv2.COLOR_BGR2GRAY)
+        angle, coherence = orientation_fields(gray, sigma_grad, sigma_int)
+        h, w = y1 - y0, x1 - x0
+        angle = angle[dy:dy + h, dx:dx + w]
+        coherence = coherence[dy:dy + h, dx:dx + w]
+
+        # Same validity mask as the hue analysis
+        hsv = cv2.cvtColor(img[y0:y1, x0:x1], cv2.COLOR_BGR2HSV)
+        valid = (hsv[:, :, 2] > 10) & (hsv[:, :, 1] > 10)
+        weight = coherence * valid
+
+        rows['weight'][y0:y1] += weight.sum(axis=1)
+        rows['angle_sum'][y0:y1] += (weight * angle).sum(axis=1)
+        rows['angle_sq_sum'][y0:y1] += (weight * angle * angle).sum(axis=1)
+        rows['count'][y0:y1] += valid.sum(axis=1)
+
+        # Per-row histograms in one bincount over (row, angle bin) indices
+        bins = np.rint(angle).astype(np.int64)
+        idx = np.arange(h)[:, None] * ANGLE_BINS + bins
+        rows['histogram'][y0:y1] += np.bincount(
+            idx[valid], weights=weight[valid], minlength=h * ANGLE_BINS).reshape(h, ANGLE_BINS)
+
+        if keep_maps:
+            rows['angle_map'][y0:y1, x0:x1] = np.where(valid, np.rint(angle), NODATA).astype(np.uint8)
+            rows['coherence_map'][y0:y1, x0:x1] = np.rint(coherence * 255.0).astype(np.uint8)
+
+    return rows
+
+
+def _band_sums(rows, starts, ends):
+    """Sum every per-row accumulator over row bands [starts, ends) via cumulative sums."""
+    sums = {}
+    for name in ('weight', 'angle_sum', 'angle_sq_sum', 'count', 'histogram'):
+        values = rows[name]
+        cs = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+        sums[name] = cs[ends] - cs[starts]
+    return sums
+
+
+def _moments(sums):
+    weight = sums['weight']
+    safe = np.maximum(weight, 1e-12)
+    mean = sums['angle_sum'] / safe
+    std = np.sqrt(np.maximum(sums['angle_sq_sum'] / safe - mean * mean, 0.0))
+    # Weights are coherence on valid pixels, so their sum / count is the mean coherence
+    coherence = weight / np.maximum(sums['count'], 1)
+    return mean, std, coherence
+
+
+def zone_statistics(rows, y0, y1):
+    """Zone result for rows [y0, y1) in the layout of analyze_zone's angle fields."""
+    sums = _band_sums(rows, np.array([y0]), np.array([max(y0, y1)]))
+    mean, std, coherence = _moments(sums)
+    hist = sums['histogram'][0]
+    total = hist.sum()
+    empty = sums['weight'][0] <= 0
+    return {
+        'angle_histogram': (hist / total if total > 0 else hist).tolist(),
+        'angle_labels': list(range(ANGLE_BINS)),
+        'mean_angle': 0.0 if empty else float(mean[0]),
+        'std_angle': 0.0 if empty else float(std[0]),
+        'mean_coherence': float(coherence[0]),
+        'valid_pixels': int(sums['count'][0])
+    }
+
+
+def depth_profile(rows, bins=100):
+    """
+    Depth profile with the bin layout of /analyze (bin i covers rows
+    int(H*i/bins) .. int(H*(i+1)/bins), at least one row). Empty bins are
+    linearly interpolated from their neighbours and flagged `filled`.
+    """
+    starts, ends = profile_rows(len(rows['weight']), bins)
+    sums = _band_sums(rows, starts, ends)
+    mean, std, coherence = _moments(sums)
+
+    valid = sums['weight'] > 0
+    mean, std = fill_gaps(np.column_stack([mean, std]), valid).T
+    thickness = np.round((np.arange(bins) + 0.5) / bins, 3)
+    return [{
+        'thickness': float(thickness[k]),
+        'angle': round(float(mean[k]), 2),
+        'std': round(float(std[k]), 2),
+        'coherence': round(float(coherence[k]), 3),
+        'filled': bool(not valid[k])
+    } for k in range(bins)]
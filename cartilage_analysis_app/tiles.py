@@ -0,0 +1,250 @@
+"""
+Deep Zoom (DZI) tile sources for inspecting large slides.
+
+Instead of shipping a full-size JPEG of the annotated slide or the hue heatmap
+to the browser, the image is served as 256x256 tiles at any zoom level
+(Deep Zoom Image format, readable by OpenSeadragon).
+
+On first use a tile source writes its 2x pyramid to `.npy` files and from then
+on reads every tile through a read-only memory map, so tiles can be cut from
+huge slides without keeping them in RAM. Layers (hue heatmap, angle map...)
+are per-pixel operations and are rendered tile by tile from the source tile.
+"""
+import os
+import json
+import math
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+
+TILE_SIZE = 256
+# Unpublished build directories older than this are left over from a crashed build
+STALE_BUILD_SECONDS = 3600
+
+
+def dzi_levels(width, height):
+    """Number of DZI levels: level 0 is 1x1, the last level is full resolution."""
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+
+def dzi_descriptor(width, height, tile_size=TILE_SIZE, fmt='jpg'):
+    """XML descriptor for a Deep Zoom Image."""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'TileSize="{tile_size}" Overlap="0" Format="{fmt}">'
+        f'<Size Width="{width}" Height="{height}"/></Image>'
+    )
+
+
+class TileSource:
+    """
+    Memory-mapped pyramid of one image.
+
+    Pyramid level p (p = 0 full resolution) has size ceil(w / 2^p) x ceil(h / 2^p),
+    which is exactly DZI level (max_level - p).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.width = self.meta['width']
+        self.height = self.meta['height']
+        self.max_level = dzi_levels(self.width, self.height) - 1
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, directory, img, meta=None):
+        """
+        Write the pyramid of `img` to `directory` and open it. The pyramid is written to
+        a private temporary directory and published with a single rename; if another
+        process published the same (content-addressed) pyramid first, that one is used.
+        """
+        root, name = os.path.split(directory)
+        tmp = tempfile.mkdtemp(dir=root, prefix=name + '.', suffix='.tmp')
+        level = np.ascontiguousarray(img)
+        p = 0
+        while True:
+            np.save(os.path.join(tmp, f'L{p}.npy'), level)
+            if max(level.shape[:2]) <= 1:
+                break
+            level = cv2.pyrDown(level)
+            p += 1
+        info = dict(meta or {})
+        info.update({'width': int(img.shape[1]), 'height': int(img.shape[0]), 'levels': p + 1})
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(info, f)
+        # Readers only ever see a complete pyramid: the rename either publishes ours
+        # or fails because an identical one is already in place
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(directory, 'meta.json')):
+                raise
+        return cls(directory)
+
+    def pyramid_level(self, p):
+        with self._lock:
+            if p not in self._maps:
+                self._maps[p] = np.load(os.path.join(self.directory, f'L{p}.npy'), mmap_mode='r')
+            return self._maps[p]
+
+    def tile(self, level, col, row):
+        """Source pixels of DZI tile (level, col, row) as a BGR array, or None if out of range."""
+        if level < 0 or level > self.max_level:
+            return None
+        p = min(self.max_level - level, self.meta['levels'] - 1)
+        src = self.pyramid_level(p)
+        y0, x0 = row * TILE_SIZE, col * TILE_SIZE
+        if y0 >= src.shape[0] or x0 >= src.shape[1] or y0 < 0 or x0 < 0:
+            return None
+        # Copy out of the memory map so rendering does not hold file pages
+        return np.array(src[y0:y0 + TILE_SIZE, x0:x0 + TILE_SIZE])
+
+    def descriptor(self):
+        return dzi_descriptor(self.width, self.height)
+
+
+class TileStore:
+    """
+    Tile sources on local disk, keyed by image fingerprint.
+
+    Args:
+        root: directory for the memory-mapped pyramids
+        max_bytes: disk budget; least recently used pyramids are deleted beyond it
+        max_open: number of sources kept open (memory maps) at once
+    """
+
+    def __init__(self, root, max_bytes, max_open=32):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._builds = {}
+        self._readers = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Open tile source for `key`, or None if it was never built (or was pruned)."""
+        with self._lock:
+            source = self._open.get(key)
+            if source is not None:
+                self._open.move_to_end(key)
+                return source
+            directory = self._dir(key)
+            if not os.path.exists(os.path.join(directory, 'meta.json')):
+                return None
+            source = TileSource(directory)
+            os.utime(directory)
+            self._remember(key, source)
+            return source
+
+    def get_or_build(self, key, load_image):
+        """
+        Open the tile source for `key`, building it from `load_image()` (-> (img, meta)
+        or None) if needed.
+        """
+        source = self.get(key)
+        if source is not None:
+            return source
+        with self._building(key):
+            # Built by a concurrent request while this one waited
+            source = self.get(key)
+            if source is not None:
+                return source
+            loaded = load_image()
+            if loaded is None:
+                return None
+            img, meta = loaded
+            source = TileSource.build(self._dir(key), img, meta)
+            with self._lock:
+                self._remember(key, source)
+        self.prune()
+        return source
+
+    @contextmanager
+    def reading(self, key, load_image=None):
+        """
+        Tile source for `key` (built from `load_image` if given, see get_or_build), or
+        None, held for the block: prune() never deletes a pyramid that is being read,
+        since its levels are memory-mapped lazily.
+        """
+        with self._lock:
+            self._readers[key] = self._readers.get(key, 0) + 1
+        try:
+            yield self.get_or_build(key, load_image) if load_image else self.get(key)
+        finally:
+            with self._lock:
+                self._readers[key] -= 1
+                if not self._readers[key]:
+                    del self._readers[key]
+
+    @contextmanager
+    def _building(self, key):
+        """Per-key build lock: builds of different images run in parallel, the same image once."""
+        with self._lock:
+            entry = self._builds.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._builds[key]
+
+    def _remember(self, key, source):
+        self._open[key] = source
+        self._open.move_to_end(key)
+        while len(self._open) > self.max_open:
+            self._open.popitem(last=False)
+
+    def prune(self):
+        """
+        Delete least recently used pyramids until the store fits its disk budget.
+        Pyramids being read or rebuilt are skipped.
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if not os.path.isdir(path):
+                    continue
+                if name.endswith('.tmp'):
+                    # In-progress builds are skipped; crashed ones removed
+                    if time.time() - os.path.getmtime(path) > STALE_BUILD_SECONDS:
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), name, path, size))
+                total += size
+            for _, name, path, size in sorted(entries):
+                if total <= self.max_bytes or len(entries) <= 1:
+                    break
+                if name in self._readers or name in self._builds:
+                    continue
+                self._open.pop(name, None)
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                entries = [e for e in entries if e[1] != name]
+
+
+def store_from_env():
+    """Tile store under TILE_DIR (default: system temp) with TILE_STORE_MB disk budget (default 4096)."""
+    root = os.environ.get('TILE_DIR') or os.path.join(tempfile.gettempdir(), 'cartilage_tiles')
+    return TileStore(root, float(os.environ.get('TILE_STORE_MB', 4096)) * 1024 * 1024)
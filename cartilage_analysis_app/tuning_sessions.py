@@ -0,0 +1,190 @@
+"""
+Live tuning sessions for zone boundaries and colour calibration.
+
+Tuning the reference used to send the whole base64 image to /analyze on every
+change. A session decodes the image once and keeps its row statistics (see
+row_statistics in zone_analysis.py): per-row hue histograms and B, G, R, V sums,
+accumulated over rows. Any boundary / calibration then recomputes the zone
+results and the depth profile from those tables in a couple of milliseconds.
+
+The client sends only parameter deltas (POST /sessions/<id>/params) and
+receives every new result on a server-sent event stream
+(GET /sessions/<id>/events). Updates are numbered; a subscriber that falls
+behind is sent only the latest result, so fast slider moves coalesce.
+"""
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+# Parameters a session accepts as deltas; force_* may be null (calibrate from the zones)
+TUNABLE = ('sz_boundary', 'mz_boundary', 'force_zero_hue', 'force_ninety_hue')
+DEFAULT_PARAMS = {'sz_boundary': 33.0, 'mz_boundary': 66.0, 'force_zero_hue': None, 'force_ninety_hue': None}
+
+
+class SessionNotFound(Exception):
+    """Raised for an unknown, closed or expired session id."""
+
+
+def apply_deltas(params, deltas):
+    """`params` updated with the tunable values in `deltas`; raises ValueError for anything else."""
+    unknown = set(deltas) - set(TUNABLE)
+    if unknown:
+        raise ValueError(f"Unknown tuning parameter(s): {', '.join(sorted(unknown))}")
+    params = dict(params)
+    for key, value in deltas.items():
+        if value is None and not key.startswith('force_'):
+            raise ValueError(f"{key} must be a number")
+        try:
+            params[key] = None if value is None else float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be a number")
+    return params
+
+
+class TuningSession:
+    """
+    One image under live tuning.
+
+    Args:
+        session_id: random id
+        image: decoded (cropped) BGR image, kept for annotated renders
+        stats: row statistics of the image
+        params: current tuning parameters (see TUNABLE)
+        meta: free-form extras returned with every result (masks, fingerprint)
+    """
+
+    def __init__(self, session_id, image, stats, params, meta=None):
+        self.id = session_id
+        self.image = image
+        self.stats = stats
+        self.params = dict(params)
+        self.meta = dict(meta or {})
+        self.version = 0
+        self.result = None
+        self.closed = False
+        self.touched = time.time()
+        self._changed = threading.Condition()
+
+    def nbytes(self):
+        return self.image.nbytes + sum(v.nbytes for v in self.stats.values() if hasattr(v, 'nbytes'))
+
+    def update(self, deltas, compute):
+        """
+        Apply parameter deltas, recompute the result with `compute(session)` and wake
+        the subscribers. Raises ValueError for invalid deltas. Returns the new version.
+        """
+        with self._changed:
+            params = apply_deltas(self.params, deltas)
+            previous = self.params
+            self.params = params
+            try:
+                result = compute(self)
+            except Exception:
+                self.params = previous
+                raise
+            self.version += 1
+            self.result = result
+            self.touched = time.time()
+            self._changed.notify_all()
+            return self.version
+
+    def wait(self, version, timeout):
+        """(version, result) once the session is past `version` or after `timeout` seconds."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version or self.closed, timeout)
+            return self.version, self.result
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+
+class TuningSessions:
+    """
+    Thread-safe LRU store of tuning sessions.
+
+    Args:
+        max_bytes: total size of the kept images and row statistics before the least
+            recently used sessions are closed
+        ttl: seconds of inactivity after which a session is closed
+    """
+
+    def __init__(self, max_bytes, ttl=1800):
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.updates = 0
+        self.evictions = 0
+
+    def create(self, image, stats, params, compute, meta=None):
+        """Open a session and compute its first result (version 1)."""
+        session = TuningSession(uuid.uuid4().hex, image, stats, DEFAULT_PARAMS, meta)
+        session.update(params, compute)
+        with self._lock:
+            self._expire()
+            self._sessions[session.id] = session
+            self._bytes += session.nbytes()
+            self.created += 1
+            # Always keep the newest session, even if it alone exceeds the budget
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                _, evicted = self._sessions.popitem(last=False)
+                self._drop(evicted)
+                self.evictions += 1
+        return session
+
+    def get(self, session_id):
+        """The open session `session_id`; raises SessionNotFound."""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise SessionNotFound(session_id)
+            self._sessions.move_to_end(session_id)
+            session.touched = time.time()
+            return session
+
+    def update(self, session_id, deltas, compute):
+        version = self.get(session_id).update(deltas, compute)
+        with self._lock:
+            self.updates += 1
+        return version
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                raise SessionNotFound(session_id)
+            self._drop(session)
+
+    def _drop(self, session):
+        self._bytes -= session.nbytes()
+        session.close()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for session_id in [k for k, s in self._sessions.items() if s.touched < cutoff]:
+            self._drop(self._sessions.pop(session_id))
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'created': self.created,
+                'updates': self.updates,
+                'evictions': self.evictions
+            }
+
+
+def sessions_from_env():
+    """Tuning sessions sized by TUNING_SESSION_MB (default 512), idle TUNING_SESSION_TTL seconds (default 1800)."""
+    return TuningSessions(float(os.environ.get('TUNING_SESSION_MB', 512)) * 1024 * 1024,
+                          float(os.environ.get('TUNING_SESSION_TTL', 1800)))
@@ -0,0 +1,457 @@
+"""
+Watch-folder ingestion daemon.
+
+The microscope writes PLM captures to a shared folder; this daemon picks them
+up and analyses them without anyone dragging files into batch.html:
+
+    scan     every `interval` seconds each watched folder is listed (polling works
+             on network shares, where inotify does not); a file is ready once its
+             size and modification time have not changed for `settle` seconds,
+             so captures that are still being written are never read half-way
+    queue    ready files are recorded in a SQLite work queue, which survives
+             restarts: jobs that were running when the daemon stopped are
+             retried, finished files are not analysed again
+    analyse  `workers` threads take jobs from the queue and run them through
+             app.analyze_bytes - the same cached, coalesced and admission-controlled
+             pipeline as /analyze, on the analysis process pool
+    output   each result is written as soon as it is ready: <name>.json (the
+             /analyze response), <name>_annotated.jpg and one row in results.csv
+
+Calibration and analysis settings (`force_zero_hue`, `force_ninety_hue`,
+`sz_boundary`, `mz_boundary`, `use_ai`, `zone_mask`, `profile_mask`) are set per
+folder in the config file and can be overridden by a `calibration.json` in the
+folder itself; they are captured when a file is queued.
+
+Usage:
+    python watch_folder.py /data/plm/incoming --workers 4
+    python watch_folder.py --config watch.json
+    python watch_folder.py /data/plm/archive --once     # process what is there, then exit
+
+Config file:
+    {
+        "db": "watch_queue.sqlite",
+        "workers": 4,
+        "interval": 2,
+        "settle": 5,
+        "folders": [
+            {"path": "/data/plm/knee", "output": "/data/results/knee", "recursive": false,
+             "settings": {"force_zero_hue": 17.9, "force_ninety_hue": 57.9},
+             "tags": ["study:knee-2026"]}
+        ]
+    }
+"""
+import os
+import csv
+import json
+import time
+import signal
+import sqlite3
+import argparse
+import threading
+
+from zone_analysis import SETTING_KEYS
+
+WATCH_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png', '.tif', '.tiff')
+CALIBRATION_FILE = 'calibration.json'
+# Server-only parts of an /analyze response that mean nothing in a results folder
+SERVER_KEYS = ('annotated_image_url', 'tiles', 'cached', 'coalesced')
+ZONES = ('SZ', 'MZ', 'DZ')
+
+
+class WorkQueue:
+    """
+    Durable SQLite queue of files to analyse.
+
+    A file is identified by its path, size and modification time, so a capture
+    that is overwritten later is queued again. Jobs that were `running` when the
+    previous daemon stopped are put back to `pending` on open.
+
+    Args:
+        path: SQLite file
+        max_attempts: analyses of a job before it is marked `failed`
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = int(max_attempts)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id INTEGER PRIMARY KEY, path TEXT, folder TEXT, output TEXT,'
+            ' size INTEGER, mtime REAL, settings TEXT, status TEXT, attempts INTEGER,'
+            ' queued REAL, started REAL, finished REAL, content_hash TEXT, error TEXT,'
+            ' UNIQUE (path, size, mtime))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+        with self._db:
+            recovered = self._db.execute(
+                "UPDATE jobs SET status = 'pending' WHERE status = 'running'").rowcount
+        if recovered:
+            print(f"Watch queue: {recovered} interrupted job(s) will be retried")
+
+    def enqueue(self, path, folder, output, size, mtime, settings):
+        """Queue a file; returns False if this version of it is already known."""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO jobs (path, folder, output, size, mtime, settings, status, attempts, queued)'
+                " VALUES (?, ?, ?, ?, ?, ?, 'pending', 0, ?)",
+                (path, folder, output, size, mtime, json.dumps(settings), time.time()))
+            return cursor.rowcount > 0
+
+    def claim(self):
+        """Mark the oldest pending job as running and return it (dict), or None."""
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started = ? WHERE id = ?",
+                (time.time(), row['id']))
+        job = dict(row)
+        job['settings'] = json.loads(job['settings'])
+        job['attempts'] += 1
+        return job
+
+    def complete(self, job_id, image_hash):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, content_hash = ?, error = NULL WHERE id = ?",
+                (time.time(), image_hash, job_id))
+
+    def fail(self, job_id, error, retry=True):
+        """Record an error; the job is retried until it has used `max_attempts`."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = CASE WHEN ? AND attempts < ? THEN 'pending' ELSE 'failed' END,"
+                ' finished = ?, error = ? WHERE id = ?',
+                (retry, self.max_attempts, time.time(), str(error), job_id))
+
+    def release(self, job_id):
+        """Put a job back without counting the attempt (e.g. the server was busy)."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = 'pending', attempts = attempts - 1 WHERE id = ?", (job_id,))
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: n for status, n in rows}
+
+
+def load_settings(folder, settings):
+    """Folder settings from the config, overridden by the folder's calibration.json."""
+    merged = dict(settings or {})
+    path = os.path.join(folder, CALIBRATION_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                merged.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Watch folder: ignoring unreadable {path}: {e}")
+    return {k: v for k, v in merged.items() if k in SETTING_KEYS}
+
+
+class FolderWatcher:
+    """
+    Polls one folder and reports files that have stopped changing.
+
+    Args:
+        path: folder to watch
+        output: results folder (default <path>/results; never scanned)
+        recursive: also watch subfolders
+        settings: analysis settings for files of this folder
+        settle: seconds a file's size and mtime must stay unchanged
+        tags: tags its results get in the results database
+    """
+
+    def __init__(self, path, output=None, recursive=False, settings=None, settle=5.0, tags=None):
+        self.path = os.path.abspath(path)
+        self.output = os.path.abspath(output or os.path.join(self.path, 'results'))
+        self.recursive = recursive
+        self.settings = settings or {}
+        self.settle = float(settle)
+        self.tags = list(tags or [])
+        self._changing = {}   # path -> (size, mtime, first seen with this size/mtime)
+        self._queued = {}     # path -> (size, mtime) last handed to the queue
+
+    def _files(self):
+        stack = [self.path]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive and os.path.abspath(entry.path) != self.output:
+                        stack.append(entry.path)
+                elif entry.name.lower().endswith(WATCH_EXTENSIONS):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, st.st_size, st.st_mtime
+
+    def scan(self, now=None):
+        """Return [(path, size, mtime)] of files that became ready since the last scan."""
+        now = time.time() if now is None else now
+        ready = []
+        seen = set()
+        for path, size, mtime in self._files():
+            seen.add(path)
+            if size == 0 or self._queued.get(path) == (size, mtime):
+                continue
+            previous = self._changing.get(path)
+            if previous is None or previous[:2] != (size, mtime):
+                self._changing[path] = (size, mtime, now)
+                continue
+            if now - previous[2] >= self.settle and now - mtime >= self.settle:
+                del self._changing[path]
+                self._queued[path] = (size, mtime)
+                ready.append((path, size, mtime))
+        for path in set(self._changing) - seen:
+            del self._changing[path]
+        return ready
+
+    def output_name(self, path):
+        """Result file stem for a source file (subfolders flattened with '__')."""
+        relative = os.path.splitext(os.path.relpath(path, self.path))[0]
+        return relative.replace(os.sep, '__').replace('/', '__')
+
+
+class ResultWriter:
+    """Writes each result as soon as it is ready: JSON, annotated JPEG and a CSV row."""
+
+    CSV_FIELDS = (['source', 'analyzed_at', 'zero_hue', 'ninety_hue', 'sz_end', 'mz_end']
+                  + [f'{zone}_{stat}' for zone in ZONES for stat in ('mean_angle', 'std_angle', 'avg_hue')])
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _write_atomic(path, payload):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+    def write(self, output, name, source, response, annotated_jpg, image_hash):
+        os.makedirs(output, exist_ok=True)
+        analyzed_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        result = {k: v for k, v in response.items() if k not in SERVER_KEYS}
+        result.update({'source': source, 'analyzed_at': analyzed_at, 'content_hash': image_hash})
+        self._write_atomic(os.path.join(output, name + '.json'), json.dumps(result, indent=1).encode())
+        self._write_atomic(os.path.join(output, name + '_annotated.jpg'), annotated_jpg)
+
+        calibration = response['color_calibration']
+        boundaries = response['zone_boundaries']
+        row = [source, analyzed_at, round(calibration['zero_hue'], 2), round(calibration['ninety_hue'], 2),
+               boundaries['sz_end'], boundaries['mz_end']]
+        for zone in ZONES:
+            stats = response['results'][zone]
+            row += [round(stats['mean_angle'], 2), round(stats['std_angle'], 2), round(stats['avg_hue'], 2)]
+
+        summary = os.path.join(output, 'results.csv')
+        with self._lock:
+            new_file = not os.path.exists(summary)
+            with open(summary, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(self.CSV_FIELDS)
+                writer.writerow(row)
+
+
+class WatchDaemon:
+    """
+    Scanner loop plus analysis threads over a WorkQueue.
+
+    Args:
+        watchers: FolderWatcher per watched folder
+        queue: WorkQueue
+        workers: analysis threads (each runs one analysis at a time)
+        interval: seconds between folder scans
+    """
+
+    def __init__(self, watchers, queue, workers=2, interval=2.0):
+        self.watchers = watchers
+        self.queue = queue
+        self.workers = int(workers)
+        self.interval = float(interval)
+        self.writer = ResultWriter()
+        self.stop = threading.Event()
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+
+    def scan_once(self):
+        queued = 0
+        for watcher in self.watchers:
+            settings = None
+            for path, size, mtime in watcher.scan():
+                if settings is None:
+                    settings = load_settings(watcher.path, watcher.settings)
+                if self.queue.enqueue(path, watcher.path, watcher.output, size, mtime, settings):
+                    queued += 1
+        return queued
+
+    def _watcher_for(self, job):
+        for watcher in self.watchers:
+            if watcher.path == job['folder']:
+                return watcher
+        return FolderWatcher(job['folder'], job['output'])
+
+    def process(self, job):
+        """Analyse one claimed job and write its outputs."""
+        import app
+        from admission import AdmissionRejected
+        from quality_gate import QualityRejected
+        from result_cache import content_hash
+
+        path = job['path']
+        try:
+            with open(path, 'rb') as f:
+                image_bytes = f.read()
+        except FileNotFoundError:
+            self.queue.fail(job['id'], 'File no longer exists', retry=False)
+            return
+        try:
+            analysed = app.analyze_bytes(image_bytes, job['settings'], keep_image=False, record=True,
+                                         source=path, tags=self._watcher_for(job).tags)
+        except AdmissionRejected as e:
+            self.queue.release(job['id'])
+            self.stop.wait(e.retry_after)
+            return
+        except QualityRejected as e:
+            # Blank / washed-out slide: analysing it again gives the same answer
+            print(f"Watch folder: {path} rejected: {e.reason}")
+            self.queue.fail(job['id'], e.reason, retry=False)
+            return
+        except Exception as e:
+            print(f"Watch folder: analysis of {path} failed (attempt {job['attempts']}): {e}")
+            self.queue.fail(job['id'], e)
+            return
+        if analysed is None:
+            self.queue.fail(job['id'], 'Failed to decode image', retry=False)
+            return
+
+        response, annotated_jpg = analysed
+        image_hash = content_hash(image_bytes)
+        watcher = self._watcher_for(job)
+        try:
+            self.writer.write(job['output'], watcher.output_name(path), path, response, annotated_jpg, image_hash)
+        except OSError as e:
+            self.queue.fail(job['id'], f'Writing results failed: {e}')
+            return
+        self.queue.complete(job['id'], image_hash)
+        print(f"Watch folder: analysed {path}{' (cached)' if response.get('cached') else ''}")
+
+    def _work(self):
+        while not self.stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stop.wait(min(self.interval, 1.0))
+                continue
+            with self._busy_lock:
+                self._busy += 1
+            try:
+                self.process(job)
+            finally:
+                with self._busy_lock:
+                    self._busy -= 1
+
+    def idle(self):
+        with self._busy_lock:
+            return self._busy == 0 and self.queue.counts().get('pending', 0) == 0
+
+    def run(self, once=False):
+        """Scan and analyse until stopped (or, with `once`, until the existing files are done)."""
+        threads = [threading.Thread(target=self._work, name=f'watch-worker-{i}', daemon=True)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        last_report = 0
+        try:
+            while not self.stop.is_set():
+                queued = self.scan_once()
+                if queued:
+                    print(f"Watch folder: queued {queued} new file(s)")
+                now = time.time()
+                if now - last_report >= 60:
+                    print(f"Watch folder: queue {self.queue.counts()}")
+                    last_report = now
+                if once and not queued and not any(w._changing for w in self.watchers) and self.idle():
+                    break
+                self.stop.wait(self.interval)
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+        print(f"Watch folder: stopped, queue {self.queue.counts()}")
+
+
+def load_config(args):
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    folders = list(config.get('folders', []))
+    folders += [{'path': path, 'recursive': args.recursive} for path in args.folders]
+    if not folders:
+        raise SystemExit("No folders to watch (pass folders or --config)")
+    for key in ('db', 'workers', 'interval', 'settle'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    config['folders'] = folders
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse PLM captures as they appear in watched folders")
+    parser.add_argument('folders', nargs='*', help="folders to watch (default settings)")
+    parser.add_argument('--config', help="JSON config with per-folder output and settings")
+    parser.add_argument('--db', help="SQLite work queue (default watch_queue.sqlite)")
+    parser.add_argument('--workers', type=int, help="concurrent analyses (default 2)")
+    parser.add_argument('--interval', type=float, help="seconds between scans (default 2)")
+    parser.add_argument('--settle', type=float, help="seconds a file must be unchanged (default 5)")
+    parser.add_argument('--recursive', action='store_true', help="also watch subfolders")
+    parser.add_argument('--once', action='store_true', help="exit when the current files are analysed")
+    args = parser.parse_args()
+    config = load_config(args)
+
+    workers = int(config.get('workers', 2))
+    # Analyses run in worker processes unless ANALYSIS_WORKERS says otherwise (read on import of app)
+    os.environ.setdefault('ANALYSIS_WORKERS', str(workers))
+    import app
+    if app.analysis_pool() is not None:
+        app.analysis_pool().start()
+
+    settle = float(config.get('settle', 5))
+    watchers = [FolderWatcher(f['path'], f.get('output'), f.get('recursive', False), f.get('settings'), settle,
+                              f.get('tags'))
+                for f in config['folders']]
+    queue = WorkQueue(config.get('db', 'watch_queue.sqlite'))
+    daemon = WatchDaemon(watchers, queue, workers, float(config.get('interval', 2)))
+
+    def handle_signal(signum, frame):
+        print("Watch folder: stopping after the running analyses...")
+        daemon.stop.set()
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    for watcher in watchers:
+        print(f"Watching {watcher.path} -> {watcher.output}")
+    try:
+        daemon.run(once=args.once)
+    finally:
+        if app.analysis_pool() is not None:
+            app.analysis_pool().shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Process pool for image analysis with shared-memory image hand-off.
+
+Analysis is CPU bound and holds the GIL in parts of the pipeline, so running it
+on request threads does not scale with cores. `AnalysisPool` runs it in worker
+processes instead. Pickling a decoded multi-megabyte image to a worker would
+cost about as much as the analysis saves, so the image is copied once into a
+`multiprocessing.shared_memory` segment and the worker only receives the
+segment name, shape and dtype; it maps the same pages and analyses them in place.
+
+Cleanup:
+    - the parent unlinks every segment as soon as its task finishes, fails or
+      its worker dies (a dead worker also resets the pool)
+    - segments still open when the parent exits are unlinked by an atexit hook,
+      or by multiprocessing's resource tracker if the parent is killed
+    - segment names carry the parent PID, so `cleanup_stale_segments()` can
+      remove leftovers of processes that no longer exist (run at start-up)
+"""
+import os
+import glob
+import uuid
+import atexit
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+SEGMENT_PREFIX = 'cartilage_'
+
+_open_segments = {}
+_segments_lock = threading.Lock()
+
+
+def _release(shm):
+    try:
+        shm.close()
+    finally:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+@atexit.register
+def _release_all():
+    with _segments_lock:
+        segments = list(_open_segments.values())
+        _open_segments.clear()
+    for shm in segments:
+        _release(shm)
+
+
+@contextmanager
+def shared_image(img):
+    """
+    Copy `img` into a new shared-memory segment for the duration of the block.
+    Yields the handle (name, shape, dtype) a worker needs to map it.
+    """
+    img = np.ascontiguousarray(img)
+    name = f"{SEGMENT_PREFIX}{os.getpid()}_{uuid.uuid4().hex[:12]}"
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, img.nbytes))
+    with _segments_lock:
+        _open_segments[name] = shm
+    try:
+        np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)[...] = img
+        yield (name, img.shape, img.dtype.str)
+    finally:
+        with _segments_lock:
+            _open_segments.pop(name, None)
+        _release(shm)
+
+
+@contextmanager
+def attach_image(handle):
+    """Map a shared image in a worker as a read-only array (no copy)."""
+    name, shape, dtype = handle
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        img = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        img.flags.writeable = False
+        yield img
+        del img
+    finally:
+        shm.close()
+
+
+def _run_shared(func, handle, args):
+    with attach_image(handle) as img:
+        return func(img, *args)
+
+
+def cleanup_stale_segments():
+    """Unlink segments left by processes that no longer exist (Linux /dev/shm only)."""
+    removed = 0
+    for path in glob.glob(os.path.join('/dev/shm', SEGMENT_PREFIX + '*')):
+        try:
+            pid = int(os.path.basename(path)[len(SEGMENT_PREFIX):].split('_')[0])
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+        except (ValueError, PermissionError):
+            continue
+    return removed
+
+
+class AnalysisPool:
+    """
+    Worker processes that run `func(img, *args)` on images passed through shared memory.
+
+    Args:
+        workers: number of worker processes
+        start_method: multiprocessing start method; 'spawn' is safe with the
+            server's threads and works on every platform
+    """
+
+    def __init__(self, workers, start_method='spawn'):
+        self.workers = int(workers)
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+        self.tasks = 0
+        self.failures = 0
+        self.restarts = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def start(self):
+        """Start the worker processes now instead of on the first task."""
+        executor = self._get_executor()
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def run(self, func, img, *args):
+        """Run `func(img, *args)` in a worker and return its result."""
+        with shared_image(img) as handle:
+            executor = self._get_executor()
+            with self._lock:
+                self.tasks += 1
+            try:
+                return executor.submit(_run_shared, func, handle, args).result()
+            except BrokenProcessPool:
+                # A worker died (crash / OOM kill): replace the pool for later tasks
+                with self._lock:
+                    self.failures += 1
+                    if self._executor is executor:
+                        self._executor = None
+                        self.restarts += 1
+                executor.shutdown(wait=False)
+                raise
+
+    def metrics(self):
+        with self._lock:
+            info = {
+                'workers': self.workers,
+                'start_method': self.start_method,
+                'running': self._executor is not None,
+                'tasks': self.tasks,
+                'failures': self.failures,
+                'restarts': self.restarts
+            }
+        with _segments_lock:
+            info['open_segments'] = len(_open_segments)
+        return info
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def pool_from_env():
+    """
+    Analysis pool with ANALYSIS_WORKERS processes (default 0 = analyse on the
+    request thread, returns None) and ANALYSIS_START_METHOD (default spawn).
+    """
+    workers = int(os.environ.get('ANALYSIS_WORKERS', 0))
+    if workers <= 0:
+        return None
+    cleanup_stale_segments()
+    return AnalysisPool(workers, os.environ.get('ANALYSIS_START_METHOD', 'spawn'))
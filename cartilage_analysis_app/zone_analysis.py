@@ -0,0 +1,378 @@
+"""
+The /analyze pipeline on a decoded image: pixel masks, row statistics, zone
+results, depth profile, calibration and the annotated rendering.
+
+Everything here is a pure function of the image and the analysis parameters,
+and importing the module has no side effects, so it is what the Flask app
+runs on request threads and what worker processes run (see analysis_worker.py)
+without importing the web application.
+"""
+import numpy as np
+import cv2
+
+import circular_stats
+import profiles
+
+# Request parameters that define an analysis; batch runs and watch folders keep
+# these from their settings (per-image options such as the crop are separate)
+SETTING_KEYS = ('force_zero_hue', 'force_ninety_hue', 'sz_boundary', 'mz_boundary',
+                'use_ai', 'zone_model', 'zone_mask', 'profile_mask')
+
+def hue_to_angle(hue, zero_hue=0, ninety_hue=60):
+    """
+    Convert OpenCV HSV Hue (0-179) to fiber orientation angle (0-90 degrees)
+    using dynamic anchors.
+
+    Args:
+        hue: input hue value or array
+        zero_hue: Hue value corresponding to 0 degrees (SZ)
+        ninety_hue: Hue value corresponding to 90 degrees (DZ)
+    """
+    # Avoid division by zero
+    if abs(ninety_hue - zero_hue) < 1.0:
+        # Fallback to defaults or return 0
+        denom = 60.0
+    else:
+        denom = ninety_hue - zero_hue
+
+    angle = (hue - zero_hue) / denom * 90.0
+    return np.clip(angle, 0, 90)
+
+
+# Pixel masks: a pixel is used if V > value and S > saturation (None skips that test).
+# Zone statistics include dark MZ pixels; profile and colour calibration use brighter pixels.
+ZONE_MASK = {'value': 10, 'saturation': 10}
+PROFILE_MASK = {'value': 20, 'saturation': None}
+
+
+def mask_thresholds(requested, default):
+    """Merge a request's {'value', 'saturation'} mask override into the default thresholds."""
+    thresholds = dict(default)
+    for channel in ('value', 'saturation'):
+        if requested and channel in requested:
+            value = requested[channel]
+            thresholds[channel] = None if value is None else int(value)
+    return thresholds
+
+
+def pixel_mask(hsv, thresholds):
+    """Boolean mask of HSV pixels passing `thresholds` (see ZONE_MASK)."""
+    mask = np.ones(hsv.shape[:2], dtype=bool)
+    if thresholds.get('value') is not None:
+        mask &= hsv[:, :, 2] > thresholds['value']
+    if thresholds.get('saturation') is not None:
+        mask &= hsv[:, :, 1] > thresholds['saturation']
+    return mask
+
+
+HUES = circular_stats.HUES
+# Columns of a row table: the hue histogram, then masked B, G, R and V sums
+ROW_COLUMNS = HUES + 4
+
+
+def row_table(img, hsv, thresholds):
+    """
+    Cumulative per-row statistics of the pixels passing `thresholds`: row r holds
+    the hue histogram and B, G, R, V sums of image rows [0, r), so any band of rows
+    is a single subtraction. Returns an (H + 1, ROW_COLUMNS) array.
+    """
+    pixels = pixel_mask(hsv, thresholds)
+    rows = np.zeros((img.shape[0] + 1, ROW_COLUMNS))
+    rows[1:, :HUES] = circular_stats.row_histograms(hsv[:, :, 0], pixels)
+    bgrv = np.dstack([img, hsv[:, :, 2]])
+    masked = cv2.bitwise_and(bgrv, bgrv, mask=pixels.view(np.uint8))
+    rows[1:, HUES:] = cv2.reduce(masked, 1, cv2.REDUCE_SUM, dtype=cv2.CV_64F).reshape(-1, 4)
+    return np.cumsum(rows, axis=0)
+
+
+def row_statistics(img, zone_mask=ZONE_MASK, profile_mask=PROFILE_MASK):
+    """
+    Row tables (see row_table) of the zone and profile masks: all that the zone
+    results, depth profile and calibration need from the pixels, for any boundaries.
+    """
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    return {
+        'height': img.shape[0],
+        'zone': row_table(img, hsv, zone_mask),
+        'profile': row_table(img, hsv, profile_mask)
+    }
+
+
+def zone_result(band, zero_hue=0, ninety_hue=60):
+    """
+    Zone statistics from the summed row-table entries of its rows, using dynamic
+    hue-to-angle mapping: every pixel of a hue has the same angle, so the angle
+    histogram, mean and spread are weighted sums over the 180 hues.
+    """
+    hist = band[:HUES]
+    count = hist.sum()
+    if count == 0:
+        return {
+            "avg_color_hex": "#000000",
+            "angle_histogram": [0]*91,
+            "angle_labels": list(range(91)),
+            "mean_angle": 0,
+            "std_angle": 0,
+            "avg_hue": 0,
+            "avg_r": 0,
+            "avg_g": 0,
+            "avg_b": 0,
+            "avg_intensity": 0
+        }
+
+    # Convert hues to angles using DYNAMIC mapping
+    angles = hue_to_angle(np.arange(HUES, dtype=float), zero_hue, ninety_hue)
+    hist_angle, _ = np.histogram(angles, bins=91, range=(0, 91), weights=hist)
+    mean_angle = hist @ angles / count
+    std_angle = np.sqrt(hist @ (angles - mean_angle) ** 2 / count)
+
+    avg_b, avg_g, avg_r, avg_intensity = band[HUES:] / count
+    return {
+        "avg_color_hex": '#{:02x}{:02x}{:02x}'.format(int(avg_r), int(avg_g), int(avg_b)),
+        "angle_histogram": (hist_angle / count).tolist(),
+        "angle_labels": list(range(91)),
+        "mean_angle": float(mean_angle),
+        "std_angle": float(std_angle),
+        "avg_hue": float(circular_stats.circular_mean(hist)),
+        "avg_r": int(avg_r),
+        "avg_g": int(avg_g),
+        "avg_b": int(avg_b),
+        "avg_intensity": float(avg_intensity)
+    }
+
+
+def analyze_zone(image_zone, zero_hue=0, ninety_hue=60, thresholds=ZONE_MASK):
+    """
+    Analyze a specific zone of the image using dynamic HSV hue-to-angle mapping.
+    """
+    if image_zone.size == 0:
+        return zone_result(np.zeros(ROW_COLUMNS), zero_hue, ninety_hue)
+    hsv = cv2.cvtColor(image_zone, cv2.COLOR_BGR2HSV)
+    return zone_result(row_table(image_zone, hsv, thresholds)[-1], zero_hue, ninety_hue)
+
+
+def analyze_rows(stats, split1_pct, split2_pct, zero_hue=0, ninety_hue=60, calibrate=False):
+    """
+    Zone results, depth profile and boundaries from row statistics (see
+    row_statistics); no pixel is touched, so this is cheap enough to re-run on
+    every boundary or calibration change.
+
+    Args:
+        stats: row statistics of the image
+        split1_pct, split2_pct: SZ/MZ and MZ/DZ boundaries in % of the height
+        zero_hue, ninety_hue: hue calibration (0° and 90° anchors)
+        calibrate: take the anchors from the circular mean hue of the SZ and DZ
+            bands instead (manual recalculation)
+
+    Returns:
+        dict with results, depth_profile, zone_boundaries, the calibration used
+        (zero_hue, ninety_hue) and the boundary rows z1_h, z2_h
+    """
+    height = stats['height']
+    zone_rows, profile_rows = stats['zone'], stats['profile']
+
+    # Ensure splits are sorted and within bounds
+    s1 = np.clip(split1_pct / 100.0, 0.0, 1.0)
+    s2 = np.clip(split2_pct / 100.0, 0.0, 1.0)
+    if s1 > s2: s1 = s2
+    z1_h = int(height * s1)
+    z2_h = int(height * s2)
+
+    if calibrate:
+        # SZ hue (0 to s1) and DZ hue (s2 to 1.0) from the profile mask
+        sz_hist = profile_rows[z1_h, :HUES] - profile_rows[0, :HUES]
+        dz_hist = profile_rows[height, :HUES] - profile_rows[z2_h, :HUES]
+        if z1_h > 0 and sz_hist.sum() > 0:
+            zero_hue = float(circular_stats.circular_mean(sz_hist))
+        if z2_h < height and dz_hist.sum() > 0:
+            ninety_hue = float(circular_stats.circular_mean(dz_hist))
+
+    results = {
+        "SZ": zone_result(zone_rows[z1_h] - zone_rows[0], zero_hue, ninety_hue),
+        "MZ": zone_result(zone_rows[z2_h] - zone_rows[z1_h], zero_hue, ninety_hue),
+        "DZ": zone_result(zone_rows[height] - zone_rows[z2_h], zero_hue, ninety_hue)
+    }
+
+    # Depth profile: every bin is a difference of two row-table entries
+    bins = 100
+    starts, ends = profiles.profile_rows(height, bins)
+    bin_rows = profile_rows[ends] - profile_rows[starts]
+    bin_hists = bin_rows[:, :HUES]
+    counts = bin_hists.sum(axis=1)
+    mean_hues = circular_stats.circular_mean(bin_hists)
+    # Circular spread of the hue, scaled to degrees of fiber angle
+    scale_factor = 90.0 / (abs(ninety_hue - zero_hue) if abs(ninety_hue - zero_hue) > 1 else 1.0)
+    std_angles = circular_stats.circular_std(bin_hists) * scale_factor
+    angles = profiles.profile_angle(mean_hues, zero_hue, ninety_hue)
+    # Masked B, G, R and V means
+    bin_means = bin_rows[:, HUES:] / np.maximum(counts, 1)[:, None]
+
+    # Empty bins are interpolated from their neighbours, every column at once
+    # (the mean hue around the colour circle)
+    valid_bins = counts > 0
+    columns = np.column_stack([angles, std_angles, mean_hues, bin_means])
+    if valid_bins.any():
+        columns = profiles.fill_gaps(columns, valid_bins, hue_columns=(2,))
+    else:
+        columns = np.zeros_like(columns)
+
+    depth_profile = []
+    for i, (angle, std, mean_hue, avg_b, avg_g, avg_r, intensity) in enumerate(columns):
+        depth_profile.append({
+            'thickness': round((i + 0.5) / bins, 3),
+            'angle': round(float(angle), 2),
+            'std': round(float(std), 2),
+            'mean_hue': round(float(mean_hue), 1),
+            'avg_r': int(avg_r),
+            'avg_g': int(avg_g),
+            'avg_b': int(avg_b),
+            'avg_hex': "#{:02x}{:02x}{:02x}".format(int(avg_r), int(avg_g), int(avg_b)),
+            'intensity': int(intensity),
+            'filled': bool(not valid_bins[i])
+        })
+
+    return {
+        'results': results,
+        'depth_profile': depth_profile,
+        'zone_boundaries': {
+            'sz_end': round(s1, 3), # Top boundary (0 to s1)
+            'mz_end': round(s2, 3), # Middle boundary (s1 to s2)
+            'sz_boundary': round(s1, 3),
+            'mz_boundary': round(s2, 3)
+        },
+        'zero_hue': zero_hue,
+        'ninety_hue': ninety_hue,
+        'z1_h': z1_h,
+        'z2_h': z2_h
+    }
+
+
+def analyze(img, params, detector=None):
+    """
+    Run the full zone/depth-profile analysis on a decoded BGR image.
+
+    Args:
+        img: BGR image array
+        params: normalised analysis parameters (see app.analysis_params): sz_boundary,
+            mz_boundary, use_ai, zone_model, force_zero_hue, force_ninety_hue,
+            zone_mask, profile_mask
+        detector: the AI ZoneDetector for `use_ai` requests (None = no AI detection)
+
+    Returns:
+        dict with results, depth_profile, zone_boundaries, ai_info,
+        color_calibration, masks and the boundary rows z1_h, z2_h
+    """
+    zone_mask, profile_mask = params['zone_mask'], params['profile_mask']
+
+    # Default Mapping
+    zero_hue = 0   # Red
+    ninety_hue = 60 # Green
+
+    # Forced calibration (both anchors or none, see analysis_params)
+    forced = params['force_zero_hue'] is not None
+    if forced:
+        zero_hue = params['force_zero_hue']
+        ninety_hue = params['force_ninety_hue']
+        print(f"Using forced color calibration: 0°={zero_hue}, 90°={ninety_hue}")
+
+    # AI Auto-Detection Logic
+    use_ai = params['use_ai']
+    ai_result_info = {}
+
+    split1_pct = params['sz_boundary']
+    split2_pct = params['mz_boundary']
+
+    if use_ai and detector:
+        print("Running AI Detection...")
+        # A shared batch model (from /zone_model) skips the per-image clustering
+        zone_model = params['zone_model']
+        ai_results = detector.detect_zones_and_colors(img, zone_model)
+
+        if ai_results.get('success'):
+            # Update boundaries
+            split1_pct = ai_results['sz_boundary']
+            split2_pct = ai_results['mz_boundary']
+
+            # Update Color Mapping
+            detected_sz_hue = ai_results['sz_hue']
+            detected_dz_hue = ai_results['dz_hue']
+
+            print(f"AI Detected: SZ Bound={split1_pct}%, MZ Bound={split2_pct}%")
+            print(f"AI Detected Colors: SZ Hue={detected_sz_hue:.1f}, DZ Hue={detected_dz_hue:.1f}")
+
+            # Update logic if separation is sufficient AND we aren't using forced values
+            if abs(detected_dz_hue - detected_sz_hue) > 5:
+                if not forced:
+                    zero_hue = detected_sz_hue
+                    ninety_hue = detected_dz_hue
+                else:
+                    print("AI detected colors ignored in favor of forced calibration.")
+
+            ai_result_info = {
+                'detected': True,
+                'sz_hue': round(detected_sz_hue, 1),
+                'dz_hue': round(detected_dz_hue, 1),
+                'sz_boundary': split1_pct,
+                'mz_boundary': split2_pct,
+                'confidence': ai_results['confidence'],
+                'shared_model': zone_model is not None
+            }
+        else:
+            print("AI Detection returned failure.")
+
+    stats = row_statistics(img, zone_mask, profile_mask)
+    calibrate = not use_ai and not forced
+    analysis = analyze_rows(stats, split1_pct, split2_pct, zero_hue, ninety_hue, calibrate)
+    if calibrate:
+        print(f"Manually Detected: Zero={analysis['zero_hue']:.1f}, Ninety={analysis['ninety_hue']:.1f}")
+
+    return {
+        'results': analysis['results'],
+        'depth_profile': analysis['depth_profile'],
+        'zone_boundaries': analysis['zone_boundaries'],
+        'ai_info': ai_result_info,
+        'color_calibration': {
+            'zero_hue': analysis['zero_hue'],
+            'ninety_hue': analysis['ninety_hue']
+        },
+        'masks': {'zone': zone_mask, 'profile': profile_mask},
+        'z1_h': analysis['z1_h'],
+        'z2_h': analysis['z2_h']
+    }
+
+
+def zone_model_param(value):
+    """Validated shared zone model (3 normalised [hue, value] centres, SZ/MZ/DZ) or None."""
+    if value is None:
+        return None
+    try:
+        model = np.asarray(value, dtype=float)
+    except (TypeError, ValueError):
+        model = None
+    if model is None or model.shape != (3, 2) or not np.all(np.isfinite(model)):
+        raise ValueError("zone_model must be three [hue, value] pairs (see /zone_model)")
+    return np.round(model, 4).tolist()
+
+
+def encode_jpeg(image_array):
+    """Encode a BGR array as JPEG bytes."""
+    ok, buffer = cv2.imencode('.jpg', image_array)
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buffer.tobytes()
+
+
+def render_annotated(img, z1_h, z2_h):
+    """Copy of the image with the SZ/MZ/DZ boundary lines and labels drawn on it."""
+    height, width = img.shape[:2]
+    annotated_img = img.copy()
+    line_color = (0, 255, 255)
+    thickness = 2
+    cv2.line(annotated_img, (0, z1_h), (width, z1_h), line_color, thickness)
+    cv2.line(annotated_img, (0, z2_h), (width, z2_h), line_color, thickness)
+
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    cv2.putText(annotated_img, "SZ", (10, min(z1_h - 10, 30)), font, 0.8, (255,255,255), 2)
+    cv2.putText(annotated_img, "MZ", (10, min(z2_h - 10, z1_h + 30)), font, 0.8, (255,255,255), 2)
+    cv2.putText(annotated_img, "DZ", (10, min(height - 10, z2_h + 30)), font, 0.8, (255,255,255), 2)
+    return annotated_img
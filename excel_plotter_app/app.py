@@ -79,6 +79,16 @@ def parse_excel(file_storage):
     except Exception as e:
         return {"error": str(e)}
 
+@app.route('/healthz')
+def healthz():
+    """Liveness probe: the process is up and serving requests."""
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe. The plotter has no model to load, so it is ready once imported."""
+    return jsonify({"ready": True, "pid": os.getpid()})
+
 @app.route('/')
 def index():
     return render_template('index.html')
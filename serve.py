@@ -0,0 +1,204 @@
+"""
+Production launcher for the Cartilage Analysis and Excel Plotter apps.
+
+`python app.py` starts the single-process Werkzeug development server with the
+reloader. For shared use (e.g. a whole lab) run the apps through this script
+instead:
+
+    # Linux/Mac: one web process x 16 threads, 4 analysis processes (gunicorn)
+    python serve.py cartilage --workers 4 --threads 16 --port 5001
+
+    # Windows or when gunicorn is not installed: one process, 16 threads (waitress)
+    python serve.py cartilage --threads 16 --port 5001
+
+    python serve.py plotter --port 5002
+
+    # Async front tier (uvicorn): uploads are received on an event loop and
+    # only complete requests reach the compute threads (see asgi_bridge.py)
+    python serve.py cartilage --server uvicorn --workers 2 --threads 8
+
+The cartilage app always runs in a single web process: rendered overlays,
+preview pyramids, tile sources, refinement jobs and tuning sessions live in
+that process's memory and the browser fetches them back by URL, which another
+process would answer with 404. Its `--workers` sets the number of analysis
+processes (ANALYSIS_WORKERS, unless set explicitly) instead, so the analyses
+still use all cores.
+
+Every worker process imports the app and runs its `warm_up()` once before
+accepting traffic (pass --lazy-ai to defer loading the zone detector).
+`/healthz` reports liveness, `/readyz` reports whether the worker has finished
+warming up.
+"""
+import os
+import sys
+import argparse
+import importlib
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Apps whose responses link to per-process state (renders, previews, tiles,
+# refinement jobs, tuning sessions): served by exactly one web process
+SINGLE_PROCESS_APPS = {'cartilage'}
+
+APPS = {
+    'cartilage': 'cartilage_analysis_app',
+    'plotter': 'excel_plotter_app'
+}
+
+
+def load_app(app_name):
+    """
+    Import the Flask module of the chosen app.
+
+    The apps use paths relative to their own folder (templates, static/uploads),
+    so we switch into it before importing.
+    """
+    app_dir = os.path.join(ROOT, APPS[app_name])
+    os.chdir(app_dir)
+    if app_dir not in sys.path:
+        sys.path.insert(0, app_dir)
+    return importlib.import_module('app')
+
+
+def warm_up(module, load_detector=True):
+    """Run the module's warm-up hook if it has one."""
+    hook = getattr(module, 'warm_up', None)
+    if hook is None:
+        return
+    state = hook(load_detector=load_detector)
+    if state and state.get('error'):
+        print(f"[pid {os.getpid()}] Warm-up failed: {state['error']}")
+    elif state:
+        print(f"[pid {os.getpid()}] Warm-up finished in {state.get('duration_s')}s")
+
+
+def serve_gunicorn(args):
+    """Multi-process serving with gunicorn (gthread workers). Not available on Windows."""
+    from gunicorn.app.base import BaseApplication
+
+    class StandaloneApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{args.host}:{args.port}")
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', args.timeout)
+            self.cfg.set('graceful_timeout', 30)
+            # Each worker loads its own copy so nothing heavy is shared across fork
+            self.cfg.set('preload_app', False)
+            self.cfg.set('accesslog', '-' if args.access_log else None)
+
+        def load(self):
+            module = load_app(args.app)
+            warm_up(module, load_detector=not args.lazy_ai)
+            return module.app
+
+    StandaloneApplication().run()
+
+
+def serve_waitress(args):
+    """Single-process, multi-threaded serving with waitress (works on Windows)."""
+    from waitress import serve
+
+    if args.workers > 1:
+        print("waitress runs a single process; use gunicorn on Linux/Mac for multiple workers. "
+              f"Serving with {args.threads} threads.")
+    module = load_app(args.app)
+    warm_up(module, load_detector=not args.lazy_ai)
+    serve(module.app, host=args.host, port=args.port, threads=args.threads,
+          channel_timeout=args.timeout)
+
+
+def serve_uvicorn(args):
+    """Async serving: uvicorn receives bodies, asgi_bridge runs Flask on a bounded thread pool."""
+    import uvicorn
+
+    # uvicorn builds the app in every worker process from the environment
+    os.environ['SERVE_APP'] = args.app
+    os.environ['WEB_THREADS'] = str(args.threads)
+    os.environ['LAZY_AI'] = '1' if args.lazy_ai else '0'
+    uvicorn.run('asgi_bridge:create_app', factory=True, app_dir=ROOT,
+                host=args.host, port=args.port, workers=args.workers,
+                timeout_keep_alive=args.timeout,
+                access_log=args.access_log)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run an app with a production WSGI server.")
+    parser.add_argument('app', choices=sorted(APPS), help="Which app to serve")
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5001)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 1)),
+                        help="Worker processes (gunicorn/uvicorn); for the cartilage app, "
+                             "analysis processes behind its single web process")
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 8)),
+                        help="Threads per worker process")
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('WEB_TIMEOUT', 300)),
+                        help="Seconds before a stuck request/worker is recycled")
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress', 'uvicorn'], default='auto')
+    parser.add_argument('--lazy-ai', action='store_true',
+                        default=os.environ.get('LAZY_AI', '') == '1',
+                        help="Do not pre-load the zone detector; build it on the first use_ai request")
+    parser.add_argument('--access-log', action='store_true', help="Log every request to stdout")
+    return parser.parse_args(argv)
+
+
+def single_process(args):
+    """
+    Serve a stateful app from one web process: its --workers become analysis
+    processes (ANALYSIS_WORKERS) unless those are configured explicitly.
+    """
+    if args.app not in SINGLE_PROCESS_APPS or args.workers <= 1:
+        return
+    if not os.environ.get('ANALYSIS_WORKERS'):
+        os.environ['ANALYSIS_WORKERS'] = str(args.workers)
+    print(f"'{args.app}' keeps renders, previews, tiles and sessions in process memory and runs in one "
+          f"web process; using {os.environ['ANALYSIS_WORKERS']} analysis processes instead of "
+          f"{args.workers} web workers.")
+    args.workers = 1
+
+
+def stream_limit(args, server):
+    """
+    Cap open server-sent event streams (MAX_EVENT_STREAMS, unless set explicitly).
+    With waitress and gunicorn every open stream holds one of the --threads, so a
+    quarter of them at most; uvicorn runs streams on their own pool (STREAM_THREADS).
+    """
+    if os.environ.get('MAX_EVENT_STREAMS'):
+        return
+    if server == 'uvicorn':
+        import asgi_bridge
+        limit = int(os.environ.get('STREAM_THREADS', asgi_bridge.DEFAULT_STREAM_THREADS))
+    else:
+        limit = max(1, args.threads // 4)
+    os.environ['MAX_EVENT_STREAMS'] = str(limit)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    single_process(args)
+
+    server = args.server
+    if server == 'auto':
+        server = 'waitress'
+        if os.name != 'nt':
+            try:
+                import gunicorn  # noqa: F401
+                server = 'gunicorn'
+            except ImportError:
+                pass
+
+    stream_limit(args, server)
+    print(f"Serving '{args.app}' on {args.host}:{args.port} with {server} "
+          f"(workers={1 if server == 'waitress' else args.workers}, threads={args.threads})")
+
+    if server == 'gunicorn':
+        serve_gunicorn(args)
+    elif server == 'uvicorn':
+        serve_uvicorn(args)
+    else:
+        serve_waitress(args)
+
+
+if __name__ == '__main__':
+    main()
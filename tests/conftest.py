@@ -0,0 +1,71 @@
+"""
+Shared fixtures. The apps import their modules flat (`import admission`), so the
+app folder and the repository root (serve.py, asgi_bridge.py) go on sys.path.
+Every file-backed store points into one temporary folder, and the results
+database and batch-run resume are off unless a test builds its own.
+"""
+import os
+import sys
+import atexit
+import shutil
+import base64
+import tempfile
+
+import cv2
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, 'cartilage_analysis_app')
+for path in (ROOT, APP_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+_TMP = tempfile.mkdtemp(prefix='cartilage_tests_')
+atexit.register(shutil.rmtree, _TMP, True)
+os.environ.update({
+    'RESULTS_DB': '',
+    'RESULT_CACHE_DIR': os.path.join(_TMP, 'results'),
+    'TILE_DIR': os.path.join(_TMP, 'tiles'),
+    'BATCH_RUN_DIR': os.path.join(_TMP, 'batch_runs'),
+    'BATCH_RUN_RESUME': '0',
+    'ANALYSIS_WORKERS': '0',
+})
+
+
+def make_plm_image(height=240, width=160, zero_hue=0, ninety_hue=60):
+    """Synthetic PLM-like slide: hue runs from `zero_hue` (top, SZ) to `ninety_hue` (bottom, DZ)."""
+    hsv = np.zeros((height, width, 3), dtype=np.uint8)
+    hsv[:, :, 0] = np.linspace(zero_hue, ninety_hue, height).round().astype(np.uint8)[:, None]
+    hsv[:, :, 1] = 200
+    hsv[:, :, 2] = 200
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def png_bytes(img):
+    return cv2.imencode('.png', img)[1].tobytes()
+
+
+def data_url(image_bytes, mimetype='image/png'):
+    return f"data:{mimetype};base64," + base64.b64encode(image_bytes).decode()
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def plm_image():
+    return make_plm_image()
+
+
+@pytest.fixture
+def plm_png(plm_image):
+    return png_bytes(plm_image)
@@ -0,0 +1,83 @@
+import time
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, image_dimensions
+from conftest import data_url
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    controller = AdmissionController(max_pixels=100, max_queue=4, max_wait=5)
+    first = controller.acquire(60)
+    order = []
+
+    def request(name, pixels):
+        cost = controller.acquire(pixels)
+        order.append(name)
+        controller.release(cost)
+
+    big = threading.Thread(target=request, args=('big', 60))
+    big.start()
+    wait_until(lambda: controller.metrics()['queue_depth'] == 1)
+    # Would fit next to the running request, but must not overtake the queued one
+    small = threading.Thread(target=request, args=('small', 10))
+    small.start()
+    wait_until(lambda: controller.metrics()['queue_depth'] == 2)
+    assert order == []
+
+    controller.release(first)
+    big.join(5)
+    small.join(5)
+    assert order == ['big', 'small']
+
+
+def test_full_queue_is_rejected_with_retry_hint():
+    controller = AdmissionController(max_pixels=10, max_queue=0, max_wait=5)
+    cost = controller.acquire(10)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(1)
+    assert rejected.value.retry_after >= 1
+    controller.release(cost)
+    controller.release(controller.acquire(1))
+    assert controller.metrics()['rejected_total'] == 1
+
+
+def test_waiting_too_long_is_rejected():
+    controller = AdmissionController(max_pixels=10, max_queue=2, max_wait=0.05)
+    controller.acquire(10)
+    with pytest.raises(AdmissionRejected):
+        controller.acquire(5)
+    assert controller.metrics()['queue_depth'] == 0
+
+
+def test_oversized_image_runs_alone():
+    controller = AdmissionController(max_pixels=10)
+    with controller.admit(1000):
+        assert controller.metrics()['pixels_in_use'] == 10
+    assert controller.metrics()['pixels_in_use'] == 0
+
+
+@pytest.mark.parametrize('ext', ['.png', '.jpg', '.bmp', '.tif'])
+def test_dimensions_come_from_the_header(ext):
+    img = np.zeros((37, 53, 3), dtype=np.uint8)
+    assert image_dimensions(cv2.imencode(ext, img)[1].tobytes()) == (53, 37)
+    assert image_dimensions(b'not an image') is None
+
+
+def test_busy_server_answers_429(client, app_module, plm_png, monkeypatch):
+    busy = AdmissionController(max_pixels=10, max_queue=0)
+    busy.acquire(10)
+    monkeypatch.setattr(app_module, 'ADMISSION', busy)
+    response = client.post('/analyze', json={'image': data_url(plm_png), 'cache': False})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
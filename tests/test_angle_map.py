@@ -0,0 +1,48 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+from zone_analysis import hue_to_angle
+from conftest import data_url, make_plm_image, png_bytes
+
+
+@pytest.mark.parametrize('zero_hue, ninety_hue', [(0, 60), (12.5, 47.3), (40, 10), (20, 20.5)])
+def test_lookup_table_matches_hue_to_angle(app_module, zero_hue, ninety_hue):
+    hues = np.arange(256, dtype=np.float64)
+    expected = np.rint(hue_to_angle(hues, zero_hue, ninety_hue))
+    assert np.array_equal(app_module.angle_lut(zero_hue, ninety_hue), expected)
+
+
+def test_angle_map_marks_masked_pixels_as_nodata(app_module):
+    img = make_plm_image(height=64, width=8)
+    img[:4] = 0       # dark: V <= 10
+    img[4:8] = 128    # grey: S <= 10
+    angles = app_module.angle_map(img, 0, 60)
+
+    hue = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)[:, :, 0]
+    assert (angles[:8] == app_module.ANGLE_NODATA).all()
+    assert np.array_equal(angles[8:], np.rint(hue_to_angle(hue[8:].astype(float), 0, 60)).astype(np.uint8))
+    assert (angles[8:] <= 90).all()
+
+
+def test_angle_map_downloads(client):
+    img = make_plm_image(height=96, width=64)
+    img[:10] = 0
+    response = client.post('/analyze', json={'image': data_url(png_bytes(img)), 'cache': False,
+                                             'angle_map': True}).get_json()
+    outputs = response['angle_map']
+    assert (outputs['width'], outputs['height']) == (64, 96)
+
+    png = client.get(outputs['png_url'])
+    angles = cv2.imdecode(np.frombuffer(png.data, np.uint8), cv2.IMREAD_UNCHANGED)
+    assert angles.shape == (96, 64) and (angles[:10] == outputs['nodata']).all()
+
+    npz = np.load(io.BytesIO(client.get(outputs['npz_url']).data))
+    assert np.array_equal(npz['angle'], angles)
+    assert np.array_equal(npz['valid'], angles != outputs['nodata'])
+
+    colored = client.get(outputs['colored_url'])
+    assert cv2.imdecode(np.frombuffer(colored.data, np.uint8), cv2.IMREAD_COLOR).shape == (96, 64, 3)
+    assert client.get(outputs['png_url'].replace('angle.png', 'bogus.png')).status_code == 404
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+from asgi_bridge import WSGIToASGI
+
+
+def http_scope(path='/', method='POST'):
+    return {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+            'headers': [(b'content-type', b'application/octet-stream')]}
+
+
+def run(bridge, scope, bodies, disconnect_after=None):
+    """Run one request through the bridge; returns the ASGI messages it sent."""
+    sent = []
+
+    async def main():
+        queue = asyncio.Queue()
+        for i, body in enumerate(bodies):
+            queue.put_nowait({'type': 'http.request', 'body': body, 'more_body': i < len(bodies) - 1})
+
+        async def receive():
+            return await queue.get()
+
+        async def send(message):
+            sent.append(message)
+            chunks = [m for m in sent if m['type'] == 'http.response.body' and m.get('more_body')]
+            if disconnect_after is not None and len(chunks) == disconnect_after:
+                queue.put_nowait({'type': 'http.disconnect'})
+
+        await asyncio.wait_for(bridge(scope, receive, send), 10)
+
+    asyncio.run(main())
+    return sent
+
+
+def echo_app(environ, start_response):
+    body = environ['wsgi.input'].read()
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def test_body_is_received_in_chunks_and_echoed():
+    sent = run(WSGIToASGI(echo_app, threads=1), http_scope(), [b'abc', b'def', b'ghi'])
+    assert sent[0]['status'] == 200
+    assert b''.join(m.get('body', b'') for m in sent[1:]) == b'abcdefghi'
+
+
+def test_oversized_body_is_rejected_before_the_app_runs():
+    calls = []
+
+    def app(environ, start_response):
+        calls.append(environ)
+        return echo_app(environ, start_response)
+
+    sent = run(WSGIToASGI(app, threads=1, max_body_size=5), http_scope(), [b'abc', b'def'])
+    assert sent[0]['status'] == 413
+    assert calls == []
+
+
+def test_stream_runs_off_the_compute_threads_and_closes_on_disconnect():
+    producers, closed = [], threading.Event()
+
+    class Events:
+        def __iter__(self):
+            for i in range(1000):
+                producers.append(threading.current_thread().name)
+                yield f'data: {i}\n\n'.encode()
+
+        def close(self):
+            closed.set()
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/event-stream')])
+        return Events()
+
+    sent = run(WSGIToASGI(app, threads=1, stream_threads=2), http_scope(method='GET'), [b''],
+               disconnect_after=3)
+    events = [m['body'] for m in sent if m['type'] == 'http.response.body' and m.get('more_body')]
+    assert events[:3] == [b'data: 0\n\n', b'data: 1\n\n', b'data: 2\n\n']
+    assert len(events) < 1000
+    assert closed.is_set()
+    assert producers and all(name.startswith('wsgi-stream') for name in producers)
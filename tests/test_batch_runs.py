@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import subprocess
+import sys
+import threading
+
+from batch_runs import RESULTS_FILE, LOCK_FILE, BatchRunStore
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class Analyzer:
+    def __init__(self, fail=()):
+        self.calls, self.fail = [], set(fail)
+
+    def __call__(self, image_bytes, settings, filename, tags):
+        self.calls.append(filename)
+        if filename in self.fail:
+            raise RuntimeError(f'{filename} broke')
+        return {'bytes': len(image_bytes), 'sz_boundary': settings.get('sz_boundary'), 'crop': settings.get('crop')}
+
+
+def finished(store, run_id):
+    return lambda: store.status(run_id)['state'] == 'complete' and not store.status(run_id)['active']
+
+
+def make_run(store, images=(b'a', b'bb', b'ccc')):
+    run = store.create('knees', {'sz_boundary': 25, 'not_a_setting': 1})
+    for i, image in enumerate(images):
+        store.add_item(run['id'], f'img{i}.png', image)
+    return run['id']
+
+
+def test_run_processes_every_image_in_upload_order(tmp_path):
+    analyzer = Analyzer()
+    store = BatchRunStore(str(tmp_path), analyzer)
+    run_id = make_run(store)
+    assert store.status(run_id)['settings'] == {'sz_boundary': 25}
+    assert store.add_item(run_id, 'again.png', b'bb')['duplicate']
+    cropped = store.add_item(run_id, 'crop.png', b'bb', {'crop': {'x': 1}, 'preview_scale': 0.5})
+    assert not cropped['duplicate']
+
+    assert store.start(run_id)
+    wait_until(finished(store, run_id))
+    assert analyzer.calls == ['img0.png', 'img1.png', 'img2.png', 'crop.png']
+    results = store.results(run_id)
+    assert [r['filename'] for r in results] == ['img0.png', 'img1.png', 'img2.png', 'crop.png']
+    assert results[0]['sz_boundary'] == 25 and results[3]['crop'] == {'x': 1}
+
+
+def test_interrupted_run_resumes_from_its_checkpoints(tmp_path):
+    store = BatchRunStore(str(tmp_path), Analyzer())
+    run_id = make_run(store)
+    run_dir = tmp_path / run_id
+    first = store.status(run_id)['items'][0]
+
+    # A crashed server: image 0 checkpointed, a torn line, the run still marked running
+    done = {'key': first['key'], 'status': 'done', 'filename': 'img0.png', 'result': {'from': 'checkpoint'}}
+    (run_dir / RESULTS_FILE).write_text(json.dumps(done) + '\n{"key": "tor')
+    store._update(run_id, state='running')
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    (run_dir / LOCK_FILE).write_text(str(dead.pid))
+
+    analyzer = Analyzer()
+    restarted = BatchRunStore(str(tmp_path), analyzer)
+    assert restarted.resume_interrupted() == [run_id]
+    wait_until(finished(restarted, run_id))
+    assert analyzer.calls == ['img1.png', 'img2.png']
+    assert restarted.results(run_id)[0]['from'] == 'checkpoint'
+    assert len(restarted.results(run_id)) == 3
+
+    # The torn line was terminated, every later line is whole
+    lines = (run_dir / RESULTS_FILE).read_text().splitlines()
+    assert lines[1] == '{"key": "tor'
+    assert all(json.loads(line)['status'] == 'done' for line in lines[2:])
+    assert not os.path.exists(run_dir / LOCK_FILE)
+
+
+def test_failed_images_are_retried_when_the_run_is_started_again(tmp_path):
+    store = BatchRunStore(str(tmp_path), Analyzer(fail={'img1.png'}))
+    run_id = make_run(store)
+    store.start(run_id)
+    wait_until(finished(store, run_id))
+    status = store.status(run_id)
+    assert (status['done'], status['failed']) == (2, 1)
+    assert status['items'][1]['error'] == 'img1.png broke'
+
+    store.analyze = analyzer = Analyzer()
+    store.start(run_id)
+    wait_until(finished(store, run_id))
+    assert analyzer.calls == ['img1.png']
+    assert store.status(run_id)['done'] == 3
+
+
+def test_progress_written_by_another_process_is_picked_up(tmp_path):
+    writer = BatchRunStore(str(tmp_path), Analyzer())
+    run_id = make_run(writer)
+    reader = BatchRunStore(str(tmp_path), Analyzer())
+    assert reader.status(run_id)['pending'] == 3
+    writer.start(run_id)
+    wait_until(finished(writer, run_id))
+    assert reader.status(run_id)['done'] == 3
+
+
+def test_pause_stops_after_the_image_in_progress(tmp_path):
+    release = threading.Event()
+    analyzer = Analyzer()
+
+    def slow(*args):
+        release.wait(5)
+        return analyzer(*args)
+
+    store = BatchRunStore(str(tmp_path), slow)
+    run_id = make_run(store)
+    store.start(run_id)
+    wait_until(lambda: store.status(run_id)['active'])
+    store.pause(run_id)
+    release.set()
+    wait_until(lambda: not store.status(run_id)['active'])
+    status = store.status(run_id)
+    assert (status['state'], status['done'], analyzer.calls) == ('paused', 1, ['img0.png'])
+
+
+def test_run_held_by_a_live_process_is_not_started_twice(tmp_path):
+    store = BatchRunStore(str(tmp_path), Analyzer())
+    run_id = make_run(store)
+    (tmp_path / run_id / LOCK_FILE).write_text(str(os.getppid()))
+    assert not store.start(run_id)
+    os.unlink(tmp_path / run_id / LOCK_FILE)
+    assert store.start(run_id)
+    wait_until(finished(store, run_id))
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+
+from block_grid import OrientationIntegrals
+from zone_analysis import hue_to_angle
+from conftest import data_url, png_bytes
+
+
+def angle_fn(hue):
+    return hue_to_angle(hue, 10, 50)
+
+
+def random_slide(height=90, width=70):
+    rng = np.random.default_rng(1)
+    hsv = np.stack([rng.integers(0, 180, (height, width)),
+                    rng.integers(0, 40, (height, width)),
+                    rng.integers(0, 40, (height, width))], axis=2).astype(np.uint8)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def brute_force(img, x0, y0, x1, y1):
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)[y0:y1, x0:x1]
+    valid = (hsv[:, :, 2] > 10) & (hsv[:, :, 1] > 10)
+    hue = hsv[:, :, 0][valid].astype(np.float64)
+    if hue.size == 0:
+        return 0, 0.0, 0.0, 0.0
+    angles = angle_fn(hue)
+    rads = np.deg2rad(hue * 2)
+    mean_hue = (np.rad2deg(np.arctan2(np.sin(rads).sum(), np.cos(rads).sum())) % 360) / 2
+    return hue.size, angles.mean(), angles.std(), mean_hue
+
+
+def test_regions_match_brute_force():
+    img = random_slide()
+    integrals = OrientationIntegrals(img, angle_fn)
+    for x, y, w, h in [(0, 0, 70, 90), (5, 7, 13, 21), (60, 80, 50, 50), (3, 3, 0, 10), (-5, -5, 10, 10)]:
+        region = integrals.region(x, y, w, h)
+        rect = region['rect']
+        count, mean, std, hue = brute_force(img, rect['x'], rect['y'],
+                                            rect['x'] + rect['width'], rect['y'] + rect['height'])
+        assert region['count'] == count
+        assert region['mean_angle'] == pytest.approx(mean, abs=1e-6)
+        assert region['std_angle'] == pytest.approx(std, abs=1e-4)
+        assert region['mean_hue'] == pytest.approx(hue, abs=1e-6)
+
+
+def test_grid_blocks_match_brute_force():
+    img = random_slide()
+    integrals = OrientationIntegrals(img, angle_fn)
+    for grid in (integrals.grid(4, 3), integrals.blocks(25, 30)):
+        ys, xs = grid['y_edges'], grid['x_edges']
+        assert ys[0] == xs[0] == 0 and ys[-1] == 90 and xs[-1] == 70
+        for r in range(grid['rows']):
+            for c in range(grid['cols']):
+                count, mean, _, _ = brute_force(img, xs[c], ys[r], xs[c + 1], ys[r + 1])
+                assert grid['count'][r][c] == count
+                assert grid['mean_angle'][r][c] == pytest.approx(mean, abs=1e-3)
+    assert integrals.blocks(25, 30)['y_edges'] == [0, 25, 50, 75, 90]
+
+
+@pytest.mark.parametrize('params', [{'grid_rows': 0}, {'grid_cols': 2.5}, {'grid_rows': 'ten'},
+                                    {'rois': {'x': 1}}, {'rois': [{'x': 'a'}]},
+                                    {'rois': [{'x': 0, 'y': 0, 'width': -1, 'height': 1}]}])
+def test_malformed_layouts_are_rejected(client, params):
+    response = client.post('/analyze_grid', json={'image': data_url(png_bytes(random_slide())), **params})
+    assert response.status_code == 400
+
+
+def test_grid_route(client):
+    img = random_slide()
+    data = client.post('/analyze_grid', json={
+        'image': data_url(png_bytes(img)), 'zero_hue': 10, 'ninety_hue': 50,
+        'grid_rows': 3, 'grid_cols': 2, 'rois': [{'x': 5, 'y': 7, 'width': 13, 'height': 21}]
+    }).get_json()
+    assert (data['grid']['rows'], data['grid']['cols']) == (3, 2)
+    assert data['rois'][0]['count'] == brute_force(img, 5, 7, 18, 28)[0]
@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import pytest
+
+import circular_stats
+from circular_stats import circular_mean, circular_median, circular_std, hue_difference, hue_histogram
+from conftest import data_url, png_bytes
+
+
+def test_mean_and_median_stay_red_across_the_wrap():
+    hist = hue_histogram([176, 177, 178, 178, 2, 3])
+    assert hue_difference(circular_mean(hist), 179.5) < 1.0
+    assert circular_median(hist) == 178
+
+
+def test_statistics_do_not_depend_on_where_the_wrap_is():
+    rng = np.random.default_rng(4)
+    hues = rng.normal(30, 4, 500).round().astype(int) % 180
+    for shift in (0, 40, 155, 170):
+        hist = hue_histogram((hues + shift) % 180)
+        assert hue_difference(circular_mean(hist), circular_mean(hue_histogram(hues)) + shift) < 1e-6
+        assert circular_std(hist) == pytest.approx(circular_std(hue_histogram(hues)))
+        assert hue_difference(circular_median(hist), circular_median(hue_histogram(hues)) + shift) == 0
+
+
+def test_std_matches_the_resultant_length_definition():
+    hues = np.array([10, 12, 15, 20, 31])
+    rads = np.deg2rad(hues * 2.0)
+    r = np.hypot(np.sin(rads).mean(), np.cos(rads).mean())
+    assert circular_std(hue_histogram(hues)) == pytest.approx(np.rad2deg(np.sqrt(-2 * np.log(r))) / 2)
+    assert circular_std(hue_histogram([50] * 9)) == pytest.approx(0, abs=1e-4)
+
+
+def test_batches_equal_single_histograms_and_empty_is_zero():
+    rng = np.random.default_rng(5)
+    batch = rng.integers(0, 5, (6, 180)).astype(float)
+    batch[2] = 0
+    for fn in (circular_mean, circular_std, circular_median):
+        assert np.allclose(fn(batch), [fn(row) for row in batch])
+    assert circular_mean(batch[2]) == circular_std(batch[2]) == circular_median(batch[2]) == 0
+
+
+def test_row_histograms_count_masked_pixels_per_row():
+    hue = np.array([[1, 1, 179], [5, 6, 7]])
+    mask = np.array([[True, True, False], [True, False, True]])
+    rows = circular_stats.row_histograms(hue, mask)
+    assert rows.shape == (2, 180)
+    assert rows[0, 1] == 2 and rows[0, 179] == 0
+    assert rows[1, 5] == rows[1, 7] == 1 and rows[1].sum() == 2
+
+
+def test_hue_difference_is_the_short_way_round():
+    assert hue_difference(178, 2) == 4
+    assert hue_difference(2, 178) == 4
+    assert hue_difference(0, 90) == 90
+    assert np.array_equal(hue_difference(np.array([10, 170]), 0), [10, 10])
+
+
+def test_red_slide_zone_hue_is_red(client):
+    # Hue runs from 170 (top) through 0 to 10 (bottom): every zone is red
+    hsv = np.full((180, 40, 3), 200, dtype=np.uint8)
+    hsv[:, :, 0] = (np.arange(170, 190, 20 / 180).round().astype(int) % 180)[:, None]
+    img = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+    data = client.post('/analyze', json={'image': data_url(png_bytes(img)), 'cache': False,
+                                         'quality_gate': False}).get_json()
+    for zone in ('SZ', 'MZ', 'DZ'):
+        assert hue_difference(data['results'][zone]['avg_hue'], 0) <= 12
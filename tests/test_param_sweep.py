@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import pytest
+
+from conftest import data_url, png_bytes
+
+SETTINGS = [
+    ({'value': 10, 'saturation': 10}, {'value': 20, 'saturation': None}, (33, 66), 'auto'),
+    ({'value': 30, 'saturation': 40}, {'value': 50, 'saturation': 15}, (20, 55), 'auto'),
+    ({'value': 0, 'saturation': None}, {'value': 20, 'saturation': None}, (40, 40), {'zero_hue': 8.5, 'ninety_hue': 52}),
+]
+
+
+@pytest.fixture(scope='module')
+def slide():
+    # Hue gradient with noisy saturation/value, so every threshold masks different pixels
+    rng = np.random.default_rng(3)
+    height, width = 200, 90
+    hue = np.clip(np.linspace(0, 70, height)[:, None] + rng.normal(0, 6, (height, width)), 0, 179)
+    hsv = np.dstack([hue, rng.integers(0, 120, (height, width)), rng.integers(0, 160, (height, width))])
+    return png_bytes(cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR))
+
+
+def analyze(client, slide, zone_mask, profile_mask, boundaries, calibration):
+    request = {'image': data_url(slide), 'cache': False, 'quality_gate': False,
+               'zone_mask': zone_mask, 'profile_mask': profile_mask,
+               'sz_boundary': boundaries[0], 'mz_boundary': boundaries[1]}
+    if calibration != 'auto':
+        request.update(force_zero_hue=calibration['zero_hue'], force_ninety_hue=calibration['ninety_hue'])
+    return client.post('/analyze', json=request).get_json()
+
+
+def test_every_combination_equals_a_direct_analysis(client, slide):
+    combos = []
+    for settings in SETTINGS:
+        zone_mask, profile_mask, boundaries, calibration = settings
+        sweep = client.post('/analyze_sweep', json={
+            'image': data_url(slide), 'zone_masks': [zone_mask], 'profile_masks': [profile_mask],
+            'boundaries': [list(boundaries)], 'calibrations': [calibration]
+        }).get_json()
+        assert len(sweep['combinations']) == 1
+        combos.append((settings, sweep['combinations'][0]))
+
+    for settings, combo in combos:
+        direct = analyze(client, slide, *settings)
+        assert combo['results'] == direct['results']
+        assert combo['zone_boundaries'] == direct['zone_boundaries']
+        for key in ('zero_hue', 'ninety_hue'):
+            assert combo['color_calibration'][key] == direct['color_calibration'][key]
+        for key in ('angle', 'std', 'mean_hue', 'filled'):
+            assert combo['depth_profile'][key] == [point[key] for point in direct['depth_profile']]
+
+
+def test_combinations_are_the_product_of_the_settings(client, slide):
+    sweep = client.post('/analyze_sweep', json={
+        'image': data_url(slide), 'zone_masks': [{'value': 10}, {'value': 20}],
+        'calibrations': ['auto', {'zero_hue': 0, 'ninety_hue': 60}], 'boundaries': [[33, 66], [20, 50], [10, 90]]
+    }).get_json()
+    assert len(sweep['combinations']) == 12
+    assert len(sweep['thickness']) == 100
+
+
+@pytest.mark.parametrize('params', [{'zone_masks': [{'value': 13}]}, {'zone_masks': {'value': 10}},
+                                    {'calibrations': [{'zero_hue': 'x', 'ninety_hue': 3}]},
+                                    {'boundaries': [[1, 2, 3]]}, {'profile_masks': [5]}])
+def test_malformed_sweeps_are_rejected(client, slide, params):
+    assert client.post('/analyze_sweep', json={'image': data_url(slide), **params}).status_code == 400
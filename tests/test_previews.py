@@ -0,0 +1,53 @@
+import io
+
+import cv2
+import numpy as np
+
+from conftest import data_url, make_plm_image
+
+
+def upload(client, image_bytes, name='slide.tif'):
+    return client.post('/convert_image', data={'image': (io.BytesIO(image_bytes), name)},
+                       content_type='multipart/form-data').get_json()
+
+
+def test_large_upload_gets_a_reduced_preview_pyramid(client, monkeypatch):
+    monkeypatch.setenv('PREVIEW_MAX_SIDE', '512')
+    img = make_plm_image(height=1600, width=1200)
+    data = upload(client, cv2.imencode('.tif', img)[1].tobytes())
+
+    assert (data['width'], data['height']) == (1200, 1600)
+    levels = data['levels']
+    assert max(levels[0]['width'], levels[0]['height']) <= 512
+    assert levels[0]['scale'] == data['preview_scale'] == levels[0]['width'] / 1200
+    for upper, lower in zip(levels, levels[1:]):
+        assert lower['scale'] == upper['scale'] / 2
+    assert max(levels[-1]['width'], levels[-1]['height']) <= 256
+
+    for level in levels:
+        response = client.get(level['url'])
+        assert response.status_code == 200
+        preview = cv2.imdecode(np.frombuffer(response.data, np.uint8), cv2.IMREAD_COLOR)
+        assert abs(preview.shape[1] - level['width']) <= 1
+        assert abs(preview.shape[0] - level['height']) <= 1
+
+
+def test_crop_on_a_preview_maps_to_full_resolution(app_module):
+    img = np.arange(400 * 300, dtype=np.uint32).reshape(400, 300)
+    crop = app_module.crop_preview_rect(img, {'x': 10, 'y': 20, 'width': 50, 'height': 40}, 0.25)
+    assert crop.shape == (160, 200)
+    assert crop[0, 0] == img[80, 40]
+
+
+def test_analysis_by_image_key_uses_the_full_resolution_original(client, monkeypatch):
+    monkeypatch.setenv('PREVIEW_MAX_SIDE', '256')
+    img = make_plm_image(height=600, width=400)
+    encoded = cv2.imencode('.png', img)[1].tobytes()
+    key = upload(client, encoded, 'slide.png')['image_key']
+    by_key = client.post('/analyze', json={'image_key': key, 'cache': False}).get_json()
+    by_upload = client.post('/analyze', json={'image': data_url(encoded), 'cache': False}).get_json()
+    assert by_key['image_fingerprint'] == by_upload['image_fingerprint']
+    assert by_key['results'] == by_upload['results']
+
+    missing = client.post('/analyze', json={'image_key': '0' * 32, 'cache': False})
+    assert missing.status_code == 404
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from circular_stats import hue_difference
+from profiles import fill_gaps, profile_rows
+
+
+def naive_fill(values, valid):
+    """Reference gap filling: walk to the nearest valid bin on each side."""
+    values = np.array(values, dtype=np.float64)
+    known = [i for i in range(len(valid)) if valid[i]]
+    if not known:
+        return values
+    for i in range(len(valid)):
+        if valid[i]:
+            continue
+        before = [k for k in known if k < i]
+        after = [k for k in known if k > i]
+        if not before:
+            values[i] = values[after[0]]
+        elif not after:
+            values[i] = values[before[-1]]
+        else:
+            lo, hi = before[-1], after[0]
+            t = (i - lo) / (hi - lo)
+            values[i] = values[lo] * (1 - t) + values[hi] * t
+    return values
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_fill_gaps_matches_the_naive_loop(seed):
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(0, 90, (100, 3))
+    valid = rng.random(100) < 0.4
+    assert np.allclose(fill_gaps(values, valid), naive_fill(values, valid))
+    assert np.allclose(fill_gaps(values[:, 0], valid), naive_fill(values[:, 0], valid))
+
+
+def test_all_or_no_valid_bins_leave_values_unchanged():
+    values = np.arange(5.0)
+    assert np.array_equal(fill_gaps(values, np.ones(5, bool)), values)
+    assert np.array_equal(fill_gaps(values, np.zeros(5, bool)), values)
+
+
+def test_hue_gaps_are_filled_around_the_circle():
+    values = np.array([[178.0, 10.0], [0.0, 0.0], [0.0, 0.0], [2.0, 30.0]])
+    filled = fill_gaps(values, [True, False, False, True], hue_columns=(0,))
+    assert hue_difference(filled[1, 0], 178 + 4 / 3) < 0.01
+    assert hue_difference(filled[2, 0], 2 / 3) < 0.01
+    # Other columns stay linear
+    assert filled[1, 1] == pytest.approx(10 + 20 / 3)
+    assert 0 <= filled[:, 0].min() and filled[:, 0].max() < 180
+
+
+def test_profile_bins_cover_every_row():
+    for height in (1, 37, 100, 250):
+        starts, ends = profile_rows(height)
+        assert len(starts) == 100
+        assert (ends > starts).all() and starts[0] == 0 and ends.max() == height
+        if height >= 100:
+            assert np.array_equal(starts[1:], ends[:-1])
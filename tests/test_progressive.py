@@ -0,0 +1,82 @@
+import json
+import threading
+
+import pytest
+
+from progressive import RefinementJobs, deviation
+from conftest import data_url, make_plm_image, png_bytes
+
+
+def analysis(hue, angle=10.0):
+    zone = {'mean_angle': angle, 'std_angle': 2.0, 'avg_hue': hue}
+    return {'results': {z: dict(zone) for z in ('SZ', 'MZ', 'DZ')},
+            'depth_profile': [{'angle': angle}, {'angle': angle + 1}]}
+
+
+def test_deviation_measures_hue_around_the_circle():
+    out = deviation(analysis(178, 10), analysis(2, 13), factor=2)
+    assert out['SZ'] == {'mean_angle': 6.0, 'std_angle': 0.0, 'avg_hue': 8.0}
+    assert out['depth_profile_angle'] == 6.0
+
+
+@pytest.fixture
+def jobs():
+    jobs = RefinementJobs(workers=1)
+    yield jobs
+    jobs._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def test_shared_job_is_cancelled_only_when_nobody_holds_it(jobs):
+    gate = threading.Event()
+    jobs.submit('busy', None, lambda: gate.wait(5))
+    first = jobs.submit('k', 'preview', lambda: 'final')
+    assert jobs.submit('k', 'preview', lambda: 'other') is first
+    assert first.holders == 2 and jobs.metrics()['submitted'] == 2
+
+    assert not jobs.cancel('k')
+    assert first.state() == 'queued'
+    assert jobs.cancel('k')
+    assert first.state() == 'failed' and jobs.metrics()['cancelled'] == 1
+
+    # A running job is never cancelled; a failed one is submitted again
+    assert not jobs.cancel('busy')
+    gate.set()
+    assert jobs.wait('busy', 5).result is True
+    again = jobs.submit('k', 'preview', lambda: 'final')
+    assert again is not first and jobs.wait('k', 5).result == 'final'
+
+
+def test_errors_are_kept_on_the_job(jobs):
+    def fail():
+        raise RuntimeError('decode failed')
+
+    jobs.submit('k', None, fail)
+    job = jobs.wait('k', 5)
+    assert str(job.error) == 'decode failed' and jobs.metrics()['failed'] == 1
+    assert jobs.wait('unknown', 0) is None
+
+
+def test_preview_then_refined_result(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'PROGRESSIVE_SIDE', 128)
+    image = data_url(png_bytes(make_plm_image(height=400, width=300, zero_hue=2, ninety_hue=62)))
+    preview = client.post('/analyze', json={'image': image, 'progressive': True}).get_json()
+    stage = preview['progressive']
+    assert stage['stage'] == 'preview' and stage['scale'] < 0.5
+    assert set(stage['error_estimate']) == {'SZ', 'MZ', 'DZ', 'depth_profile_angle'}
+    assert preview['tiles'] is None
+
+    final = client.get(stage['refined_url'] + '?wait=30')
+    assert final.status_code == 200
+    final = final.get_json()
+    assert final['progressive']['stage'] == 'final'
+    assert set(final['progressive']['preview_deviation']) == set(stage['error_estimate'])
+
+    events = client.get(stage['events_url']).get_data(as_text=True)
+    assert events.startswith('event: final\n')
+    assert json.loads(events.split('data: ', 1)[1])['results'] == final['results']
+
+    # The exact result is cached now, so the next progressive request gets it directly
+    direct = client.post('/analyze', json={'image': image, 'progressive': True}).get_json()
+    assert 'progressive' not in direct and direct['results'] == final['results']
+    assert client.get('/analyze/refined/unknown').status_code == 404
+    assert client.get(stage['refined_url'] + '?wait=soon').status_code == 400
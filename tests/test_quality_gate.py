@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import pytest
+
+from quality_gate import QualityGate, QualityRejected, decode_small, gate_from_env
+from conftest import data_url, png_bytes
+
+
+def stained_slide(height=200, width=150):
+    """Textured slide with varying saturation: passes every check."""
+    rng = np.random.default_rng(7)
+    hsv = np.dstack([np.tile(np.linspace(0, 60, height)[:, None], (1, width)),
+                     rng.integers(80, 250, (height, width)),
+                     rng.integers(60, 250, (height, width))]).astype(np.uint8)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+@pytest.mark.parametrize('pixel, kind', [((0, 0, 0), 'blank or too dark'), ((255, 255, 255), 'overexposed'),
+                                         ((128, 128, 128), 'unstained or grey')])
+def test_colourless_slides_are_blocking(pixel, kind):
+    img = np.full((64, 64, 3), pixel, dtype=np.uint8)
+    blocking, _ = QualityGate().issues(QualityGate().measure(img))
+    assert len(blocking) == 1 and kind in blocking[0]
+
+
+def test_flat_colour_blocks_and_blur_warns():
+    flat = np.full((64, 64, 3), (40, 90, 200), dtype=np.uint8)
+    blocking, warnings = QualityGate().issues(QualityGate().measure(flat))
+    assert 'no colour variation' in blocking[0]
+    assert 'out of focus' in warnings[0]
+
+
+def test_stained_slide_passes():
+    report = QualityGate().check(stained_slide())
+    assert report['passed'] and report['issues'] == []
+
+
+def test_flag_mode_reports_and_reject_mode_raises():
+    blank = np.zeros((32, 32, 3), dtype=np.uint8)
+    flag = QualityGate()
+    report = flag.check(blank)
+    assert not report['passed'] and report['issues']
+    assert flag.metrics()['flagged'] == 1 and flag.metrics()['rejected'] == 0
+
+    reject = QualityGate('reject')
+    with pytest.raises(QualityRejected) as rejected:
+        reject.check(blank)
+    assert rejected.value.report['passed'] is False
+    assert reject.metrics()['rejected'] == 1
+    # Warnings alone never reject
+    assert QualityGate('reject', {'min_focus': 1e9}).check(stained_slide())['passed']
+
+
+def test_gate_mode_from_environment(monkeypatch):
+    monkeypatch.delenv('QUALITY_GATE', raising=False)
+    assert gate_from_env().mode == 'flag'
+    monkeypatch.setenv('QUALITY_GATE', 'reject')
+    monkeypatch.setenv('QUALITY_MIN_FOCUS', '3')
+    gate = gate_from_env()
+    assert gate.mode == 'reject' and gate.limits['min_focus'] == 3
+    monkeypatch.setenv('QUALITY_GATE', 'off')
+    assert gate_from_env() is None
+
+
+def test_reduced_decode_keeps_the_full_size_scale():
+    img = cv2.resize(stained_slide(), (1600, 1200))
+    small, scale = decode_small(cv2.imencode('.jpg', img)[1].tobytes(), 256)
+    assert max(small.shape[:2]) == 256
+    assert scale == pytest.approx(small.shape[1] / 1600)
+    assert decode_small(b'not an image', 256) == (None, None)
+
+
+def test_analyze_flags_by_default_and_rejects_when_asked(client, app_module, monkeypatch):
+    blank = data_url(png_bytes(np.full((120, 80, 3), 255, dtype=np.uint8)))
+    flagged = client.post('/analyze', json={'image': blank, 'cache': False})
+    assert flagged.status_code == 200
+    assert not flagged.get_json()['quality']['passed']
+
+    monkeypatch.setattr(app_module, 'QUALITY', QualityGate('reject'))
+    rejected = client.post('/analyze', json={'image': blank, 'cache': False})
+    assert rejected.status_code == 422
+    assert 'overexposed' in rejected.get_json()['error']
+    assert rejected.get_json()['quality']['passed'] is False
+    assert client.post('/analyze', json={'image': blank, 'cache': False, 'quality_gate': False}).status_code == 200
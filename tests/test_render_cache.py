@@ -0,0 +1,52 @@
+import numpy as np
+
+from render_cache import RenderCache, image_fingerprint, render_key
+from conftest import data_url
+
+
+def test_fingerprint_follows_content_not_identity():
+    img = np.arange(24, dtype=np.uint8).reshape(2, 4, 3)
+    assert image_fingerprint(img) == image_fingerprint(img.copy())
+    assert image_fingerprint(img) != image_fingerprint(img.reshape(4, 2, 3))
+    assert image_fingerprint(img[:, ::2]) == image_fingerprint(np.ascontiguousarray(img[:, ::2]))
+    assert render_key('f', 'heat', a=1, b=2) == render_key('f', 'heat', b=2, a=1)
+    assert render_key('f', 'heat', a=1) != render_key('f', 'heat', a=2)
+
+
+def test_least_recently_used_entries_are_evicted_by_bytes():
+    cache = RenderCache(max_bytes=10)
+    cache.put('a', b'xxxx')
+    cache.put('b', b'xxxx')
+    cache.get('a')
+    cache.put('c', b'xxxx')
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    assert cache.metrics()['bytes'] == 8 and cache.metrics()['evictions'] == 1
+
+    # The newest entry stays even when it alone is over budget
+    cache.put('big', b'x' * 50)
+    assert 'big' in cache and cache.metrics()['entries'] == 1
+
+
+def test_get_or_render_renders_once():
+    cache, calls = RenderCache(max_bytes=100), []
+
+    def render():
+        calls.append(1)
+        return b'jpeg'
+
+    assert cache.get_or_render('k', render) == b'jpeg'
+    assert cache.get_or_render('k', render) == b'jpeg'
+    assert len(calls) == 1
+
+
+def test_render_route_serves_immutable_content(client, plm_png):
+    analysis = client.post('/analyze', json={'image': data_url(plm_png), 'cache': False}).get_json()
+    url = analysis['annotated_image_url']
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+
+    etag = response.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/render/' + '0' * 32 + '.jpg').status_code == 404
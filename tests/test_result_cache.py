@@ -0,0 +1,71 @@
+import time
+
+from result_cache import ResultCache, content_hash, result_key
+from conftest import data_url, make_plm_image, png_bytes
+
+MB = 1024 * 1024
+
+
+def open_cache(tmp_path, version='v1', **kwargs):
+    options = {'memory_bytes': MB, 'disk_bytes': MB, 'ttl': 3600}
+    options.update(kwargs)
+    return ResultCache(str(tmp_path / 'results.sqlite'), version, **options)
+
+
+def test_key_covers_image_parameters_and_version():
+    params = {'sz_boundary': 33.0, 'mz_boundary': 66.0}
+    key = result_key('img', params, 'v1')
+    assert key == result_key('img', dict(reversed(list(params.items()))), 'v1')
+    assert key != result_key('other', params, 'v1')
+    assert key != result_key('img', {**params, 'sz_boundary': 30.0}, 'v1')
+    assert key != result_key('img', params, 'v2')
+    assert content_hash(b'abc') == content_hash(b'abc') != content_hash(b'abd')
+
+
+def test_disk_tier_is_shared_and_promoted_to_memory(tmp_path):
+    open_cache(tmp_path).put('k', {'a': 1}, b'jpg')
+    other = open_cache(tmp_path)
+    assert other.get('k') == ({'a': 1}, b'jpg')
+    assert other.get('k') == ({'a': 1}, b'jpg')
+    metrics = other.metrics()
+    assert (metrics['disk_hits'], metrics['memory_hits'], metrics['misses']) == (1, 1, 0)
+
+
+def test_other_versions_and_expired_rows_never_hit(tmp_path):
+    open_cache(tmp_path).put('k', {'a': 1})
+    assert open_cache(tmp_path, version='v2').get('k') is None
+    # Opening as v2 deleted the v1 rows
+    assert open_cache(tmp_path).get('k') is None
+
+    open_cache(tmp_path).put('old', {'a': 1})
+    time.sleep(0.02)
+    assert open_cache(tmp_path, ttl=0.01).get('old') is None
+
+
+def test_memory_and_disk_budgets_evict_least_recently_used(tmp_path):
+    cache = open_cache(tmp_path, memory_bytes=60, disk_bytes=60)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, {'pad': 'x' * 20})
+        time.sleep(0.01)
+    assert cache.metrics()['memory_entries'] == 2
+    cache.prune()
+    assert cache.metrics()['disk_entries'] == 2
+    assert open_cache(tmp_path).get('a') is None
+    assert open_cache(tmp_path).get('c') is not None
+
+
+def test_analyze_reuses_results_for_equivalent_requests(client):
+    image = data_url(png_bytes(make_plm_image(zero_hue=5, ninety_hue=55)))
+    first = client.post('/analyze', json={'image': image}).get_json()
+    assert first['cached'] is False
+
+    # Defaults spelled out, ints vs floats and a lone forced hue are the same request
+    same = client.post('/analyze', json={'image': image, 'sz_boundary': 33.0, 'mz_boundary': 66,
+                                         'force_zero_hue': 12}).get_json()
+    assert same['cached'] is True
+    assert same['results'] == first['results']
+    assert client.get(same['annotated_image_url']).status_code == 200
+
+    changed = client.post('/analyze', json={'image': image, 'sz_boundary': 30}).get_json()
+    assert changed['cached'] is False
+    assert client.post('/analyze', json={'image': image, 'cache': False}).get_json()['cached'] is False
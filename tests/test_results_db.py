@@ -0,0 +1,87 @@
+import pytest
+
+from results_db import ResultsDatabase, where_clause
+from conftest import data_url, make_plm_image, png_bytes
+
+
+def response(sz, dz, hue=30.0, bins=4):
+    return {
+        'results': {zone: {'mean_angle': angle, 'std_angle': 5.0, 'avg_hue': hue}
+                    for zone, angle in (('SZ', sz), ('MZ', (sz + dz) / 2), ('DZ', dz))},
+        'color_calibration': {'zero_hue': 10.0, 'ninety_hue': 50.0},
+        'zone_boundaries': {'sz_end': 0.33, 'mz_end': 0.66},
+        'depth_profile': [{'thickness': (i + 0.5) / bins, 'angle': sz + i, 'std': 1.0, 'mean_hue': hue,
+                           'filled': i == 0} for i in range(bins)]
+    }
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = ResultsDatabase(str(tmp_path / 'results.sqlite'))
+    db.record('k1', 'h1', 'v1', response(10, 80, hue=178), source='knee_01.png', tags=['study:OA', 'healthy'])
+    db.record('k2', 'h2', 'v1', response(20, 60, hue=2), source='knee_02.png', tags=['study:OA'])
+    db.record('k3', 'h3', 'v1', response(30, 70), source='hip_100%.png', tags=['study:hip'])
+    return db
+
+
+def sources(result):
+    return sorted(sample['source'] for sample in result['samples'])
+
+
+def test_filters_select_samples(db):
+    assert sources(db.query({'tags': ['study:OA']})) == ['knee_01.png', 'knee_02.png']
+    assert sources(db.query({'tags': ['study:OA', 'healthy']})) == ['knee_01.png']
+    assert sources(db.query({'source': '100%'})) == ['hip_100%.png']
+    assert sources(db.query({'source': 'e%0'})) == []
+    assert sources(db.query({'zones': {'DZ': {'mean_angle': [65, None]}}})) == ['hip_100%.png', 'knee_01.png']
+    assert sources(db.query({'zones': {'SZ': {'mean_angle': [15, 25]}}})) == ['knee_02.png']
+    assert db.query({}, limit=1)['total'] == 3
+
+
+def test_recording_an_analysis_again_only_adds_tags(db):
+    sample_id = db.query({'source': 'knee_01'})['samples'][0]['id']
+    assert db.record('k1', 'h1', 'v1', response(10, 80), tags=['rerun']) == sample_id
+    assert db.query({})['total'] == 3
+    assert db.sample(sample_id)['tags'] == ['healthy', 'rerun', 'study:OA']
+    assert db.tag(sample_id, remove=['rerun']) == ['healthy', 'study:OA']
+    assert db.tag(999, add=['x']) is None
+
+
+def test_cohort_profile_and_zones(db):
+    cohort = db.aggregate({'tags': ['study:OA']})
+    assert cohort['samples'] == 2
+    assert cohort['zones']['SZ'] == {'mean_angle': 15.0, 'std_angle': 5.0}
+    assert cohort['profile']['angle'] == [15.0, 16.0, 17.0, 18.0]
+    assert cohort['profile']['count'] == [2, 2, 2, 2]
+    # Hues 178 and 2 average to red, not to green
+    assert all(min(hue, 180 - hue) < 1e-6 for hue in cohort['profile']['mean_hue'])
+    assert db.aggregate({'tags': ['study:OA']}, include_filled=False)['profile']['count'] == [2, 2, 2]
+
+
+@pytest.mark.parametrize('filters', [[1], {'zones': ['DZ']}, {'zones': {'XZ': {}}}, {'zones': {'DZ': 5}},
+                                     {'zones': {'DZ': {'median': [1, 2]}}},
+                                     {'zones': {'DZ': {'mean_angle': 60}}},
+                                     {'zones': {'DZ': {'mean_angle': [1, 2, 3]}}}])
+def test_malformed_filters_raise_value_error(filters):
+    with pytest.raises(ValueError):
+        where_clause(filters)
+
+
+def test_only_opted_in_analyses_are_recorded(client, app_module, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'results_db', lambda: db)
+    image = data_url(png_bytes(make_plm_image(zero_hue=7, ninety_hue=44)))
+    assert client.post('/analyze', json={'image': image}).get_json()['sample_id'] is None
+    assert db.query({})['total'] == 3
+
+    recorded = client.post('/analyze', json={'image': image, 'filename': 'knee_03.png',
+                                             'tags': ['study:OA']}).get_json()
+    assert recorded['sample_id'] is not None
+    assert client.get(f"/results/{recorded['sample_id']}").get_json()['source'] == 'knee_03.png'
+
+    found = client.post('/results/query', json={'tags': ['study:OA']}).get_json()
+    assert found['total'] == 3
+    assert client.post('/results/query', json={'zones': {'DZ': 5}}).status_code == 400
+    assert client.post('/results/aggregate', json={'cohorts': ['OA']}).status_code == 400
+    cohorts = client.post('/results/aggregate', json={'cohorts': {'OA': {'tags': ['study:OA']},
+                                                                  'hip': {'tags': ['study:hip']}}}).get_json()
+    assert {name: c['samples'] for name, c in cohorts['cohorts'].items()} == {'OA': 3, 'hip': 1}
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+
+from image_store import StoredImage
+from conftest import data_url, make_plm_image, png_bytes
+
+
+def decode(response):
+    return cv2.imdecode(np.frombuffer(response.data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_pyramid_level_is_the_smallest_still_wide_enough():
+    stored = StoredImage(np.zeros((256, 512, 3), dtype=np.uint8))
+    assert stored.level_for_width(None)[0] == 0
+    assert stored.level_for_width(1000)[0] == 0
+    n, img = stored.level_for_width(200)
+    assert n == 1 and img.shape[1] == 256
+    n, img = stored.level_for_width(128)
+    assert n == 2 and img.shape[1] == 128
+
+
+def test_analysis_returns_histogram_and_lazy_view_urls(client):
+    img = make_plm_image(height=240, width=512)
+    img[:20] = 0  # masked out: V <= 10
+    data = client.post('/analyze_scientific', json={'image': data_url(png_bytes(img))}).get_json()
+
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    valid = (hsv[:, :, 1] > 10) & (hsv[:, :, 2] > 10)
+    assert data['histogram'] == np.histogram(hsv[:, :, 0][valid], bins=180, range=(0, 180))[0].tolist()
+    assert data['hue_url'] == f"/scientific/{data['image_key']}/hue.jpg"
+
+
+def test_views_render_at_display_width_and_are_cached(client, app_module):
+    img = make_plm_image(height=240, width=512)
+    key = client.post('/analyze_scientific', json={'image': data_url(png_bytes(img))}).get_json()['image_key']
+
+    full = client.get(f'/scientific/{key}/hue.jpg')
+    assert decode(full).shape[:2] == (240, 512)
+    # Rounded up to a multiple of 64
+    small = client.get(f'/scientific/{key}/mask.jpg?w=100')
+    assert decode(small).shape[1] == 128
+
+    misses = app_module.RENDERS.metrics()['misses']
+    again = client.get(f'/scientific/{key}/mask.jpg?w=100')
+    assert again.data == small.data
+    assert app_module.RENDERS.metrics()['misses'] == misses
+
+    assert client.get(f'/scientific/{key}/bogus.jpg').status_code == 404
+    assert client.get(f"/scientific/{'0' * 32}/hue.jpg").status_code == 404
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from ai_model import segment_zones
+
+
+def score(labels, a, b):
+    """Rows whose label matches their segment of the SZ [0, a) | MZ [a, b) | DZ [b, H) split."""
+    return (labels[:a] == 0).sum() + (labels[a:b] == 1).sum() + (labels[b:] == 2).sum()
+
+
+def brute_force(labels, min_width=0.05):
+    """Best score over every valid (a, b) split."""
+    height = len(labels)
+    m = min(int(height * min_width), height // 3)
+    return max(score(labels, a, b) for a in range(m, height + 1) for b in range(a + m, height - m + 1))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_split_is_optimal(seed):
+    rng = np.random.default_rng(seed)
+    height = int(rng.integers(9, 80))
+    a, b = sorted(rng.integers(0, height, 2))
+    labels = np.repeat([0, 1, 2], [a, b - a, height - b])
+    # Noisy rows and background rows
+    noisy = rng.random(height) < 0.25
+    labels = np.where(noisy, rng.integers(-1, 3, height), labels)
+
+    found_a, found_b, confidence = segment_zones(labels)
+    m = min(int(height * 0.05), height // 3)
+    assert m <= found_a and found_a + m <= found_b <= height - m
+    assert score(labels, found_a, found_b) == brute_force(labels)
+    labelled = (labels >= 0).sum()
+    assert confidence['overall'] == pytest.approx(brute_force(labels) / labelled, abs=1e-3)
+
+
+def test_clean_labels_are_split_exactly_with_full_confidence():
+    labels = np.repeat([0, 1, 2], [30, 30, 40])
+    a, b, confidence = segment_zones(labels)
+    assert (a, b) == (30, 60)
+    assert confidence == {'overall': 1.0, 'sz_boundary': 1.0, 'mz_boundary': 1.0}
+
+
+def test_a_few_stray_rows_do_not_move_a_boundary():
+    labels = np.repeat([0, 1, 2], [30, 30, 40])
+    labels[[5, 12, 45, 80]] = [2, 1, 0, 1]
+    labels[90:] = -1
+    a, b, confidence = segment_zones(labels)
+    assert (a, b) == (30, 60)
+    assert confidence['overall'] < 1.0
+
+
+def test_zones_never_collapse_below_the_minimum_height():
+    a, b, _ = segment_zones(np.full(100, 2))
+    assert a >= 5 and b - a >= 5
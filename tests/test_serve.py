@@ -0,0 +1,38 @@
+import os
+
+import serve
+
+
+def test_single_process_app_turns_workers_into_analysis_processes(monkeypatch):
+    monkeypatch.delenv('ANALYSIS_WORKERS', raising=False)
+    args = serve.parse_args(['cartilage', '--workers', '4'])
+    serve.single_process(args)
+    assert args.workers == 1
+    assert os.environ['ANALYSIS_WORKERS'] == '4'
+
+
+def test_explicit_analysis_workers_are_kept(monkeypatch):
+    monkeypatch.setenv('ANALYSIS_WORKERS', '2')
+    args = serve.parse_args(['cartilage', '--workers', '4'])
+    serve.single_process(args)
+    assert os.environ['ANALYSIS_WORKERS'] == '2'
+
+
+def test_stateless_app_keeps_its_web_workers(monkeypatch):
+    monkeypatch.delenv('ANALYSIS_WORKERS', raising=False)
+    args = serve.parse_args(['plotter', '--workers', '3'])
+    serve.single_process(args)
+    assert args.workers == 3
+    assert 'ANALYSIS_WORKERS' not in os.environ
+
+
+def test_readiness_follows_warm_up(client, app_module, monkeypatch):
+    assert client.get('/healthz').status_code == 200
+    monkeypatch.setitem(app_module.WARMUP_STATE, 'ready', False)
+    assert client.get('/readyz').status_code == 503
+
+    state = app_module.warm_up(load_detector=False)
+    assert state['ready'] and state['error'] is None
+    assert client.get('/readyz').status_code == 200
+    # A second call does no work
+    assert app_module.warm_up(load_detector=False)['started_at'] == state['started_at']
@@ -0,0 +1,103 @@
+import time
+import threading
+
+
+from single_flight import SingleFlight
+from conftest import data_url, make_plm_image, png_bytes
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def call_concurrently(flights, key, compute, callers):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flights.run(key, compute))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    threads[0].start()
+    wait_until(lambda: flights.metrics()['in_flight'] == 1)
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: flights.metrics()['waiting'] == callers - 1)
+    return threads, results, errors
+
+
+def test_concurrent_callers_share_one_computation():
+    flights, release, calls = SingleFlight(), threading.Event(), []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {'zones': [1, 2, 3]}
+
+    threads, results, _ = call_concurrently(flights, 'k', compute, 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    # Every caller owns its copy
+    results[0][0]['zones'].append(4)
+    assert all(result['zones'] == [1, 2, 3] for result, _ in results[1:])
+    assert flights.metrics()['in_flight'] == 0 and flights.metrics()['max_waiters'] == 3
+
+
+def test_errors_reach_every_caller_and_free_the_key():
+    flights, release = SingleFlight(), threading.Event()
+
+    def compute():
+        release.wait(5)
+        raise RuntimeError('decode failed')
+
+    threads, _, errors = call_concurrently(flights, 'k', compute, 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert [str(e) for e in errors] == ['decode failed'] * 3
+    assert flights.run('k', lambda: 42) == (42, False)
+
+
+def test_different_keys_do_not_wait_on_each_other():
+    flights, release = SingleFlight(), threading.Event()
+    thread = threading.Thread(target=flights.run, args=('slow', lambda: release.wait(5)))
+    thread.start()
+    wait_until(lambda: flights.metrics()['in_flight'] == 1)
+    assert flights.run('fast', lambda: 'done') == ('done', False)
+    release.set()
+    thread.join(5)
+
+
+def test_identical_analyze_requests_are_coalesced(client, app_module, monkeypatch):
+    release, original = threading.Event(), app_module.run_analysis
+
+    def slow_analysis(*args, **kwargs):
+        release.wait(5)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'run_analysis', slow_analysis)
+    image = data_url(png_bytes(make_plm_image(zero_hue=3, ninety_hue=47)))
+    responses = []
+
+    def post():
+        responses.append(client.post('/analyze', json={'image': image, 'cache': False}).get_json())
+
+    threads = [threading.Thread(target=post) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: app_module.ANALYSES.metrics()['waiting'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(r['coalesced'] for r in responses) == [False, True, True]
+    assert all(r['results'] == responses[0]['results'] for r in responses)
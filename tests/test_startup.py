@@ -0,0 +1,40 @@
+import os
+import sys
+import json
+import subprocess
+
+from conftest import APP_DIR
+
+PROBE = """
+import json, os, sys, threading
+before = set(os.listdir('.'))
+import app
+print(json.dumps({
+    'modules': sorted(m for m in ('torch', 'ai_model', 'sklearn') if m in sys.modules),
+    'detector': app._detector is not None,
+    'new_files': sorted(set(os.listdir('.')) - before),
+    'threads': threading.active_count()
+}))
+"""
+
+
+def test_import_is_cheap_and_has_no_side_effects(tmp_path):
+    env = dict(os.environ, PYTHONPATH=APP_DIR, RESULTS_DB=str(tmp_path / 'results.sqlite'),
+               RESULT_CACHE_DIR=str(tmp_path / 'cache'), TILE_DIR=str(tmp_path / 'tiles'),
+               BATCH_RUN_DIR=str(tmp_path / 'runs'), ANALYSIS_WORKERS='2')
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    probe = json.loads(out.strip().splitlines()[-1])
+    # No deep-learning runtime and no zone detector until a use_ai request
+    assert probe['modules'] == []
+    assert not probe['detector']
+    # Databases, caches, run folders and worker processes are all built on first use
+    assert probe['new_files'] == []
+    assert not os.listdir(tmp_path)
+    assert probe['threads'] == 1
+
+
+def test_detector_is_built_once_on_first_use(app_module):
+    first = app_module.get_detector()
+    assert first is not None
+    assert app_module.get_detector() is first
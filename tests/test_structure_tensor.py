@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+import structure_tensor
+from conftest import data_url, png_bytes
+
+
+def stripes(height=128, width=128, vertical=False, period=8):
+    coord = np.arange(width if vertical else height)
+    wave = 140 + 80 * np.sin(2 * np.pi * coord / period)
+    value = np.tile(wave, (height, 1)) if vertical else np.tile(wave[:, None], (1, width))
+    hsv = np.dstack([np.full((height, width), 30), np.full((height, width), 200), value]).astype(np.uint8)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+@pytest.mark.parametrize('vertical, expected', [(False, 0.0), (True, 90.0)])
+def test_stripe_orientation(vertical, expected):
+    rows = structure_tensor.row_statistics(stripes(vertical=vertical))
+    zone = structure_tensor.zone_statistics(rows, 0, 128)
+    assert zone['mean_angle'] == pytest.approx(expected, abs=1.0)
+    assert zone['mean_coherence'] > 0.9
+    assert zone['valid_pixels'] == 128 * 128
+
+
+def test_tiles_give_the_whole_image_result():
+    img = np.random.default_rng(2).integers(30, 255, (150, 110, 3), dtype=np.uint8)
+    whole = structure_tensor.row_statistics(img, 1.5, 4.0, keep_maps=True)
+    tiled = structure_tensor.row_statistics(img, 1.5, 4.0, tile=32, keep_maps=True)
+    for name in ('weight', 'angle_sum', 'count', 'histogram'):
+        assert np.allclose(whole[name], tiled[name], rtol=1e-4, atol=1e-3)
+    assert np.abs(whole['angle_map'].astype(int) - tiled['angle_map']).max() <= 1
+
+
+@pytest.mark.parametrize('params', [{'sigma_grad': 'wide'}, {'sigma_grad': float('nan')},
+                                    {'sigma_int': 0}, {'sigma_int': True}, {'sz_boundary': 150},
+                                    {'mz_boundary': None}])
+def test_malformed_parameters_are_rejected(client, params):
+    response = client.post('/analyze_structure_tensor', json={'image': data_url(png_bytes(stripes())), **params})
+    assert response.status_code == 400
+
+
+def test_route_returns_zones_profile_and_maps(client):
+    data = client.post('/analyze_structure_tensor', json={
+        'image': data_url(png_bytes(stripes())), 'sz_boundary': 25, 'mz_boundary': 50, 'maps': True
+    }).get_json()
+    assert set(data['results']) == {'SZ', 'MZ', 'DZ'}
+    assert len(data['depth_profile']) == 100
+    assert client.get(data['maps']['angle_url']).status_code == 200
@@ -0,0 +1,72 @@
+import os
+import threading
+
+import numpy as np
+
+from tiles import TileSource, TileStore, dzi_levels
+from conftest import data_url, make_plm_image, png_bytes
+
+
+def random_image(height, width):
+    return np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def test_dzi_levels_end_at_one_pixel():
+    assert dzi_levels(1, 1) == 1
+    assert dzi_levels(256, 256) == 9
+    assert dzi_levels(300, 200) == 10
+
+
+def test_full_resolution_tiles_are_cut_from_the_image(tmp_path):
+    img = random_image(300, 600)
+    source = TileSource.build(str(tmp_path / 'k'), img)
+    top = source.max_level
+    assert np.array_equal(source.tile(top, 1, 0), img[:256, 256:512])
+    assert np.array_equal(source.tile(top, 2, 1), img[256:, 512:])
+    assert source.tile(0, 0, 0).shape[:2] == (1, 1)
+    assert source.tile(top, 3, 0) is None
+    assert source.tile(top + 1, 0, 0) is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_concurrent_requests_build_a_pyramid_once(tmp_path):
+    store, calls = TileStore(str(tmp_path), max_bytes=1 << 30), []
+    img = random_image(64, 64)
+
+    def load():
+        calls.append(1)
+        return img, {}
+
+    threads = [threading.Thread(target=store.get_or_build, args=('k', load)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert np.array_equal(store.get('k').tile(6, 0, 0), img)
+
+
+def test_prune_skips_pyramids_being_read(tmp_path):
+    store = TileStore(str(tmp_path), max_bytes=0)
+    img = random_image(128, 128)
+    with store.reading('a', lambda: (img, {})) as a:
+        with store.reading('b', lambda: (img, {})):
+            assert sorted(os.listdir(tmp_path)) == ['a', 'b']
+        store.prune()
+        # b is no longer read, a is: only b may go
+        assert os.listdir(tmp_path) == ['a']
+        assert np.array_equal(a.tile(a.max_level, 0, 0), img)
+
+
+def test_tile_routes(client):
+    img = make_plm_image(height=300, width=520)
+    tiles = client.post('/analyze', json={'image': data_url(png_bytes(img)), 'cache': False}).get_json()['tiles']
+
+    descriptor = client.get(tiles['hue'])
+    assert descriptor.status_code == 200
+    assert b'Width="520" Height="300"' in descriptor.data
+
+    base = tiles['angle'][:-len('.dzi')] + '_files'
+    assert client.get(f'{base}/10/2_1.jpg').status_code == 200
+    assert client.get(f'{base}/10/3_0.jpg').status_code == 404
+    assert client.get(tiles['original'].replace('original', 'bogus')).status_code == 404
@@ -0,0 +1,147 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from admission import StreamSlots
+from tuning_sessions import DEFAULT_PARAMS, SessionNotFound, TuningSession, TuningSessions, apply_deltas
+from conftest import data_url
+
+
+def count_updates(session):
+    return {'params': dict(session.params)}
+
+
+def make_session(**params):
+    session = TuningSession('s', np.zeros((4, 4, 3), dtype=np.uint8), {}, DEFAULT_PARAMS)
+    session.update(params, count_updates)
+    return session
+
+
+def test_deltas_are_validated():
+    assert apply_deltas(DEFAULT_PARAMS, {'sz_boundary': '40'})['sz_boundary'] == 40.0
+    assert apply_deltas(DEFAULT_PARAMS, {'force_zero_hue': None})['force_zero_hue'] is None
+    for deltas in ({'gamma': 1}, {'sz_boundary': None}, {'mz_boundary': 'wide'}):
+        with pytest.raises(ValueError):
+            apply_deltas(DEFAULT_PARAMS, deltas)
+
+
+def test_failed_update_keeps_version_and_params():
+    session = make_session(sz_boundary=20)
+
+    def broken(session):
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        session.update({'sz_boundary': 50}, broken)
+    assert session.version == 1
+    assert session.params['sz_boundary'] == 20.0
+    with pytest.raises(ValueError):
+        session.update({'gamma': 1}, count_updates)
+    assert session.version == 1
+
+
+def test_slow_subscriber_gets_only_the_latest_version():
+    session = make_session()
+    for boundary in (10, 20, 30, 40):
+        session.update({'sz_boundary': boundary}, count_updates)
+    version, result = session.wait(1, 0)
+    assert version == 5
+    assert result['params']['sz_boundary'] == 40.0
+
+
+def test_wait_wakes_on_update_and_on_close():
+    session = make_session()
+    seen = []
+    waiter = threading.Thread(target=lambda: seen.append(session.wait(1, 5)))
+    waiter.start()
+    session.update({'mz_boundary': 70}, count_updates)
+    waiter.join(5)
+    assert seen[0][0] == 2
+
+    closer = threading.Thread(target=lambda: seen.append(session.wait(2, 5)))
+    closer.start()
+    session.close()
+    closer.join(5)
+    assert not closer.is_alive() and seen[1][0] == 2
+
+
+def test_least_recently_used_session_is_evicted():
+    image = np.zeros((10, 10, 3), dtype=np.uint8)
+    sessions = TuningSessions(max_bytes=2 * image.nbytes)
+    first = sessions.create(image, {}, {}, count_updates)
+    second = sessions.create(image, {}, {}, count_updates)
+    sessions.get(first.id)
+    third = sessions.create(image, {}, {}, count_updates)
+
+    assert second.closed
+    with pytest.raises(SessionNotFound):
+        sessions.get(second.id)
+    assert sessions.get(first.id) is first and sessions.get(third.id) is third
+    # The newest session is kept even when it alone is over budget
+    tiny = TuningSessions(max_bytes=1)
+    assert tiny.get(tiny.create(image, {}, {}, count_updates).id).version == 1
+
+
+def test_stream_slots_refuse_beyond_the_cap():
+    slots = StreamSlots(1)
+    release = slots.acquire()
+    assert slots.acquire() is None
+    release()
+    release()
+    assert slots.metrics() == {'limit': 1, 'open': 0, 'opened_total': 1, 'refused_total': 1}
+    assert slots.acquire() is not None
+
+
+def read_event(chunks):
+    for chunk in chunks:
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if not text.startswith(':'):
+            return text
+
+
+def test_session_routes_follow_the_latest_parameters(client, app_module, plm_png):
+    created = client.post('/sessions', json={'image': data_url(plm_png), 'sz_boundary': 25})
+    assert created.status_code == 200
+    first = created.get_json()
+    assert first['version'] == 1 and first['params']['sz_boundary'] == 25.0
+    session_url = first['params_url'].rsplit('/params', 1)[0]
+
+    assert client.post(first['params_url'], json={'gamma': 2}).status_code == 400
+    for boundary in (30, 35, 40):
+        assert client.post(first['params_url'], json={'sz_boundary': boundary}).status_code == 200
+
+    polled = client.get(f'{session_url}?after=1&wait=1').get_json()
+    assert polled['version'] == 4 and polled['params']['sz_boundary'] == 40.0
+    direct = client.post('/analyze', json={'image': data_url(plm_png), 'sz_boundary': 40,
+                                           'cache': False}).get_json()
+    assert polled['zone_boundaries'] == direct['zone_boundaries']
+    assert polled['results'].keys() == direct['results'].keys()
+    for zone, stats in direct['results'].items():
+        for key in ('avg_hue', 'mean_angle', 'std_angle'):
+            assert polled['results'][zone][key] == pytest.approx(stats[key], abs=1e-6)
+
+    open_before = client.get('/metrics/event_streams').get_json()['open']
+    events = client.get(f"{first['events_url']}?after=1", buffered=False)
+    chunks = events.response
+    result = read_event(chunks)
+    assert result.startswith('event: result')
+    assert json.loads(result.split('data: ', 1)[1])['version'] == 4
+    assert client.get('/metrics/event_streams').get_json()['open'] == open_before + 1
+
+    assert client.delete(session_url).status_code == 200
+    assert read_event(chunks).startswith('event: closed')
+    events.close()
+    assert client.get('/metrics/event_streams').get_json()['open'] == open_before
+    assert client.get(session_url).status_code == 404
+    assert client.post(first['params_url'], json={'sz_boundary': 30}).status_code == 404
+
+
+def test_event_streams_beyond_the_cap_answer_503(client, app_module, plm_png, monkeypatch):
+    session_id = client.post('/sessions', json={'image': data_url(plm_png)}).get_json()['session']
+    monkeypatch.setattr(app_module, 'EVENT_STREAMS', StreamSlots(0))
+    response = client.get(f'/sessions/{session_id}/events')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert app_module.EVENT_STREAMS.metrics()['refused_total'] == 1
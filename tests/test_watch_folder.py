@@ -0,0 +1,108 @@
+import os
+import csv
+import json
+import time
+
+import pytest
+
+from watch_folder import FolderWatcher, WatchDaemon, WorkQueue, load_settings
+from conftest import make_plm_image, png_bytes
+
+
+def queue_file(queue, name, mtime=1.0):
+    return queue.enqueue(f'/in/{name}', '/in', '/out', 10, mtime, {'sz_boundary': 30})
+
+
+def test_queue_is_fifo_and_deduplicated(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'q.sqlite'))
+    assert queue_file(queue, 'a.png') and queue_file(queue, 'b.png')
+    assert not queue_file(queue, 'a.png')
+    # An overwritten capture is a new job
+    assert queue_file(queue, 'a.png', mtime=2.0)
+
+    claimed = [queue.claim()['path'] for _ in range(3)]
+    assert claimed == ['/in/a.png', '/in/b.png', '/in/a.png']
+    assert queue.claim() is None
+    assert queue.counts() == {'running': 3}
+
+
+def test_running_jobs_are_retried_after_a_restart(tmp_path):
+    path = str(tmp_path / 'q.sqlite')
+    queue = WorkQueue(path)
+    queue_file(queue, 'a.png')
+    queue_file(queue, 'b.png')
+    done = queue.claim()
+    queue.complete(done['id'], 'hash')
+    queue.claim()
+
+    reopened = WorkQueue(path)
+    assert reopened.counts() == {'done': 1, 'pending': 1}
+    job = reopened.claim()
+    assert job['path'] == '/in/b.png' and job['attempts'] == 2
+    assert job['settings'] == {'sz_boundary': 30}
+
+
+def test_failures_retry_until_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'q.sqlite'), max_attempts=2)
+    queue_file(queue, 'a.png')
+    queue.fail(queue.claim()['id'], 'boom')
+    assert queue.counts() == {'pending': 1}
+    # A busy server does not use up an attempt
+    queue.release(queue.claim()['id'])
+    job = queue.claim()
+    assert job['attempts'] == 2
+    queue.fail(job['id'], 'boom')
+    assert queue.counts() == {'failed': 1}
+
+    queue_file(queue, 'b.png')
+    queue.fail(queue.claim()['id'], 'gone', retry=False)
+    assert queue.counts() == {'failed': 2}
+
+
+def test_files_are_ready_once_they_stop_changing(tmp_path):
+    watcher = FolderWatcher(str(tmp_path), recursive=True, settle=5)
+    capture = tmp_path / 'slide.png'
+    capture.write_bytes(b'partial')
+    os.utime(capture, (100, 100))
+    (tmp_path / 'results').mkdir()
+    (tmp_path / 'results' / 'old.png').write_bytes(b'output')
+    (tmp_path / 'notes.txt').write_bytes(b'ignored')
+
+    assert watcher.scan(now=101) == []
+    assert watcher.scan(now=104) == []
+    capture.write_bytes(b'partial, more')
+    os.utime(capture, (103, 103))
+    assert watcher.scan(now=105) == []
+    assert watcher.scan(now=110) == [(str(capture), 13, 103)]
+    assert watcher.scan(now=120) == []
+
+
+def test_calibration_file_overrides_folder_settings(tmp_path):
+    (tmp_path / 'calibration.json').write_text(json.dumps({'force_zero_hue': 12, 'colour': 'red'}))
+    settings = load_settings(str(tmp_path), {'force_zero_hue': 5, 'sz_boundary': 30})
+    assert settings == {'force_zero_hue': 12, 'sz_boundary': 30}
+
+
+def test_daemon_analyses_new_captures_once(tmp_path, app_module):
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir()
+    (incoming / 'knee_01.png').write_bytes(png_bytes(make_plm_image(zero_hue=6, ninety_hue=50)))
+    past = time.time() - 60
+    os.utime(incoming / 'knee_01.png', (past, past))
+
+    queue = WorkQueue(str(tmp_path / 'q.sqlite'))
+    watcher = FolderWatcher(str(incoming), settle=0, settings={'sz_boundary': 25})
+    WatchDaemon([watcher], queue, workers=1, interval=0.05).run(once=True)
+
+    results = incoming / 'results'
+    assert queue.counts() == {'done': 1}
+    result = json.loads((results / 'knee_01.json').read_text())
+    assert result['zone_boundaries']['sz_end'] == pytest.approx(0.25)
+    assert 'annotated_image_url' not in result
+    assert (results / 'knee_01_annotated.jpg').stat().st_size > 0
+    with open(results / 'results.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['source'] for row in rows] == [str(incoming / 'knee_01.png')]
+
+    WatchDaemon([FolderWatcher(str(incoming), settle=0)], queue, workers=1, interval=0.05).run(once=True)
+    assert queue.counts() == {'done': 1}
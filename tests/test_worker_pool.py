@@ -0,0 +1,77 @@
+import os
+import sys
+import glob
+import subprocess
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+import analysis_worker
+import worker_pool
+from worker_pool import AnalysisPool, attach_image, shared_image
+from conftest import make_plm_image
+
+
+def crash(img):
+    os._exit(1)
+
+
+def worker_state(img):
+    return os.getpid(), bool(img.flags.writeable), sorted(m for m in ('app', 'flask') if m in sys.modules)
+
+
+def own_segments():
+    return glob.glob(f'/dev/shm/{worker_pool.SEGMENT_PREFIX}{os.getpid()}_*')
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = AnalysisPool(1)
+    yield pool
+    pool.shutdown()
+
+
+def test_shared_image_round_trip_and_unlink():
+    img = np.random.default_rng(6).integers(0, 256, (40, 30, 3), dtype=np.uint8)
+    with shared_image(img) as handle:
+        with attach_image(handle) as mapped:
+            assert np.array_equal(mapped, img)
+            assert not mapped.flags.writeable
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=handle[0])
+
+
+def test_worker_analysis_equals_in_process_analysis(pool, app_module):
+    img = make_plm_image(zero_hue=4, ninety_hue=58)
+    params = app_module.analysis_params({'sz_boundary': 25, 'mz_boundary': 60})
+    analysis, jpg = pool.run(analysis_worker.analyze, img, params)
+    local_analysis, local_jpg = analysis_worker.analyze(img, params)
+    for key in ('results', 'depth_profile', 'zone_boundaries', 'color_calibration', 'z1_h', 'z2_h'):
+        assert analysis[key] == local_analysis[key]
+    assert jpg == local_jpg
+
+    # Workers map the image read-only and never load the Flask app
+    pid, writeable, modules = pool.run(worker_state, img)
+    assert pid != os.getpid() and not writeable and modules == []
+    assert pool.metrics()['open_segments'] == 0 and own_segments() == []
+
+
+def test_dead_worker_resets_the_pool(pool):
+    img = np.zeros((4, 4, 3), dtype=np.uint8)
+    with pytest.raises(BrokenProcessPool):
+        pool.run(crash, img)
+    assert pool.metrics()['restarts'] == 1 and own_segments() == []
+    assert pool.run(worker_state, img)[0] != os.getpid()
+
+
+def test_stale_segments_of_dead_processes_are_removed():
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    stale = f'/dev/shm/{worker_pool.SEGMENT_PREFIX}{dead.pid}_test'
+    open(stale, 'wb').close()
+    with shared_image(np.zeros(4, dtype=np.uint8)):
+        assert worker_pool.cleanup_stale_segments() >= 1
+        assert not os.path.exists(stale)
+        assert len(own_segments()) == 1
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+import pytest
+
+from ai_model import ZoneDetector, order_centers, stratified_sample
+from conftest import data_url, png_bytes
+
+ZONES = ((0.3, 10, 200), (0.6, 40, 60), (1.0, 70, 200))  # (zone end, hue, value): bright SZ, dark MZ, green DZ
+
+
+def three_zone_slide(height=200, width=60, shift=0, seed=0):
+    rng = np.random.default_rng(seed)
+    hsv = np.zeros((height, width, 3), dtype=np.uint8)
+    start = 0
+    for end, hue, value in ZONES:
+        rows = slice(start, int(height * end))
+        hsv[rows, :, 0] = np.clip(hue + shift + rng.integers(-2, 3, (rows.stop - rows.start, width)), 0, 179)
+        hsv[rows, :, 2] = value
+        start = rows.stop
+    hsv[:, :, 1] = 200
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+@pytest.fixture(scope='module')
+def detector():
+    return ZoneDetector()
+
+
+def test_centres_are_ordered_sz_mz_dz():
+    centres = [[0.4, 0.8], [0.05, 0.9], [0.2, 0.2]]
+    assert np.allclose(order_centers(centres), [[0.05, 0.9], [0.2, 0.2], [0.4, 0.8]])
+
+
+def test_samples_are_spread_over_every_depth():
+    img = three_zone_slide()
+    samples = stratified_sample(img, 1000, strata=10)
+    assert len(samples) == 1000
+    hues = np.rint(samples[:, 0] * 180)
+    for _, hue, _ in ZONES:
+        assert (np.abs(hues - hue) <= 2).sum() >= 200
+
+
+def test_shared_model_gives_the_per_image_zones(detector):
+    images = [three_zone_slide(seed=i) for i in range(3)]
+    model = detector.fit_zone_model(images, samples_per_image=3000)
+    assert model.shape == (3, 2)
+    assert np.array_equal(model, detector.fit_zone_model(images, samples_per_image=3000))
+    assert np.rint(model[:, 0] * 180).tolist() == pytest.approx([10, 40, 70], abs=1)
+
+    _, shared = detector.detect_batch(images, zone_model=model)
+    for img, result in zip(images, shared):
+        own = detector.detect_zones_and_colors(img)
+        assert result['debug_method'] == 'Shared K-Means Model'
+        assert (result['sz_boundary'], result['mz_boundary']) == (own['sz_boundary'], own['mz_boundary']) == (30.0, 60.0)
+
+
+def test_pooled_model_through_the_routes(client):
+    images = [{'image': data_url(png_bytes(three_zone_slide(seed=i)))} for i in range(2)]
+    model = client.post('/zone_model', json={'images': images, 'samples_per_image': 2000}).get_json()['zone_model']
+    assert len(model) == 3
+
+    shared = client.post('/analyze', json={'image': images[0]['image'], 'use_ai': True,
+                                           'zone_model': model}).get_json()
+    assert shared['ai_info']['shared_model'] is True
+    assert shared['zone_boundaries']['sz_end'] == pytest.approx(0.3)
+    # A different model is a different analysis
+    own = client.post('/analyze', json={'image': images[0]['image'], 'use_ai': True}).get_json()
+    assert own['cached'] is False and own['ai_info']['shared_model'] is False